@@ -0,0 +1,382 @@
+# API HTTP headless per la pipeline di generazione
+# Montata nello stesso processo dell'interfaccia Gradio, espone ingestion,
+# ricerca, generazione del prompt e del post in JSON (con streaming SSE)
+
+import asyncio
+import hmac
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from mpd_config import Config
+from mpd_rag_system import DatabaseLocked, GenerationError
+from mpd_scheduler import SchedulerOverloaded, track_queue_time
+from mpd_tenants import TenantRegistry
+
+
+class DocumentRequest(BaseModel):
+    content: str = Field(..., min_length=1)
+    post_name: str = ""
+    document_type: str = "Post"
+    tenant: Optional[str] = None
+
+
+class DocumentUpdateRequest(BaseModel):
+    content: str = Field(..., min_length=1)
+    post_name: Optional[str] = None
+    document_type: Optional[str] = None
+    tenant: Optional[str] = None
+
+
+class BulkDeleteRequest(BaseModel):
+    # Filtro sui metadati con la sintassi where di Chroma, es. {"document_type": "Avoid Dictionary"}
+    where: Dict = Field(..., min_length=1)
+    tenant: Optional[str] = None
+
+
+class SearchRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    n_results: int = Field(Config.SIMILARITY_RESULTS, ge=1, le=50)
+    document_type: Optional[str] = None
+    tenant: Optional[str] = None
+
+
+class ProductRequest(BaseModel):
+    product_name: str = Field(..., min_length=1)
+    brand_values: str = Field(..., min_length=1)
+    product_description: str = Field(..., min_length=1)
+    perfumer_name: str = "Not specified"
+    olfactory_pyramid: str = "To be defined"
+    keywords: str = ""
+    tenant: Optional[str] = None
+
+
+class PromptRequest(ProductRequest):
+    post_destination: str = Config.POST_DESTINATIONS[0]
+
+
+class FanOutRequest(ProductRequest):
+    post_destinations: List[str] = Field(default_factory=lambda: list(Config.POST_DESTINATIONS))
+    generate_post: bool = True
+
+
+class PostRequest(BaseModel):
+    prompt: str = Field(..., min_length=1)
+    model: Optional[str] = None
+    structured: bool = False
+    tenant: Optional[str] = None
+
+
+class ConcurrencyLimiter:
+    """
+    Limita le richieste API in esecuzione; oltre il tempo massimo di attesa risponde 503
+    """
+
+    def __init__(self, max_concurrency: int = Config.API_MAX_CONCURRENCY,
+                 queue_timeout: float = Config.API_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._semaphore = None
+
+    async def acquire(self):
+        # Il semaforo va creato dentro l'event loop del server
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server busy, retry later")
+
+    def release(self):
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def _check_result(text: str) -> str:
+    """
+    I metodi del sistema RAG segnalano gli errori con testo che inizia per ❌
+    """
+    if text.startswith("❌"):
+        status_code = 503 if SchedulerOverloaded.MARKER in text else 502
+        raise HTTPException(status_code=status_code, detail=text)
+    return text
+
+
+def require_api_key(x_api_key: Optional[str] = Header(None)):
+    """
+    Le route che modificano o eliminano documenti richiedono Config.API_KEY
+    (senza chiave sono esposte solo con API_ALLOW_UNAUTHENTICATED)
+    """
+    if not Config.API_KEY:
+        return
+    if not x_api_key or not hmac.compare_digest(x_api_key.encode('utf-8'), Config.API_KEY.encode('utf-8')):
+        raise HTTPException(status_code=401, detail="❌ Missing or invalid API key",
+                            headers={"WWW-Authenticate": "X-API-Key"})
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_api(tenants: TenantRegistry, limiter: ConcurrencyLimiter = None) -> FastAPI:
+    """
+    Crea l'applicazione FastAPI con le route della pipeline sotto Config.API_PREFIX
+    """
+    limiter = limiter or ConcurrencyLimiter()
+    app = FastAPI(title="Moellhausen Prompt Designer API", docs_url=f"{Config.API_PREFIX}/docs",
+                  openapi_url=f"{Config.API_PREFIX}/openapi.json", redoc_url=None)
+    router = APIRouter(prefix=Config.API_PREFIX)
+
+    @app.middleware("http")
+    async def request_id_middleware(request: Request, call_next):
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        request.state.request_id = request_id
+        started = time.perf_counter()
+        with track_queue_time() as queue_waits:
+            response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        if request.url.path.startswith(Config.API_PREFIX):
+            # Tempo trascorso nella coda dello scheduler LLM (non disponibile per le risposte in streaming)
+            queue_ms = sum(queue_waits) * 1000
+            response.headers["X-Queue-Time-Ms"] = f"{queue_ms:.0f}"
+            print(f"🔌 [{request_id}] {request.method} {request.url.path} -> {response.status_code} "
+                  f"({(time.perf_counter() - started) * 1000:.0f} ms, queue {queue_ms:.0f} ms)")
+        return response
+
+    @app.exception_handler(SchedulerOverloaded)
+    async def overloaded_handler(request: Request, exc: SchedulerOverloaded):
+        return JSONResponse(status_code=503, content={"detail": str(exc)},
+                            headers={"Retry-After": "5"})
+
+    async def acquire(tenant: Optional[str], header_tenant: Optional[str]):
+        """
+        Prende in prestito il sistema RAG del tenant: va restituito con release(tenant_id).
+        L'attivazione di un tenant apre la collection, quindi avviene fuori dall'event loop.
+        """
+        tenant_id = tenant or header_tenant or None
+        try:
+            return tenant_id, await run_in_threadpool(tenants.acquire, tenant_id)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e.args[0]))
+        except DatabaseLocked as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    async def release(tenant_id: Optional[str]):
+        # Il rilascio può chiudere un tenant in eccesso rispetto al limite
+        await run_in_threadpool(tenants.release, tenant_id)
+
+    @asynccontextmanager
+    async def leased(tenant: Optional[str], header_tenant: Optional[str]):
+        # Il tenant resta in uso (e non può essere rimosso dalla cache) fino alla fine della richiesta
+        tenant_id, rag = await acquire(tenant, header_tenant)
+        try:
+            yield rag
+        finally:
+            await release(tenant_id)
+
+    @router.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @router.get("/tenants")
+    async def list_tenants():
+        return {"default": tenants.default_tenant_id,
+                "tenants": [{"tenant_id": tenant_id, "label": label} for label, tenant_id in tenants.choices()]}
+
+    @router.get("/scheduler")
+    async def scheduler_stats(tenant: Optional[str] = None, x_tenant_id: Optional[str] = Header(None)):
+        async with leased(tenant, x_tenant_id) as rag:
+            return rag.scheduler.stats()
+
+    @router.get("/stats")
+    async def stats(request: Request, tenant: Optional[str] = None,
+                    x_tenant_id: Optional[str] = Header(None)):
+        async with leased(tenant, x_tenant_id) as rag:
+            count = await run_in_threadpool(rag.count_documents)
+            return {"request_id": request.state.request_id, "tenant": rag.collection_name, "documents": count,
+                    "prompt_eval": rag.prompt_eval_stats()}
+
+    @router.post("/documents")
+    async def add_document(body: DocumentRequest, request: Request,
+                           x_tenant_id: Optional[str] = Header(None)):
+        async with leased(body.tenant, x_tenant_id) as rag:
+            async with limiter.slot():
+                result = await run_in_threadpool(rag.add_post_to_database, body.content,
+                                                 body.post_name or f"Post_{len(body.content) // 100}",
+                                                 body.document_type)
+            return {"request_id": request.state.request_id, "result": _check_result(result)}
+
+    @router.get("/documents")
+    async def list_documents(request: Request, document_type: Optional[str] = None, tenant: Optional[str] = None,
+                             x_tenant_id: Optional[str] = Header(None)):
+        async with leased(tenant, x_tenant_id) as rag:
+            async with limiter.slot():
+                documents = await run_in_threadpool(rag.list_documents, document_type)
+            return {"request_id": request.state.request_id, "documents": documents}
+
+    @router.get("/documents/{doc_id}")
+    async def get_document(doc_id: str, request: Request, tenant: Optional[str] = None,
+                           x_tenant_id: Optional[str] = Header(None)):
+        async with leased(tenant, x_tenant_id) as rag:
+            async with limiter.slot():
+                document = await run_in_threadpool(rag.get_document, doc_id)
+            if document is None:
+                raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+            return {"request_id": request.state.request_id, **document}
+
+    # Senza API_KEY le route che modificano o eliminano documenti non vengono esposte:
+    # l'interfaccia è in ascolto su tutte le interfacce di rete
+    if Config.API_KEY or Config.API_ALLOW_UNAUTHENTICATED:
+        @router.put("/documents/{doc_id}", dependencies=[Depends(require_api_key)])
+        async def update_document(doc_id: str, body: DocumentUpdateRequest, request: Request,
+                                  x_tenant_id: Optional[str] = Header(None)):
+            async with leased(body.tenant, x_tenant_id) as rag:
+                async with limiter.slot():
+                    if await run_in_threadpool(rag.get_document, doc_id) is None:
+                        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+                    result = await run_in_threadpool(rag.update_post, doc_id, body.content, body.post_name,
+                                                     body.document_type)
+                return {"request_id": request.state.request_id, "result": _check_result(result)}
+
+        @router.delete("/documents/{doc_id}", dependencies=[Depends(require_api_key)])
+        async def delete_document(doc_id: str, request: Request, tenant: Optional[str] = None,
+                                  x_tenant_id: Optional[str] = Header(None)):
+            async with leased(tenant, x_tenant_id) as rag:
+                async with limiter.slot():
+                    if await run_in_threadpool(rag.get_document, doc_id) is None:
+                        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+                    result = await run_in_threadpool(rag.delete_posts, [doc_id])
+                return {"request_id": request.state.request_id, "result": _check_result(result)}
+
+        @router.post("/documents/delete", dependencies=[Depends(require_api_key)])
+        async def bulk_delete_documents(body: BulkDeleteRequest, request: Request,
+                                        x_tenant_id: Optional[str] = Header(None)):
+            async with leased(body.tenant, x_tenant_id) as rag:
+                async with limiter.slot():
+                    result = await run_in_threadpool(rag.delete_posts_by_metadata, body.where)
+                if result.startswith("❌ No documents"):
+                    raise HTTPException(status_code=404, detail=result)
+                return {"request_id": request.state.request_id, "result": _check_result(result)}
+
+        @router.post("/maintenance/compact", dependencies=[Depends(require_api_key)])
+        async def compact(request: Request, tenant: Optional[str] = None,
+                          x_tenant_id: Optional[str] = Header(None)):
+            async with leased(tenant, x_tenant_id) as rag:
+                async with limiter.slot():
+                    report = await run_in_threadpool(rag.compact_collection)
+                return {"request_id": request.state.request_id, **report}
+    else:
+        print("⚠️ API_KEY is not set: document update, delete and compaction routes are disabled "
+              "(set API_KEY, or API_ALLOW_UNAUTHENTICATED=true on a trusted network)")
+
+    @router.post("/search")
+    async def search(body: SearchRequest, request: Request, x_tenant_id: Optional[str] = Header(None)):
+        async with leased(body.tenant, x_tenant_id) as rag:
+            restrictions = {"document_type": body.document_type} if body.document_type else None
+            async with limiter.slot():
+                results = await run_in_threadpool(rag.get_similar_posts, body.query, body.n_results, restrictions)
+            return {"request_id": request.state.request_id, "results": results}
+
+    @router.post("/prompts")
+    async def generate_prompt(body: PromptRequest, request: Request, x_tenant_id: Optional[str] = Header(None)):
+        async with leased(body.tenant, x_tenant_id) as rag:
+
+            def run():
+                context = rag.prepare_generation_context(body.product_name, body.brand_values, body.product_description,
+                                                         olfactory_pyramid=body.olfactory_pyramid,
+                                                         perfumer_name=body.perfumer_name)
+                return rag.generate_prompt_from_context(context,
+                                                        product_name=body.product_name,
+                                                        perfumer_name=body.perfumer_name,
+                                                        brand_values=body.brand_values,
+                                                        product_description=body.product_description,
+                                                        olfactory_pyramid=body.olfactory_pyramid,
+                                                        keywords=body.keywords,
+                                                        post_destination=body.post_destination)
+
+            async with limiter.slot():
+                try:
+                    prompt, template_version = await run_in_threadpool(run)
+                except GenerationError as e:
+                    raise HTTPException(status_code=409, detail=str(e))
+            return {"request_id": request.state.request_id, "prompt": _check_result(prompt),
+                    "template_version": template_version}
+
+    @router.post("/prompts/stream")
+    async def generate_for_destinations(body: FanOutRequest, request: Request,
+                                        x_tenant_id: Optional[str] = Header(None)):
+        request_id = request.state.request_id
+
+        # Slot e tenant vengono presi prima di iniziare lo stream, così l'eventuale 503/404 arriva
+        # come risposta HTTP; entrambi restano occupati fino alla fine dello stream
+        await limiter.acquire()
+        try:
+            tenant_id, rag = await acquire(body.tenant, x_tenant_id)
+        except HTTPException:
+            limiter.release()
+            raise
+        released = False
+
+        async def release_once():
+            nonlocal released
+            if not released:
+                released = True
+                limiter.release()
+                await release(tenant_id)
+
+        async def events():
+            try:
+                yield _sse("start", {"request_id": request_id, "destinations": body.post_destinations})
+                generator = rag.generate_for_destinations(
+                    product_name=body.product_name,
+                    perfumer_name=body.perfumer_name,
+                    brand_values=body.brand_values,
+                    product_description=body.product_description,
+                    olfactory_pyramid=body.olfactory_pyramid,
+                    keywords=body.keywords,
+                    post_destinations=body.post_destinations,
+                    generate_post=body.generate_post)
+                async for event in iterate_in_threadpool(generator):
+                    yield _sse(event['stage'], {"request_id": request_id, **event})
+                yield _sse("done", {"request_id": request_id})
+            finally:
+                await release_once()
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                                 background=BackgroundTask(release_once))
+
+    @router.post("/posts")
+    async def generate_post(body: PostRequest, request: Request, x_tenant_id: Optional[str] = Header(None)):
+        async with leased(body.tenant, x_tenant_id) as rag:
+            async with limiter.slot():
+                if body.structured:
+                    try:
+                        result = await run_in_threadpool(rag.get_structured_post, body.prompt, body.model)
+                    except SchedulerOverloaded:
+                        raise
+                    except Exception as e:
+                        raise HTTPException(status_code=502, detail=f"❌ Error in retrieving post: {str(e)}")
+                    return {"request_id": request.state.request_id, "post": result['text'],
+                            "sections": result['sections'], "errors": result['errors'],
+                            "regenerated": result['regenerated'], "attempts": result['attempts']}
+                post = await run_in_threadpool(rag.get_post_from_llm, body.prompt, body.model)
+            return {"request_id": request.state.request_id, "post": _check_result(post)}
+
+    app.include_router(router)
+    return app
@@ -15,12 +15,48 @@ class Config:
     # Modello per l'embedding dei documenti
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "toshk0/nomic-embed-text-v2-moe:Q6_K")
 
+    # Micro-batching degli embedding: finestra di raccolta (ms), dimensione massima del batch
+    # e numero di chiamate batch contemporanee verso Ollama
+    EMBED_BATCHING = os.getenv("EMBED_BATCHING", "true").lower() == "true"
+    EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+    EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "32"))
+    EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "2"))
+
     # Modello per l'analisi
     ANALYSIS_MODEL = os.getenv("ANALYSIS_MODEL", "deepseek-v3.1:671b-cloud")
 
     # Modello per la generazione del post
     POST_MODEL = os.getenv("POST_MODEL", "deepseek-v3.1:671b-cloud")
 
+    # Output strutturato del post: numero massimo di rigenerazioni delle sole sezioni non valide
+    STRUCTURED_POST_MAX_RETRIES = int(os.getenv("STRUCTURED_POST_MAX_RETRIES", "2"))
+
+    # === SCHEDULER CHIAMATE LLM ===
+    # Numero massimo di chiamate contemporanee verso l'host Ollama
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+    # Limiti per singola operazione (operazione=limite, separati da virgola)
+    LLM_OPERATION_LIMITS = os.getenv("LLM_OPERATION_LIMITS", "analysis=2,prompt=2,post=2,warmup=1")
+
+    # Profondità massima della coda oltre la quale le richieste di ciascuna classe vengono rifiutate
+    LLM_QUEUE_DEPTH_INTERACTIVE = int(os.getenv("LLM_QUEUE_DEPTH_INTERACTIVE", "32"))
+    LLM_QUEUE_DEPTH_BATCH = int(os.getenv("LLM_QUEUE_DEPTH_BATCH", "16"))
+    LLM_QUEUE_DEPTH_BACKGROUND = int(os.getenv("LLM_QUEUE_DEPTH_BACKGROUND", "4"))
+
+    # Secondi di attesa massima in coda prima di rinunciare (0 = nessun limite)
+    LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", "120"))
+
+    # === RIUTILIZZO DEL PREFISSO DEI PROMPT ===
+    # Invia la parte fissa dei template come system prompt (false = prompt unico, come in passato)
+    PROMPT_PREFIX_REUSE = os.getenv("PROMPT_PREFIX_REUSE", "true").lower() == "true"
+
+    # Valuta in anticipo la parte fissa dei template all'attivazione di ogni tenant dell'applicazione,
+    # con priorità background (mai negli strumenti CLI)
+    PROMPT_PREFIX_WARMUP = os.getenv("PROMPT_PREFIX_WARMUP", "true").lower() == "true"
+
+    # Per quanto tempo Ollama mantiene il modello (e la cache del prefisso) in memoria dopo una richiesta
+    OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
     # === CONFIGURAZIONE CHROMADB ===
     # Path del database ChromaDB
     CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
@@ -28,6 +64,57 @@ class Config:
     # Nome della collection
     COLLECTION_NAME = os.getenv("COLLECTION_NAME", "moellhausen_posts")
 
+    # Numero di record letti/scritti per blocco durante export e import degli snapshot
+    SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "500"))
+
+    # === INGESTION IN BACKGROUND ===
+    # Il caricamento dall'interfaccia accoda un job invece di indicizzare subito (false = sincrono, come in passato)
+    INGEST_BACKGROUND = os.getenv("INGEST_BACKGROUND", "true").lower() == "true"
+
+    # Database SQLite della coda dei job e dello stato dei file già indicizzati (persistente tra i riavvii)
+    INGEST_QUEUE_DB = os.getenv("INGEST_QUEUE_DB", "./ingestion_queue.sqlite3")
+
+    # Numero di thread che elaborano i job
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+
+    # Tentativi massimi per job prima di segnarlo come fallito
+    INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+    # Giorni dopo i quali i job completati o falliti vengono eliminati dalla coda
+    INGEST_JOB_RETENTION_DAYS = float(os.getenv("INGEST_JOB_RETENTION_DAYS", "7"))
+
+    # Cartella osservata: i file nuovi o modificati vengono indicizzati automaticamente ("" = disattivata).
+    # I file nella radice vanno al tenant di default, quelli in una sottocartella <tenant_id> al relativo tenant
+    INGEST_DROP_FOLDER = os.getenv("INGEST_DROP_FOLDER", "")
+
+    # Estensioni dei file considerati nella cartella osservata (separate da virgola)
+    INGEST_EXTENSIONS = os.getenv("INGEST_EXTENSIONS", ".txt,.md")
+
+    # Tipo assegnato ai documenti della cartella osservata
+    INGEST_DOCUMENT_TYPE = os.getenv("INGEST_DOCUMENT_TYPE", "Post")
+
+    # Secondi tra due scansioni della cartella (anche con il watcher attivo, come rete di sicurezza)
+    INGEST_SCAN_INTERVAL = float(os.getenv("INGEST_SCAN_INTERVAL", "30"))
+
+    # Secondi senza modifiche dopo i quali un file è considerato completo (evita file ancora in copia)
+    INGEST_SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", "2"))
+
+    # Intervallo (secondi) di aggiornamento dell'avanzamento nella tab di caricamento
+    INGEST_PROGRESS_REFRESH = float(os.getenv("INGEST_PROGRESS_REFRESH", "2"))
+
+    # === CONFIGURAZIONE TENANT ===
+    # File JSON con i tenant (brand / linee di prodotto). Se assente viene usato solo il tenant di default
+    TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+
+    # Tenant selezionato di default nell'interfaccia e nelle API
+    DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "moellhausen")
+
+    # Secondi di inattività dopo i quali un tenant viene rilasciato dalla memoria (0 = mai)
+    TENANT_IDLE_TIMEOUT = float(os.getenv("TENANT_IDLE_TIMEOUT", "1800"))
+
+    # Numero massimo di tenant attivi contemporaneamente
+    MAX_ACTIVE_TENANTS = int(os.getenv("MAX_ACTIVE_TENANTS", "4"))
+
     # === CONFIGURAZIONE GRADIO ===
     # Porta per l'interfaccia web
     GRADIO_PORT = int(os.getenv("GRADIO_PORT", "7860"))
@@ -35,13 +122,70 @@ class Config:
     # Condivisione pubblica (True per tunnel pubblico)
     GRADIO_SHARE = os.getenv("GRADIO_SHARE", "false").lower() == "true"
 
+    # Eventi Gradio eseguiti contemporaneamente per ciascun handler (1 = default di Gradio)
+    GRADIO_CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "1"))
+
+    # Lunghezza massima della coda Gradio oltre la quale le richieste vengono rifiutate (0 = illimitata)
+    GRADIO_MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "0"))
+
+    # === CONFIGURAZIONE API HTTP ===
+    # Abilita l'API JSON nello stesso processo dell'interfaccia Gradio
+    API_ENABLED = os.getenv("API_ENABLED", "true").lower() == "true"
+
+    # Prefisso delle route dell'API
+    API_PREFIX = os.getenv("API_PREFIX", "/api/v1")
+
+    # Numero massimo di richieste API eseguite contemporaneamente
+    API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "8"))
+
+    # Secondi di attesa massima per uno slot libero prima di rispondere 503
+    API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "30"))
+
+    # Chiave richiesta (header X-API-Key) da modifica, eliminazione e compattazione dei documenti
+    # Vuota = queste route non vengono esposte (salvo API_ALLOW_UNAUTHENTICATED)
+    API_KEY = os.getenv("API_KEY", "")
+
+    # Espone modifica, eliminazione e compattazione anche senza API_KEY (solo per reti fidate)
+    API_ALLOW_UNAUTHENTICATED = os.getenv("API_ALLOW_UNAUTHENTICATED", "false").lower() == "true"
+
     # === CONFIGURAZIONE RAG ===
     # Numero di post simili da recuperare per l'analisi
     SIMILARITY_RESULTS = int(os.getenv("SIMILARITY_RESULTS", "3"))
 
+    # Pre-filtro dei candidati tramite l'indice strutturato (note olfattive, profumiere, tag)
+    STRUCTURED_PREFILTER = os.getenv("STRUCTURED_PREFILTER", "true").lower() == "true"
+
+    # Numero massimo di candidati passati alla ricerca vettoriale dopo il pre-filtro
+    PREFILTER_MAX_CANDIDATES = int(os.getenv("PREFILTER_MAX_CANDIDATES", "50"))
+
+    # Bonus di similarità massimo per i post che condividono campi strutturati con il prodotto
+    STRUCTURED_BOOST = float(os.getenv("STRUCTURED_BOOST", "0.1"))
+
+    # Secondi entro cui le modifiche all'indice strutturato vengono scritte su disco, tutte insieme
+    # (0 = a ogni modifica). Dopo un crash l'indice viene ricostruito all'avvio se il numero di documenti
+    # non coincide con la collection; rebuild_metadata_index() lo riallinea in ogni caso.
+    METADATA_INDEX_FLUSH_DELAY = float(os.getenv("METADATA_INDEX_FLUSH_DELAY", "2"))
+
     # Temperatura per la generazione (0.0 = deterministica, 1.0 = creativa)
     GENERATION_TEMPERATURE = float(os.getenv("GENERATION_TEMPERATURE", "0.4"))
 
+    # === CONFIGURAZIONE DESTINAZIONI ===
+    # Destinazioni disponibili per i post
+    POST_DESTINATIONS = ["Instagram", "Linkedin", "Facebook"]
+
+    # Numero massimo di generazioni parallele nella modalità multi-destinazione
+    FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "3"))
+
+    # === CONFRONTO MODELLI ===
+    # Modelli proposti di default nella tab di confronto (separati da virgola)
+    COMPARISON_MODELS = os.getenv("COMPARISON_MODELS", "")
+
+    # Numero massimo di modelli eseguiti in parallelo
+    COMPARISON_MAX_WORKERS = int(os.getenv("COMPARISON_MAX_WORKERS", "4"))
+
+    # Directory in cui salvare i report JSON del confronto
+    COMPARISON_REPORT_DIR = os.getenv("COMPARISON_REPORT_DIR", "./reports")
+
     # === LIMITI E VALIDAZIONE ===
     # Lunghezza minima del contenuto del post (caratteri)
     MIN_POST_LENGTH = int(os.getenv("MIN_POST_LENGTH", "100"))
@@ -52,6 +196,15 @@ class Config:
     ANALYSIS_PROMPT_FILE = os.getenv("ANALYSIS_PROMPT_FILE", "analysis_prompt.txt")
     GENERATION_PROMPT_FILE = os.getenv("GENERATION_PROMPT_FILE", "system_prompt.txt")
 
+    # Intervallo minimo (secondi) tra due controlli di modifica dei template, se il watcher non è disponibile
+    PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))
+
+    # Directory (relativa ai template) in cui archiviare le versioni precedenti dei prompt
+    PROMPT_HISTORY_DIR = os.getenv("PROMPT_HISTORY_DIR", ".prompt_history")
+
+    # Numero di generazioni recenti conservate in memoria con le versioni dei template usate
+    GENERATION_LOG_SIZE = int(os.getenv("GENERATION_LOG_SIZE", "200"))
+
     PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY", "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")
 
 
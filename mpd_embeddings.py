@@ -0,0 +1,142 @@
+# Micro-batching delle richieste di embedding
+# Le richieste che arrivano entro una breve finestra vengono unite in una sola
+# chiamata batch al modello di embedding e ogni vettore torna al chiamante originale
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from mpd_config import Config
+
+
+class BatchingEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Embedding function Chroma che raggruppa le richieste concorrenti.
+    Serve solo per gli embedding calcolati dall'applicazione: la collection usa la funzione
+    interna, così la configurazione persistita resta quella del modello Ollama.
+    """
+
+    def __init__(self,
+                 inner: EmbeddingFunction,
+                 window_ms: float = Config.EMBED_BATCH_WINDOW_MS,
+                 max_batch_size: int = Config.EMBED_MAX_BATCH_SIZE,
+                 max_in_flight: int = Config.EMBED_MAX_IN_FLIGHT):
+        self._inner = inner
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._workers: List[threading.Thread] = []
+        self._workers_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stats = {'requests': 0, 'texts': 0, 'upstream_calls': 0, 'deduplicated': 0}
+        self._stats_lock = threading.Lock()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        if not texts:
+            return []
+
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['texts'] += len(texts)
+
+        # I batch già grandi (es. ingestion massiva) non hanno bisogno di attendere
+        if len(texts) >= self.max_batch_size or self._stop_event.is_set():
+            return self._embed(texts)
+
+        self._ensure_workers()
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def embed_query(self, input: Documents) -> Embeddings:
+        return self.__call__(input)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['avg_texts_per_call'] = round(stats['texts'] / stats['upstream_calls'], 2) \
+            if stats['upstream_calls'] else None
+        return stats
+
+    def close(self):
+        self._stop_event.set()
+        # Le richieste ancora in coda vengono servite direttamente
+        while True:
+            try:
+                texts, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                future.set_result(self._embed(texts))
+            except Exception as e:
+                future.set_exception(e)
+
+    @property
+    def inner(self) -> EmbeddingFunction:
+        return self._inner
+
+    # --- Worker ---
+
+    def _embed(self, texts: List[str]) -> Embeddings:
+        with self._stats_lock:
+            self._stats['upstream_calls'] += 1
+        return self._inner(texts)
+
+    def _ensure_workers(self):
+        with self._workers_lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < self.max_in_flight:
+                worker = threading.Thread(target=self._worker_loop, name="embedding-batcher", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _collect_batch(self) -> List[Tuple[List[str], Future]]:
+        first = self._queue.get(timeout=1)
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.window
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+
+        return batch
+
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                batch = self._collect_batch()
+            except queue.Empty:
+                continue
+
+            # Testi identici nello stesso batch vengono calcolati una volta sola
+            unique_texts = list(dict.fromkeys(text for texts, _ in batch for text in texts))
+            total_texts = sum(len(texts) for texts, _ in batch)
+
+            try:
+                vectors = self._embed(unique_texts)
+                by_text = dict(zip(unique_texts, vectors))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self._stats['deduplicated'] += total_texts - len(unique_texts)
+
+            for texts, future in batch:
+                future.set_result([by_text[text] for text in texts])
@@ -1,11 +1,17 @@
 # Interfaccia Gradio per il Sistema RAG Instagram Prompt Generator
 # Due pagine: 1) Caricamento Documenti  2) Generazione Prompt
 
+import functools
+
 import gradio as gr
 from tomlkit import document
 
-from mpd_rag_system import InstagramPromptGenerator
+from mpd_rag_system import GenerationError, InstagramPromptGenerator
+from mpd_model_comparison import ModelComparisonRunner, TABLE_HEADERS, parse_models, report_rows, report_markdown
 from mpd_config import Config
+from mpd_ingestion import IngestionWorker
+from mpd_templates import TemplateError
+from mpd_tenants import TenantRegistry, load_tenants
 
 import  mpd_support_functions as support
 
@@ -14,16 +20,31 @@ class GradioInterface:
     Interfaccia utente Gradio per il sistema RAG Instagram
     """
 
-    def __init__(self, ollama_host=Config.OLLAMA_HOST):
-        self.rag_system = InstagramPromptGenerator(
-            chroma_path=Config.CHROMA_DB_PATH,
-            collection_name=Config.COLLECTION_NAME,
-            embedding_model=Config.EMBEDDING_MODEL,
-            analysis_model=Config.ANALYSIS_MODEL,
-            ollama_host=ollama_host,
-        )
+    def __init__(self, ollama_host=Config.OLLAMA_HOST, tenants: TenantRegistry = None,
+                 ingestion: IngestionWorker = None):
+        # Nell'applicazione ogni tenant, quando viene attivato, fa valutare in anticipo i prefissi dei template
+        self.tenants = tenants or TenantRegistry(load_tenants(Config.TENANTS_FILE, ollama_host=ollama_host),
+                                                 factory=functools.partial(InstagramPromptGenerator,
+                                                                           warm_prefixes=True),
+                                                 default_tenant_id=Config.DEFAULT_TENANT)
+
+        # Worker di ingestion in background (caricamenti dall'interfaccia e cartella osservata)
+        self.ingestion = ingestion
+        if self.ingestion is None and (Config.INGEST_BACKGROUND or Config.INGEST_DROP_FOLDER):
+            self.ingestion = IngestionWorker(self.tenants).start()
+
+    def rag_for(self, tenant_id):
+        """
+        Sistema RAG del tenant, in prestito per la durata del blocco with (non viene rilasciato mentre è in uso)
+        """
+        return self.tenants.lease(tenant_id or None)
+
+    def collection_stats(self, tenant_id):
+        with self.rag_for(tenant_id) as rag_system:
+            return rag_system.get_collection_stats()
 
-        self.system_prompt_path = Config.GENERATION_PROMPT_FILE
+    def on_tenant_change(self, tenant_id):
+        return self.collection_stats(tenant_id)
 
     def process_uploaded_file(self, file, post_name):
         """
@@ -52,22 +73,120 @@ class GradioInterface:
         except Exception as e:
             return f"❌ Errore loading file: {str(e)}", ""
 
-    def add_document_to_db(self, content, post_name, document_type):
+    def add_document_to_db(self, tenant_id, content, post_name, document_type):
         """
         Aggiunge un documento al database ChromaDB
         """
         if not content.strip():
-            return "❌ Empty file - Type or load an Instagram post", self.rag_system.get_collection_stats()
+            return "❌ Empty file - Type or load an Instagram post", self.collection_stats(tenant_id)
 
         if not post_name.strip():
             post_name = f"Post_{len(content)//100}"
 
-        result = self.rag_system.add_post_to_database(content, post_name, document_type)
-        stats = self.rag_system.get_collection_stats()
+        if self.ingestion is not None and Config.INGEST_BACKGROUND:
+            # L'indicizzazione avviene nel worker: l'avanzamento è mostrato sotto
+            job_id = self.ingestion.submit(tenant_id, content, post_name, document_type)
+            return f"⏳ '{post_name}' queued for indexing (job {job_id})", self.collection_stats(tenant_id)
+
+        with self.rag_for(tenant_id) as rag_system:
+            result = rag_system.add_post_to_database(content, post_name, document_type)
+            stats = rag_system.get_collection_stats()
 
         return result, stats
 
-    def generate_prompt(self, product_name, perfumer_name, brand_values, 
+    def ingestion_progress(self, tenant_id, last_done):
+        """
+        Avanzamento dei job di ingestion; le statistiche vengono ricalcolate solo quando un job termina
+        """
+        progress = self.ingestion.progress(tenant_id)
+        counts = progress['counts']
+        lines = [f"⏳ {counts['queued']} queued · ⚙️ {counts['running']} running · "
+                 f"✅ {counts['done']} done · ❌ {counts['failed']} failed"]
+        if self.ingestion.drop_folder:
+            lines.append(f"📂 Drop folder: {self.ingestion.drop_folder}")
+        icons = {'queued': '⏳', 'running': '⚙️', 'done': '✅', 'failed': '❌'}
+        for job in progress['recent']:
+            label = job['post_name'] or job['path'] or ''
+            source = "drop folder" if job['source'] == "folder" else "upload"
+            detail = f" - {job['result'][:120]}" if job['result'] and job['status'] != 'done' else ""
+            lines.append(f"{icons.get(job['status'], '•')} #{job['id']} {label} ({source}){detail}")
+
+        finished = counts['done'] + counts['failed']
+        if finished == last_done:
+            return "\n".join(lines), gr.update(), last_done
+        return "\n".join(lines), self.collection_stats(tenant_id), finished
+
+    def refresh_documents(self, tenant_id):
+        """
+        Aggiorna l'elenco dei documenti selezionabili per modifica ed eliminazione
+        """
+        with self.rag_for(tenant_id) as rag_system:
+            documents = rag_system.list_documents()
+        choices = [(f"{document['title'][:60]} · {document['document_type'] or '-'} ({document['id']})",
+                    document['id']) for document in documents]
+        return gr.update(choices=choices, value=[])
+
+    def load_document(self, tenant_id, document_ids):
+        """
+        Carica nell'editor il documento selezionato, per modificarlo e sostituirlo
+        """
+        if not document_ids or len(document_ids) != 1:
+            return "❌ Select exactly one document to load", gr.update(), gr.update(), gr.update()
+
+        with self.rag_for(tenant_id) as rag_system:
+            document = rag_system.get_document(document_ids[0])
+        if document is None:
+            return f"❌ Document not found: {document_ids[0]}", gr.update(), gr.update(), gr.update()
+
+        metadata = document['metadata']
+        return (f"📝 Loaded {document['id']}: edit the content and click “Replace selected”",
+                document['document'], metadata.get('post_name', ''), metadata.get('document_type') or None)
+
+    def update_document(self, tenant_id, document_ids, content, post_name, document_type):
+        with self.rag_for(tenant_id) as rag_system:
+            if not document_ids or len(document_ids) != 1:
+                result = "❌ Select exactly one document to replace"
+            elif not content.strip():
+                result = "❌ Empty content - Type or load the new version of the document"
+            else:
+                result = rag_system.update_post(document_ids[0], content, post_name.strip() or None,
+                                                document_type or None)
+            return result, rag_system.get_collection_stats(), self.refresh_documents(tenant_id)
+
+    def delete_documents(self, tenant_id, document_ids):
+        with self.rag_for(tenant_id) as rag_system:
+            result = rag_system.delete_posts(document_ids or [])
+            return result, rag_system.get_collection_stats(), self.refresh_documents(tenant_id)
+
+    def bulk_delete_documents(self, tenant_id, document_type, post_name):
+        """
+        Elimina tutti i documenti con il tipo e/o il nome indicati
+        """
+        conditions = []
+        if document_type:
+            conditions.append({"document_type": document_type})
+        if post_name and post_name.strip():
+            conditions.append({"post_name": post_name.strip()})
+
+        with self.rag_for(tenant_id) as rag_system:
+            if not conditions:
+                result = "❌ Choose a document type and/or a post name to delete"
+            else:
+                where = conditions[0] if len(conditions) == 1 else {"$and": conditions}
+                result = rag_system.delete_posts_by_metadata(where)
+            return result, rag_system.get_collection_stats(), self.refresh_documents(tenant_id)
+
+    def compact_database(self, tenant_id):
+        with self.rag_for(tenant_id) as rag_system:
+            try:
+                report = rag_system.compact_collection()
+                result = (f"✅ Compacted {report['documents']} documents in {report['duration_s']}s: "
+                          f"{report['size_before_mb']} MB → {report['size_after_mb']} MB")
+            except Exception as e:
+                result = f"❌ Error compacting database: {str(e)}"
+            return result, rag_system.get_collection_stats()
+
+    def generate_prompt(self, tenant_id, product_name, perfumer_name, brand_values, 
                        product_description, olfactory_pyramid, keywords, post_destination):
         """
         Genera il prompt ottimizzato per LLM commerciale
@@ -77,40 +196,161 @@ class GradioInterface:
             return "❌ **Error:** Product Name, Brand Values and Description are mandatory"
 
         # Genera il prompt ottimizzato
-        result = self.rag_system.generate_optimized_prompt(
-            product_name=product_name,
-            perfumer_name=perfumer_name or "Not specified",
-            brand_values=brand_values,
-            product_description=product_description,
-            olfactory_pyramid=olfactory_pyramid or "To be defined",
-            keywords=keywords or "",
-            post_destination=post_destination
-        )
+        with self.rag_for(tenant_id) as rag_system:
+            result = rag_system.generate_optimized_prompt(
+                product_name=product_name,
+                perfumer_name=perfumer_name or "Not specified",
+                brand_values=brand_values,
+                product_description=product_description,
+                olfactory_pyramid=olfactory_pyramid or "To be defined",
+                keywords=keywords or "",
+                post_destination=post_destination
+            )
 
         return result
 
-    def get_post_from_llm(self, prompt):
+    def generate_for_destinations(self, tenant_id, product_name, perfumer_name, brand_values,
+                                  product_description, olfactory_pyramid, keywords, post_destinations):
+        """
+        Genera prompt e post per tutte le destinazioni selezionate,
+        aggiornando l'interfaccia man mano che ogni destinazione è pronta
+        """
+        destinations = Config.POST_DESTINATIONS
+        outputs = {destination: {'prompt': "", 'post': ""} for destination in destinations}
+
+        def flatten():
+            return tuple(value for destination in destinations
+                         for value in (outputs[destination]['prompt'], outputs[destination]['post']))
+
+        if not post_destinations:
+            outputs[destinations[0]]['prompt'] = "❌ **Error:** Select at least one destination"
+            yield flatten()
+            return
 
+        if not all([product_name.strip(), brand_values.strip(), product_description.strip()]):
+            for destination in post_destinations:
+                outputs[destination]['prompt'] = "❌ **Error:** Product Name, Brand Values and Description are mandatory"
+            yield flatten()
+            return
+
+        for destination in post_destinations:
+            outputs[destination]['prompt'] = "⏳ Generating..."
+        yield flatten()
+
+        # Il prestito dura fino alla fine dello stream (o alla sua chiusura da parte di Gradio)
+        with self.rag_for(tenant_id) as rag_system:
+            events = rag_system.generate_for_destinations(
+                product_name=product_name,
+                perfumer_name=perfumer_name or "Not specified",
+                brand_values=brand_values,
+                product_description=product_description,
+                olfactory_pyramid=olfactory_pyramid or "To be defined",
+                keywords=keywords or "",
+                post_destinations=post_destinations
+            )
+
+            for event in events:
+                destination = event['destination']
+                if event['stage'] == 'post':
+                    outputs[destination]['post'] = event['text']
+                else:
+                    outputs[destination]['prompt'] = event['text']
+                    if event['stage'] == 'prompt' and not event['text'].startswith("❌"):
+                        outputs[destination]['post'] = "⏳ Generating..."
+                yield flatten()
+
+    def get_post_from_llm(self, tenant_id, prompt, structured=False):
+        """
+        Genera il post; in modalità strutturata mostra la validazione delle sezioni man mano
+        """
         if not all([prompt.strip()]):
-            return "❌ **Error:** Please get a valid prompt first"
+            yield "❌ **Error:** Please get a valid prompt first", ""
+            return
 
-        result = self.rag_system.get_post_from_llm(prompt=prompt)
+        if not structured:
+            with self.rag_for(tenant_id) as rag_system:
+                post = rag_system.get_post_from_llm(prompt=prompt)
+            yield post, ""
+            return
 
-        return result
+        progress = []
+        try:
+            with self.rag_for(tenant_id) as rag_system:
+                for event in rag_system.stream_structured_post(prompt):
+                    if event['stage'] == 'section':
+                        progress.append(f"❌ {event['section']}: {event['error']}" if event['error']
+                                        else f"✅ {event['section']}")
+                        yield "⏳ Generating...", "\n".join(progress)
+                    elif event['stage'] == 'retry':
+                        progress.append(f"🔁 Attempt {event['attempt']}: regenerating {', '.join(event['sections'])}")
+                        yield "⏳ Generating...", "\n".join(progress)
+                    else:
+                        result = event['result']
+                        if result['errors']:
+                            progress.append("⚠️ Still invalid: " + ", ".join(f"{key} ({error})" for key, error
+                                                                              in result['errors'].items()))
+                        else:
+                            progress.append(f"✅ All sections valid after {result['attempts']} attempt(s)")
+                        yield result['text'], "\n".join(progress)
+        except Exception as e:
+            yield f"❌ Error in retrieving post: {str(e)}", "\n".join(progress)
+
+
+    def compare_models(self, tenant_id, models, product_name, perfumer_name, brand_values,
+                       product_description, olfactory_pyramid, keywords, post_destination):
+        """
+        Esegue il confronto A/B tra i modelli indicati
+        """
+        if not parse_models(models):
+            return [], "❌ **Error:** Enter at least one model", None
+
+        if not all([product_name.strip(), brand_values.strip(), product_description.strip()]):
+            return [], "❌ **Error:** Product Name, Brand Values and Description are mandatory", None
 
+        try:
+            with self.rag_for(tenant_id) as rag_system:
+                runner = ModelComparisonRunner(rag_system)
+                report = runner.run(
+                    models,
+                    product_name=product_name,
+                    perfumer_name=perfumer_name or "Not specified",
+                    brand_values=brand_values,
+                    product_description=product_description,
+                    olfactory_pyramid=olfactory_pyramid or "To be defined",
+                    keywords=keywords or "",
+                    post_destination=post_destination or Config.POST_DESTINATIONS[0]
+                )
+            report_path = runner.save_report(report)
+        except GenerationError as e:
+            return [], str(e), None
+        except Exception as e:
+            return [], f"❌ Error comparing models: {str(e)}", None
+
+        return report_rows(report), report_markdown(report), report_path
 
     def on_file_upload(self, file, post_name):
         status, preview, full_content = self.process_uploaded_file(file, post_name)
         return status, preview, full_content  # Il campo manuale ora riceve il testo INTEGRALE
 
-    def on_tab_3_selected(self):
-        sys_prompt = support.load_system_prompt(self.system_prompt_path)
-        return sys_prompt
+    def on_tab_3_selected(self, tenant_id):
+        with self.rag_for(tenant_id) as rag_system:
+            template = rag_system.templates.get(rag_system.generation_prompt)
+        return template.source, f"📄 Current version: {template.version}"
 
 
-    def save_sys_prompt(self, prompt):
-        support.save_system_prompt(self.system_prompt_path, prompt)
-        return
+    def save_sys_prompt(self, tenant_id, prompt):
+        if not prompt.strip():
+            return "❌ **Error:** System prompt cannot be empty"
+
+        try:
+            with self.rag_for(tenant_id) as rag_system:
+                template = rag_system.templates.save(rag_system.generation_prompt, prompt)
+        except TemplateError as e:
+            return f"❌ Invalid system prompt: {str(e)}"
+        except Exception as e:
+            return f"❌ Error saving system prompt: {str(e)}"
+
+        return f"✅ System prompt saved (version {template.version})"
 
     def create_interface(self):
         """
@@ -137,6 +377,15 @@ class GradioInterface:
             </div>
             """)
 
+            # Selezione del tenant (brand / linea di prodotto) usato da tutte le pagine
+            tenant_selector = gr.Dropdown(
+                label="Brand / product line",
+                choices=self.tenants.choices(),
+                value=self.tenants.default_tenant_id,
+                interactive=True,
+                visible=len(self.tenants.tenant_ids()) > 1
+            )
+
             # === PAGINA 1: CARICAMENTO DOCUMENTI ===
             with gr.Tab("📚 Document Loading"):
                 gr.HTML('<h2 class="section-header">📚 Instagram Posts Database Management</h2>')
@@ -211,8 +460,63 @@ class GradioInterface:
                             label="Database statistics",
                             interactive=False, 
                             lines=4,
-                            value=self.rag_system.get_collection_stats()
+                            value=self.collection_stats(None)
+                        )
+
+                if self.ingestion is not None:
+                    ingestion_status = gr.Textbox(
+                        label="Background ingestion",
+                        interactive=False,
+                        lines=4
+                    )
+                    ingestion_done = gr.State(None)
+                    ingestion_timer = gr.Timer(Config.INGEST_PROGRESS_REFRESH)
+
+                with gr.Accordion("🛠️ Manage documents", open=False):
+                    with gr.Row():
+                        documents_selector = gr.Dropdown(
+                            label="Indexed documents",
+                            choices=[],
+                            multiselect=True,
+                            interactive=True,
+                            scale=4
+                        )
+                        refresh_documents_button = gr.Button("🔄 Refresh", variant="secondary", scale=1)
+
+                    with gr.Row():
+                        load_document_button = gr.Button("📝 Load selected into editor", variant="secondary")
+                        update_document_button = gr.Button("✏️ Replace selected with editor content", variant="primary")
+                        delete_documents_button = gr.Button("🗑️ Delete selected", variant="stop")
+
+                    with gr.Row():
+                        bulk_document_type = gr.Dropdown(
+                            choices=['Post', 'Avoid Dictionary', "Include Dictionary"],
+                            label="Bulk delete: document type",
+                            interactive=True
                         )
+                        bulk_post_name = gr.Textbox(
+                            label="Bulk delete: post name",
+                            lines=1
+                        )
+                        bulk_delete_button = gr.Button("🗑️ Delete all matching", variant="stop")
+
+                    with gr.Row():
+                        compact_button = gr.Button("🧹 Compact database (reclaim disk space, rebuild index)",
+                                                   variant="secondary")
+
+                    manage_status = gr.Textbox(
+                        label="Result",
+                        interactive=False,
+                        lines=2
+                    )
+
+                if self.ingestion is not None:
+                    ingestion_timer.tick(
+                        fn=self.ingestion_progress,
+                        inputs=[tenant_selector, ingestion_done],
+                        outputs=[ingestion_status, db_stats, ingestion_done],
+                        show_progress="hidden"
+                    )
 
                 # Eventi pagina 1
                 file_upload.change(
@@ -223,8 +527,12 @@ class GradioInterface:
 
                 add_button.click(
                     fn=self.add_document_to_db,
-                    inputs=[content_manual, document_name_input, document_type],
+                    inputs=[tenant_selector, content_manual, document_name_input, document_type],
                     outputs=[add_status, db_stats]
+                ).then(
+                    fn=self.refresh_documents,
+                    inputs=tenant_selector,
+                    outputs=documents_selector
                 )
 
                 clear_button.click(
@@ -232,6 +540,44 @@ class GradioInterface:
                     outputs=[content_manual, document_name_input, file_status, content_preview, file_upload, add_status]
                 )
 
+                refresh_documents_button.click(
+                    fn=self.refresh_documents,
+                    inputs=tenant_selector,
+                    outputs=documents_selector
+                )
+
+                load_document_button.click(
+                    fn=self.load_document,
+                    inputs=[tenant_selector, documents_selector],
+                    outputs=[manage_status, content_manual, document_name_input, document_type]
+                )
+
+                update_document_button.click(
+                    fn=self.update_document,
+                    inputs=[tenant_selector, documents_selector, content_manual, document_name_input, document_type],
+                    outputs=[manage_status, db_stats, documents_selector]
+                )
+
+                delete_documents_button.click(
+                    fn=self.delete_documents,
+                    inputs=[tenant_selector, documents_selector],
+                    outputs=[manage_status, db_stats, documents_selector]
+                )
+
+                bulk_delete_button.click(
+                    fn=self.bulk_delete_documents,
+                    inputs=[tenant_selector, bulk_document_type, bulk_post_name],
+                    outputs=[manage_status, db_stats, documents_selector]
+                )
+
+                compact_button.click(
+                    fn=self.compact_database,
+                    inputs=tenant_selector,
+                    outputs=[manage_status, db_stats]
+                )
+
+                interface.load(self.refresh_documents, inputs=tenant_selector, outputs=documents_selector)
+
             # === PAGINA 2: GENERAZIONE PROMPT ===
             with gr.Tab("✨ Prompt generator"):
                 gr.HTML('<h2 class="section-header">✨ Optimized Prompt Generator</h2>')
@@ -247,7 +593,7 @@ class GradioInterface:
                     with gr.Column():
                         gr.HTML('<h3>📄 Post Informations</h3>')
                         post_destination = gr.Dropdown(label="Post destination",
-                                                       choices=["Instagram", "Linkedin", "Facebook"],
+                                                       choices=Config.POST_DESTINATIONS,
                                                        interactive=True)
 
                 with gr.Row():
@@ -304,6 +650,11 @@ class GradioInterface:
                 )
 
 
+                structured_post = gr.Checkbox(
+                    label="🧩 Structured output (validate each section while generating, regenerate only the invalid ones)",
+                    value=False
+                )
+
                 get_post_button = gr.Button("🚀 Get Post from Optimized Prompt", variant="primary", size="large")
 
                 gr.HTML('<h3>📋 Post</h3>')
@@ -314,19 +665,98 @@ class GradioInterface:
                     show_copy_button=True
                 )
 
+                post_validation = gr.Textbox(
+                    label="Section validation",
+                    lines=3,
+                    interactive=False
+                )
+
                 # Eventi pagina 2
 
                 generate_button.click(
                     fn=self.generate_prompt,
-                    inputs=[product_name, perfumer_name, brand_values,
+                    inputs=[tenant_selector, product_name, perfumer_name, brand_values,
                            product_description, olfactory_pyramid, keywords, post_destination],
                     outputs=prompt_output
                 )
 
                 get_post_button.click(
                     fn=self.get_post_from_llm,
-                    inputs=[prompt_output],
-                    outputs=post_output
+                    inputs=[tenant_selector, prompt_output, structured_post],
+                    outputs=[post_output, post_validation]
+                )
+
+                # Generazione multi-destinazione
+                gr.HTML('<h3>📣 Multi-destination generation</h3>')
+                post_destinations = gr.CheckboxGroup(
+                    label="Post destinations",
+                    choices=Config.POST_DESTINATIONS,
+                    value=Config.POST_DESTINATIONS,
+                    interactive=True
+                )
+
+                fanout_button = gr.Button("🚀 Generate Prompts and Posts for all Destinations", variant="primary", size="large")
+
+                fanout_outputs = []
+                for destination in Config.POST_DESTINATIONS:
+                    with gr.Accordion(f"📋 {destination}", open=False):
+                        with gr.Row():
+                            fanout_outputs.append(gr.Textbox(
+                                label=f"Optimised prompt for {destination}",
+                                lines=12,
+                                interactive=True,
+                                show_copy_button=True
+                            ))
+                            fanout_outputs.append(gr.Textbox(
+                                label=f"Post for {destination}",
+                                lines=12,
+                                interactive=True,
+                                show_copy_button=True
+                            ))
+
+                fanout_button.click(
+                    fn=self.generate_for_destinations,
+                    inputs=[tenant_selector, product_name, perfumer_name, brand_values,
+                           product_description, olfactory_pyramid, keywords, post_destinations],
+                    outputs=fanout_outputs
+                )
+
+            # === PAGINA: CONFRONTO MODELLI ===
+            with gr.Tab("⚖️ Model Comparison"):
+                gr.HTML('<h2 class="section-header">⚖️ Model A/B Comparison</h2>')
+
+                gr.HTML("""
+                <div class="info-box"  style="background-color: #000000;">
+                    <strong>🎯 Howto:</strong><br>
+                    Fill in the product in the "Prompt generator" tab, list the Ollama models to compare
+                    and run the comparison. Every model receives exactly the same retrieval context and prompt.
+                </div>
+                """)
+
+                comparison_models = gr.Textbox(
+                    label="Models to compare (comma separated)",
+                    placeholder="e.g.: deepseek-v3.1:671b-cloud, llama3.1:8b, qwen2.5:7b",
+                    value=Config.COMPARISON_MODELS,
+                    lines=2
+                )
+
+                compare_button = gr.Button("⚖️ Compare Models", variant="primary", size="large")
+
+                comparison_table = gr.Dataframe(
+                    headers=TABLE_HEADERS,
+                    label="Latency and throughput",
+                    interactive=False
+                )
+
+                comparison_report = gr.File(label="JSON report", interactive=False)
+
+                comparison_outputs = gr.Markdown()
+
+                compare_button.click(
+                    fn=self.compare_models,
+                    inputs=[tenant_selector, comparison_models, product_name, perfumer_name, brand_values,
+                           product_description, olfactory_pyramid, keywords, post_destination],
+                    outputs=[comparison_table, comparison_outputs, comparison_report]
                 )
 
             # === PAGINA 3: SYSTEM PROMPT ===
@@ -336,7 +766,9 @@ class GradioInterface:
                 gr.HTML("""
                 <div class="info-box"  style="background-color: #000000;">
                     <strong>🎯 Howto:</strong><br>
-                    Modify and save System Prompt
+                    Modify and save System Prompt<br>
+                    Keep the fixed instructions above the <code>---USER---</code> line and the {placeholders} below it:
+                    the fixed part is evaluated once by the model and reused across requests
                 </div>
                 """)
 
@@ -352,10 +784,21 @@ class GradioInterface:
 
                         save_sys_prompt = gr.Button("🚀 Save system prompt", variant="primary", size="large")
 
+                        sys_prompt_status = gr.Textbox(
+                            label="Status",
+                            interactive=False,
+                            lines=1
+                        )
+
                 ## Eventi pagina 3
-                sys_prompt_tab.select(self.on_tab_3_selected, inputs=None, outputs=system_prompt)
+                sys_prompt_tab.select(self.on_tab_3_selected, inputs=tenant_selector, outputs=[system_prompt, sys_prompt_status])
+
+                save_sys_prompt.click(self.save_sys_prompt, inputs=[tenant_selector, system_prompt], outputs=sys_prompt_status)
 
-                save_sys_prompt.click(self.save_sys_prompt, inputs=system_prompt, outputs=None)
+            # Cambio tenant: aggiorna statistiche e system prompt mostrati
+            tenant_selector.change(self.on_tenant_change, inputs=tenant_selector, outputs=db_stats)
+            tenant_selector.change(self.refresh_documents, inputs=tenant_selector, outputs=documents_selector)
+            tenant_selector.change(self.on_tab_3_selected, inputs=tenant_selector, outputs=[system_prompt, sys_prompt_status])
 
 
 
@@ -385,7 +828,23 @@ def launch_app(ollama_host="http://localhost:11434", share=False, port=7860):
         print("✅ Interfaccia creata con successo!")
         print(f"🌐 Avvio server su porta {port}...")
 
-        interface.queue()
+        interface.queue(default_concurrency_limit=Config.GRADIO_CONCURRENCY_LIMIT,
+                        max_size=Config.GRADIO_MAX_QUEUE_SIZE or None)
+
+        if Config.API_ENABLED and not share:
+            # API JSON e interfaccia Gradio servite dallo stesso server
+            import uvicorn
+            from mpd_api import create_api
+
+            api = create_api(app.tenants)
+            api = gr.mount_gradio_app(api, interface, path="/", show_api=False)
+
+            print(f"🔌 API disponibile su http://0.0.0.0:{port}{Config.API_PREFIX}")
+            uvicorn.run(api, host="0.0.0.0", port=port)
+            return
+
+        if Config.API_ENABLED:
+            print("⚠️ API HTTP non disponibile con la condivisione pubblica attiva")
 
         # Lancia l'interfaccia
         interface.launch(
@@ -0,0 +1,463 @@
+# Ingestion dei documenti in background
+# I documenti caricati dall'interfaccia e quelli copiati nella cartella osservata vengono
+# accodati in una coda persistente (SQLite) ed elaborati da un worker in background,
+# fuori dal percorso delle richieste interattive
+
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from mpd_config import Config
+from mpd_rag_system import InstagramPromptGenerator
+
+try:
+    import watchfiles
+except ImportError:  # pragma: no cover - watchfiles è opzionale
+    watchfiles = None
+
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant TEXT NOT NULL,
+    source TEXT NOT NULL,
+    path TEXT,
+    content TEXT,
+    post_name TEXT NOT NULL DEFAULT '',
+    document_type TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    doc_id TEXT NOT NULL,
+    sha256 TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_path ON jobs (tenant, path);
+CREATE TABLE IF NOT EXISTS files (
+    tenant TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    doc_id TEXT,
+    indexed_at TEXT NOT NULL,
+    PRIMARY KEY (tenant, path)
+);
+"""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionQueue:
+    """
+    Coda persistente dei job di ingestion e stato dei file della cartella osservata
+    """
+
+    def __init__(self, path: str = Config.INGEST_QUEUE_DB):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+            # Job interrotti da un riavvio: tornano in coda
+            self._connection.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+
+    def enqueue(self, tenant: str, content: str = None, post_name: str = "", document_type: str = "",
+                source: str = "upload", path: str = None, doc_id: str = None, sha256: str = None) -> int:
+        """
+        Accoda un documento (testo caricato, oppure file letto al momento dell'elaborazione).
+        L'ID del documento viene assegnato qui: tentativi e riavvii scrivono sempre lo stesso documento.
+        """
+        doc_id = doc_id or InstagramPromptGenerator.new_post_id(post_name)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (tenant, source, path, content, post_name, document_type, status, doc_id, "
+                "sha256, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (tenant, source, path, content, post_name or "", document_type or "", QUEUED, doc_id, sha256,
+                 datetime.now().isoformat()))
+            return cursor.lastrowid
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Prende il job in coda più vecchio e lo segna come in esecuzione
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE status = ? AND available_at <= ? ORDER BY id LIMIT 1",
+                (QUEUED, time.time())).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (RUNNING, datetime.now().isoformat(), row['id']))
+        job = dict(row)
+        job['attempts'] += 1
+        return job
+
+    def complete(self, job_id: int, result: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, content = NULL, finished_at = ? WHERE id = ?",
+                (DONE, result, datetime.now().isoformat(), job_id))
+
+    def fail(self, job_id: int, result: str, retry_in: float = None):
+        """
+        Segna il job come fallito, o lo rimette in coda dopo retry_in secondi
+        """
+        with self._lock, self._connection:
+            if retry_in is None:
+                self._connection.execute(
+                    "UPDATE jobs SET status = ?, result = ?, content = NULL, finished_at = ? WHERE id = ?",
+                    (FAILED, result, datetime.now().isoformat(), job_id))
+            else:
+                self._connection.execute(
+                    "UPDATE jobs SET status = ?, result = ?, available_at = ? WHERE id = ?",
+                    (QUEUED, result, time.time() + retry_in, job_id))
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recent(self, tenant: str = None, limit: int = 10) -> List[Dict]:
+        """
+        Ultimi job (senza il testo dei documenti), dal più recente
+        """
+        query = ("SELECT id, tenant, source, path, post_name, status, attempts, result, doc_id, created_at, "
+                 "finished_at FROM jobs")
+        parameters = []
+        if tenant:
+            query += " WHERE tenant = ?"
+            parameters.append(tenant)
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY id DESC LIMIT ?", (*parameters, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self, tenant: str = None) -> Dict[str, int]:
+        query, parameters = "SELECT status, COUNT(*) FROM jobs", ()
+        if tenant:
+            query, parameters = query + " WHERE tenant = ?", (tenant,)
+        with self._lock:
+            rows = self._connection.execute(query + " GROUP BY status", parameters).fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def has_pending(self, tenant: str, path: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM jobs WHERE tenant = ? AND path = ? AND status IN (?, ?) LIMIT 1",
+                (tenant, path, QUEUED, RUNNING)).fetchone()
+        return row is not None
+
+    def has_failed(self, tenant: str, path: str, sha256: str) -> bool:
+        """
+        True se questa versione del file (stesso hash) è già fallita definitivamente
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM jobs WHERE tenant = ? AND path = ? AND sha256 = ? AND status = ? LIMIT 1",
+                (tenant, path, sha256, FAILED)).fetchone()
+        return row is not None
+
+    def prune(self, older_than: float) -> int:
+        """
+        Elimina i job completati o falliti da più di older_than secondi, tranne l'ultimo job
+        di ogni file (che ricorda le versioni fallite)
+        """
+        cutoff = datetime.fromtimestamp(time.time() - older_than).isoformat()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ? AND id NOT IN "
+                "(SELECT MAX(id) FROM jobs WHERE path IS NOT NULL GROUP BY tenant, path)",
+                (DONE, FAILED, cutoff))
+            return cursor.rowcount
+
+    def file_state(self, tenant: str, path: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM files WHERE tenant = ? AND path = ?",
+                                           (tenant, path)).fetchone()
+        return dict(row) if row else None
+
+    def record_file(self, tenant: str, path: str, mtime: float, size: int, sha256: str, doc_id: str = None):
+        """
+        Salva mtime, dimensione e hash di un file (e il documento che lo rappresenta, se indicizzato)
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO files (tenant, path, mtime, size, sha256, doc_id, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (tenant, path) DO UPDATE SET "
+                "mtime = excluded.mtime, size = excluded.size, sha256 = excluded.sha256, "
+                "doc_id = COALESCE(excluded.doc_id, files.doc_id), indexed_at = excluded.indexed_at",
+                (tenant, path, mtime, size, sha256, doc_id, datetime.now().isoformat()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class IngestionWorker:
+    """
+    Elabora i job della coda in background e osserva la cartella dei documenti da indicizzare
+    """
+
+    def __init__(self,
+                 tenants,
+                 queue: IngestionQueue = None,
+                 drop_folder: str = Config.INGEST_DROP_FOLDER,
+                 workers: int = Config.INGEST_WORKERS,
+                 max_attempts: int = Config.INGEST_MAX_ATTEMPTS,
+                 scan_interval: float = Config.INGEST_SCAN_INTERVAL,
+                 settle_seconds: float = Config.INGEST_SETTLE_SECONDS,
+                 extensions: str = Config.INGEST_EXTENSIONS,
+                 document_type: str = Config.INGEST_DOCUMENT_TYPE,
+                 job_retention: float = Config.INGEST_JOB_RETENTION_DAYS * 86400):
+        self.tenants = tenants
+        self.queue = queue or IngestionQueue()
+        self.drop_folder = os.path.abspath(drop_folder) if drop_folder else None
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.scan_interval = scan_interval
+        self.settle_seconds = settle_seconds
+        self.extensions = tuple(ext.strip().lower() for ext in extensions.split(',') if ext.strip())
+        self.document_type = document_type
+        self.job_retention = job_retention
+
+        self._stop_event = threading.Event()
+        self._job_available = threading.Event()
+        self._scan_requested = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._prune_lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def start(self) -> "IngestionWorker":
+        # I thread vanno fermati prima della finalizzazione dell'interprete (il watcher è codice nativo)
+        atexit.register(self.close)
+        for index in range(self.workers):
+            self._start_thread(self._work_loop, f"ingestion-worker-{index}")
+
+        if self.drop_folder:
+            os.makedirs(self.drop_folder, exist_ok=True)
+            self._start_thread(self._scan_loop, "ingestion-folder-scan")
+            if watchfiles is not None:
+                self._start_thread(self._watch_loop, "ingestion-folder-watcher")
+            print(f"📂 Watching drop folder {self.drop_folder} ({', '.join(self.extensions)})")
+        return self
+
+    def submit(self, tenant_id: str, content: str, post_name: str = "", document_type: str = "") -> int:
+        """
+        Accoda un documento caricato dall'interfaccia e restituisce l'ID del job
+        """
+        tenant_id = self.tenants.config(tenant_id or None).tenant_id
+        job_id = self.queue.enqueue(tenant_id, content, post_name, document_type)
+        self._job_available.set()
+        return job_id
+
+    def progress(self, tenant_id: str = None, limit: int = 5) -> Dict:
+        tenant_id = self.tenants.config(tenant_id or None).tenant_id
+        return {'counts': self.queue.counts(tenant_id), 'recent': self.queue.recent(tenant_id, limit)}
+
+    def scan_drop_folder(self) -> int:
+        """
+        Accoda i file nuovi o modificati della cartella osservata e restituisce quanti sono
+        """
+        if not self.drop_folder or not os.path.isdir(self.drop_folder):
+            return 0
+
+        queued, unsettled = 0, False
+        tenant_dirs = {tenant_id for tenant_id in self.tenants.tenant_ids()
+                       if os.path.isdir(os.path.join(self.drop_folder, tenant_id))}
+        default_tenant = self.tenants.config().tenant_id
+        for root, directories, files in os.walk(self.drop_folder):
+            relative = os.path.relpath(root, self.drop_folder)
+            top = relative.split(os.sep)[0]
+            tenant_id = top if top in tenant_dirs else default_tenant
+            directories[:] = sorted(directory for directory in directories if not directory.startswith('.'))
+            for name in sorted(files):
+                if name.startswith('.') or not name.lower().endswith(self.extensions):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if time.time() - os.stat(path).st_mtime < self.settle_seconds:
+                        # Ancora in copia: verrà ricontrollato alla prossima scansione
+                        unsettled = True
+                        continue
+                    queued += self._check_file(tenant_id, path)
+                except OSError as e:
+                    print(f"⚠️ Unable to read {name} from the drop folder: {e}")
+
+        if unsettled:
+            timer = threading.Timer(self.settle_seconds, self._scan_requested.set)
+            timer.daemon = True
+            timer.start()
+        if queued:
+            self._job_available.set()
+        return queued
+
+    def prune_jobs(self) -> int:
+        """
+        Elimina i job conclusi più vecchi di job_retention secondi
+        """
+        pruned = self.queue.prune(self.job_retention)
+        if pruned:
+            print(f"🧹 Removed {pruned} finished ingestion job(s)")
+        return pruned
+
+    def close(self):
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        self._job_available.set()
+        self._scan_requested.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self.queue.close()
+
+    def _check_file(self, tenant_id: str, path: str) -> int:
+        stat = os.stat(path)
+        state = self.queue.file_state(tenant_id, path)
+        if state and state['mtime'] == stat.st_mtime and state['size'] == stat.st_size:
+            return 0
+        if self.queue.has_pending(tenant_id, path):
+            return 0
+
+        sha256 = file_sha256(path)
+        if state and state['sha256'] == sha256:
+            # Solo l'mtime è cambiato (es. sincronizzazione): nessuna nuova indicizzazione
+            self.queue.record_file(tenant_id, path, stat.st_mtime, stat.st_size, sha256)
+            return 0
+        if self.queue.has_failed(tenant_id, path, sha256):
+            # Versione già fallita definitivamente: si riprova solo quando il file cambia
+            return 0
+
+        # Un file già indicizzato aggiorna il suo documento invece di crearne uno nuovo
+        post_name = os.path.splitext(os.path.basename(path))[0]
+        self.queue.enqueue(tenant_id, post_name=post_name, document_type=self.document_type,
+                           source="folder", path=path, doc_id=state['doc_id'] if state else None,
+                           sha256=sha256)
+        return 1
+
+    def _process(self, job: Dict):
+        """
+        Indicizza il documento del job; restituisce (esito, ID documento, nuovo tentativo possibile)
+        """
+        # Il tenant resta in uso per tutta l'indicizzazione e non può essere chiuso dalla cache
+        with self.tenants.lease(job['tenant']) as rag:
+            return self._index(rag, job)
+
+    def _index(self, rag, job: Dict):
+        if job['source'] != "folder":
+            return self._write(rag, job, job['content']), job['doc_id'], True
+
+        path = job['path']
+        if not os.path.exists(path):
+            return f"❌ File no longer exists: {path}", None, False
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Hash del contenuto effettivamente indicizzato, anche se il file cambia nel frattempo
+        sha256 = hashlib.sha256(data).hexdigest()
+        try:
+            content = data.decode('utf-8')
+            error = None if content.strip() else f"❌ File is empty: {os.path.basename(path)}"
+        except UnicodeDecodeError:
+            error = f"❌ File is not valid UTF-8 text: {os.path.basename(path)}"
+        if error:
+            # Non viene ritentato finché il file non cambia
+            self.queue.record_file(job['tenant'], path, stat.st_mtime, stat.st_size, sha256)
+            return error, None, False
+
+        result = self._write(rag, job, content)
+        if not result.startswith("❌"):
+            self.queue.record_file(job['tenant'], path, stat.st_mtime, stat.st_size, sha256, job['doc_id'])
+        return result, job['doc_id'], True
+
+    @staticmethod
+    def _write(rag, job: Dict, content: str) -> str:
+        """
+        Scrittura idempotente sull'ID assegnato al job: un nuovo tentativo dopo un'aggiunta
+        già riuscita (o un riavvio a metà) aggiorna lo stesso documento invece di duplicarlo
+        """
+        if rag.get_document(job['doc_id']) is not None:
+            return rag.update_post(job['doc_id'], content, job['post_name'], job['document_type'])
+        return rag.add_post_to_database(content, job['post_name'], job['document_type'], post_id=job['doc_id'])
+
+    def _work_loop(self):
+        while not self._stop_event.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._prune_if_due()
+                self._job_available.wait(timeout=1.0)
+                self._job_available.clear()
+                continue
+
+            label = job['post_name'] or job['path'] or f"job {job['id']}"
+            try:
+                result, doc_id, retryable = self._process(job)
+            except Exception as e:
+                result, doc_id, retryable = f"❌ Error ingesting '{label}': {str(e)}", None, True
+
+            if not result.startswith("❌"):
+                self.queue.complete(job['id'], result)
+                print(f"📥 Ingested '{label}' for tenant '{job['tenant']}' (job {job['id']})")
+            elif retryable and job['attempts'] < self.max_attempts:
+                delay = 5 * 2 ** (job['attempts'] - 1)
+                self.queue.fail(job['id'], result, retry_in=delay)
+                print(f"⚠️ Ingestion of '{label}' failed, retrying in {delay}s: {result}")
+            else:
+                self.queue.fail(job['id'], result)
+                print(f"❌ Ingestion of '{label}' failed: {result}")
+
+    def _prune_if_due(self):
+        # Al più una pulizia all'ora, eseguita dal primo worker inattivo
+        if time.monotonic() - self._last_prune < 3600 or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = time.monotonic()
+            self.prune_jobs()
+        except Exception as e:
+            print(f"⚠️ Unable to prune ingestion jobs: {e}")
+        finally:
+            self._prune_lock.release()
+
+    def _scan_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.scan_drop_folder()
+            except Exception as e:
+                print(f"⚠️ Drop folder scan error: {e}")
+            self._scan_requested.wait(timeout=self.scan_interval)
+            self._scan_requested.clear()
+
+    def _watch_loop(self):
+        try:
+            for _ in watchfiles.watch(self.drop_folder, stop_event=self._stop_event):
+                self._scan_requested.set()
+        except Exception as e:
+            print(f"⚠️ Drop folder watcher stopped, falling back to periodic scans: {e}")
+
+    def _start_thread(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
@@ -0,0 +1,754 @@
+# Load test con utenti virtuali concorrenti
+# Simula N utenti che caricano documenti, generano prompt e post contro un server Ollama
+# finto (locale, con latenze configurabili), per dimensionare il deployment.
+#
+# Modalità:
+#   pipeline  chiama direttamente InstagramPromptGenerator nello stesso processo
+#   gradio    usa gli endpoint dell'interfaccia Gradio in esecuzione (gradio_client)
+#   api       usa l'API HTTP in esecuzione (/api/v1)
+#
+# Esempi:
+#   python mpd_loadtest.py pipeline --users 1,4,8,16 --duration 30
+#   python mpd_loadtest.py fake-ollama --port 11500      # poi avviare l'app con OLLAMA_HOST=http://127.0.0.1:11500
+#   python mpd_loadtest.py gradio --url http://localhost:7860 --users 1,4,8 --pid <pid dell'app>
+
+import argparse
+import contextvars
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from mpd_config import Config
+from mpd_retrieval_eval import HashingEmbeddingFunction, percentile
+from mpd_scheduler import parse_limits, track_queue_time
+
+# Sezioni valide (superano la validazione di mpd_post_schema) usate dal server finto
+FAKE_SECTIONS = {
+    'title': "Unique, one of a kind with Moellhausen: {product} by {perfumer}",
+    'brand_values': "Moellhausen combines Italian craftsmanship, scientific precision and a passion "
+                    "for rare raw materials in every creation.",
+    'introduction': "In {product}, our perfumer {perfumer} evokes a journey through ancient gardens, "
+                    "where light and shadow weave a story of refined Italian artistry.",
+    'description': "The fragrance opens like a silk curtain on a summer evening, warm and luminous, "
+                   "revealing a personality that is both magnetic and serene, intimate and timeless.",
+    'olfactory_pyramid': "Top notes of bergamot and pink pepper, a heart of Damask rose and iris, "
+                         "a base of oud, amber and sandalwood.",
+    'closing': "A creation that celebrates craftsmanship, creativity and our commitment to artistic perfumery.",
+}
+
+PRODUCTS = [
+    ("KING NARMAR", "Nilafar", "craftsmanship, luxury", "Top: bergamot, saffron  Heart: rose  Base: oud, amber"),
+    ("OCEAN BREEZE", "Luca Rossi", "elegance, Mediterranean spirit", "Top: sea salt, lemon  Heart: marine accord  Base: ambergris"),
+    ("GOLDEN SUNSET", "Aurora", "innovation, warmth", "Top: mandarin  Heart: orange blossom  Base: vanilla, musk"),
+    ("VELVET NIGHT", "Anna Chiara Di Trolio", "mystery, sensuality", "Top: black pepper  Heart: iris  Base: patchouli, leather"),
+]
+
+DEFAULT_MIX = "generate=5,post=3,add=1,search=1"
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.fake
+        server.count(self.path)
+        if self.path == "/api/version":
+            return self._json({"version": "0.0.0-fake"})
+        if self.path == "/api/tags":
+            return self._json({"models": [{"name": model, "model": model} for model in sorted(server.models)]})
+        self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        server = self.server.fake
+        server.count(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b"{}")
+        server.models.add(body.get('model', ''))
+
+        if server.should_fail():
+            return self._json({"error": "fake server error (injected)"}, status=500)
+
+        if self.path == "/api/embed":
+            texts = body.get('input') or []
+            texts = [texts] if isinstance(texts, str) else texts
+            time.sleep(server.embed_ms * len(texts) / 1000)
+            # L'embedding function di Chroma restituisce array numpy: nel JSON vanno liste di float
+            embeddings = [[float(value) for value in embedding] for embedding in server.embedder(texts)]
+            return self._json({"model": body.get('model'), "embeddings": embeddings})
+
+        if self.path == "/api/generate":
+            return self._generate(server, body)
+
+        self._json({"error": "not found"}, status=404)
+
+    def _generate(self, server, body: Dict):
+        prompt, system = body.get('prompt') or '', body.get('system') or ''
+        options = body.get('options') or {}
+        prompt_tokens = server.prompt_tokens(body.get('model', ''), system, prompt)
+        prompt_eval = prompt_tokens / server.prompt_tokens_per_sec
+        time.sleep(prompt_eval)
+
+        output_tokens = min(server.output_tokens, options.get('num_predict') or server.output_tokens)
+        response = server.response_text(body.get('format'), output_tokens)
+        eval_time = output_tokens / server.tokens_per_sec
+
+        metrics = {"model": body.get('model'), "created_at": datetime.now().isoformat(), "done": True,
+                   "done_reason": "stop", "total_duration": int((prompt_eval + eval_time) * 1e9),
+                   "load_duration": 0, "prompt_eval_count": prompt_tokens,
+                   "prompt_eval_duration": int(prompt_eval * 1e9), "eval_count": output_tokens,
+                   "eval_duration": int(eval_time * 1e9)}
+
+        if not body.get('stream', True):
+            time.sleep(eval_time)
+            return self._json({**metrics, "response": response})
+
+        # Streaming NDJSON, interrotto se il client chiude la connessione
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [response[i:i + 24] for i in range(0, len(response), 24)] or [""]
+        try:
+            for piece in pieces:
+                time.sleep(eval_time / len(pieces))
+                self._chunk(json.dumps({"model": body.get('model'), "response": piece, "done": False}) + "\n")
+            self._chunk(json.dumps({**metrics, "response": ""}) + "\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            server.count("aborted_streams")
+
+    def _chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, payload: Dict, status: int = 200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOllamaServer:
+    """
+    Server HTTP compatibile con le API Ollama usate dall'applicazione
+    (/api/generate anche in streaming e con format, /api/embed, /api/tags, /api/version).
+    Simula la valutazione del prompt con cache del prefisso system e la generazione a velocità fissa.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 tokens_per_sec: float = 200, output_tokens: int = 120,
+                 prompt_tokens_per_sec: float = 4000, embed_ms: float = 2,
+                 error_rate: float = 0.0, embedding_dim: int = 256, seed: int = 0):
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.embed_ms = embed_ms
+        self.error_rate = error_rate
+        self.embedder = HashingEmbeddingFunction(dim=embedding_dim)
+        self.models = set()
+        self.requests = Counter()
+        self._cached_prefixes = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._httpd = ThreadingHTTPServer((host, port), _FakeOllamaHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, key: str):
+        with self._lock:
+            self.requests[key] += 1
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def prompt_tokens(self, model: str, system: str, prompt: str) -> int:
+        """
+        Token da valutare: un system prompt già visto per lo stesso modello resta in cache
+        """
+        key = (model, hash(system))
+        with self._lock:
+            cached = bool(system) and key in self._cached_prefixes
+            self._cached_prefixes.add(key)
+        return max(1, len(prompt) // 4 + (0 if cached else len(system) // 4))
+
+    def response_text(self, format, output_tokens: int) -> str:
+        product, perfumer, _, _ = self._random.choice(PRODUCTS)
+        if isinstance(format, dict):
+            keys = format.get('required') or list(format.get('properties', {}))
+            return json.dumps({key: FAKE_SECTIONS[key].format(product=product, perfumer=perfumer)
+                               for key in keys if key in FAKE_SECTIONS})
+        words = "luxury fragrance elegant woody floral amber Italian craftsmanship poetic".split()
+        return " ".join(self._random.choice(words) for _ in range(output_tokens))
+
+
+def sample_post(rng: random.Random, index: int) -> str:
+    """
+    Post sintetico nel formato markdown dei post reali
+    """
+    product, perfumer, values, pyramid = rng.choice(PRODUCTS)
+    product = f"{product} {index}"
+    return (f"# UNIQUE, ONE OF A KIND WITH MOELLHAUSEN: {product} BY {perfumer.upper()}\n\n"
+            f"## Brand Values\n{FAKE_SECTIONS['brand_values']} Values: {values}.\n\n"
+            f"## Introduction\n{FAKE_SECTIONS['introduction'].format(product=product, perfumer=perfumer)}\n\n"
+            f"## Description\n{FAKE_SECTIONS['description']}\n\n"
+            f"## OLFACTORY PYRAMID\n{pyramid}\n\n"
+            f"## Closing\n{FAKE_SECTIONS['closing']}\n\n"
+            f"## TAGS\n#moellhausen #perfume #{perfumer.split()[0].lower()}")
+
+
+def sample_product(rng: random.Random) -> Dict:
+    product, perfumer, values, pyramid = rng.choice(PRODUCTS)
+    return {"product_name": f"{product} BY {perfumer.upper()}", "perfumer_name": perfumer,
+            "brand_values": values, "product_description": "A new fragrance inspired by Italian gardens",
+            "olfactory_pyramid": pyramid, "keywords": "", "post_destination": Config.POST_DESTINATIONS[0]}
+
+
+_ID_PATTERN = re.compile(r"\(ID: ([^)]+)\)")
+_JOB_PATTERN = re.compile(r"\(job (\d+)\)")
+
+
+def added_issues(added_ids: List[str], adds: int) -> List[str]:
+    """
+    Problemi comuni a tutte le modalità: ID duplicati o aggiunte riuscite senza ID
+    """
+    issues = []
+    if len(set(added_ids)) != len(added_ids):
+        issues.append(f"{len(added_ids) - len(set(added_ids))} duplicate IDs returned by add")
+    if len(added_ids) < adds:
+        issues.append(f"{adds - len(added_ids)} successful adds returned no document ID")
+    return issues
+
+
+class OperationResult:
+    __slots__ = ('operation', 'started', 'latency', 'queue_wait', 'error', 'doc_id')
+
+    def __init__(self, operation: str, started: float, latency: float, queue_wait: Optional[float],
+                 error: Optional[str], doc_id: Optional[str] = None):
+        self.operation = operation
+        self.started = started
+        self.latency = latency
+        self.queue_wait = queue_wait
+        self.error = error
+        self.doc_id = doc_id
+
+
+class PipelineTarget:
+    """
+    Chiama la pipeline direttamente, nello stesso processo (un solo InstagramPromptGenerator condiviso)
+    """
+    name = "pipeline"
+
+    def __init__(self, ollama_host: str, chroma_path: str):
+        from mpd_rag_system import InstagramPromptGenerator
+
+        self.rag = InstagramPromptGenerator(chroma_path=chroma_path, collection_name="loadtest",
+                                            ollama_host=ollama_host)
+
+    def session(self):
+        return None
+
+    def call(self, session, operation: str, rng: random.Random, index: int):
+        """
+        Esegue un'operazione e restituisce (errore o None, ID documento, attesa in coda)
+        """
+        with track_queue_time() as waits:
+            if operation == "add":
+                result = self.rag.add_post_to_database(sample_post(rng, index), f"LoadTest_{index}", "Post")
+            elif operation == "generate":
+                result = self.rag.generate_optimized_prompt(**sample_product(rng))
+            elif operation == "post":
+                result = self.rag.get_post_from_llm("Write an Instagram post for a luxury fragrance")
+            elif operation == "structured_post":
+                result = self.rag.get_structured_post("Write an Instagram post for a luxury fragrance")
+                result = "❌ " + json.dumps(result['errors']) if result['errors'] else "✅"
+            elif operation == "search":
+                result = "✅" if self.rag.get_similar_posts("luxury woody amber fragrance", 3) else "❌ no results"
+            else:
+                raise ValueError(f"Unknown operation: {operation}")
+
+        match = _ID_PATTERN.search(result) if operation == "add" else None
+        error = result if result.startswith("❌") else None
+        return error, match.group(1) if match else None, sum(waits)
+
+    def check_consistency(self, added_ids: List[str], adds: int) -> Dict:
+        """
+        Verifica che le scritture concorrenti abbiano lasciato collection e indice coerenti
+        """
+        collection = self.rag.collection
+        stored = collection.get(include=[])['ids']
+        found = collection.get(ids=added_ids, include=[])['ids'] if added_ids else []
+        issues = added_issues(added_ids, adds)
+        if len(found) != len(set(added_ids)):
+            issues.append(f"{len(set(added_ids)) - len(found)} added documents missing from the collection")
+        if len(stored) != collection.count():
+            issues.append(f"count() = {collection.count()} but {len(stored)} IDs listed")
+        if len(self.rag.metadata_index) != len(stored):
+            issues.append(f"metadata index has {len(self.rag.metadata_index)} entries, collection {len(stored)}")
+        return {'documents': len(stored), 'added': len(added_ids), 'issues': issues}
+
+    def close(self):
+        self.rag.close()
+
+
+class GradioTarget:
+    """
+    Usa gli endpoint dell'interfaccia Gradio in esecuzione, come un browser
+    """
+    name = "gradio"
+
+    def __init__(self, url: str, tenant: str = Config.DEFAULT_TENANT, queue_db: str = None,
+                 ingest_timeout: float = 120):
+        from gradio_client import Client  # noqa: F401 - verifica subito la dipendenza
+
+        self.url = url
+        self.tenant = tenant
+        self.queue_db = queue_db
+        self.ingest_timeout = ingest_timeout
+        # Con l'ingestion in background l'aggiunta restituisce solo l'ID del job
+        self.queued_jobs: List[int] = []
+        self._jobs_lock = threading.Lock()
+
+    def session(self):
+        from gradio_client import Client
+        return Client(self.url, verbose=False)
+
+    def call(self, session, operation: str, rng: random.Random, index: int):
+        if operation == "add":
+            result, _ = session.predict(self.tenant, sample_post(rng, index), f"LoadTest_{index}", "Post",
+                                        api_name="/add_document_to_db")
+        elif operation == "generate":
+            product = sample_product(rng)
+            result = session.predict(self.tenant, product['product_name'], product['perfumer_name'],
+                                     product['brand_values'], product['product_description'],
+                                     product['olfactory_pyramid'], product['keywords'],
+                                     product['post_destination'], api_name="/generate_prompt")
+        elif operation in ("post", "structured_post"):
+            result, _ = session.predict(self.tenant, "Write an Instagram post for a luxury fragrance",
+                                        operation == "structured_post", api_name="/get_post_from_llm")
+        else:
+            raise ValueError(f"Operation '{operation}' is not available in gradio mode")
+
+        match = _ID_PATTERN.search(result) if operation == "add" else None
+        job = _JOB_PATTERN.search(result) if operation == "add" and not match else None
+        if job:
+            with self._jobs_lock:
+                self.queued_jobs.append(int(job.group(1)))
+        return (result if result.startswith("❌") else None), match.group(1) if match else None, None
+
+    def check_consistency(self, added_ids: List[str], adds: int) -> Dict:
+        added_ids, issues = list(added_ids), []
+        if self.queued_jobs:
+            if not self.queue_db:
+                return {'added': len(added_ids), 'issues': [
+                    f"{len(self.queued_jobs)} adds were queued for background indexing: "
+                    f"pass --ingest-queue-db to wait for them and verify the documents"]}
+            indexed, failed = self._wait_for_jobs()
+            added_ids.extend(indexed)
+            adds -= failed
+            if failed:
+                issues.append(f"{failed} queued adds failed in the ingestion worker")
+        return {'added': len(added_ids), 'issues': issues + added_issues(added_ids, adds)}
+
+    def _wait_for_jobs(self):
+        """
+        Attende i job di ingestion accodati dalle aggiunte; restituisce (ID documenti, job falliti)
+        """
+        from mpd_ingestion import DONE, FAILED, IngestionQueue
+
+        queue = IngestionQueue(self.queue_db)
+        deadline = time.monotonic() + self.ingest_timeout
+        try:
+            while True:
+                jobs = [queue.get(job_id) for job_id in self.queued_jobs]
+                if all(job and job['status'] in (DONE, FAILED) for job in jobs) or time.monotonic() > deadline:
+                    break
+                time.sleep(0.5)
+        finally:
+            queue.close()
+        indexed = [job['doc_id'] for job in jobs if job and job['status'] == DONE]
+        return indexed, sum(1 for job in jobs if job and job['status'] == FAILED)
+
+    def close(self):
+        pass
+
+
+class ApiTarget:
+    """
+    Usa l'API HTTP in esecuzione; l'attesa in coda viene letta dall'header X-Queue-Time-Ms
+    """
+    name = "api"
+
+    def __init__(self, url: str, tenant: str = Config.DEFAULT_TENANT):
+        self.base = url.rstrip('/') + Config.API_PREFIX
+        self.tenant = tenant
+
+    def session(self):
+        import requests
+        session = requests.Session()
+        session.headers["X-Tenant-ID"] = self.tenant
+        return session
+
+    def call(self, session, operation: str, rng: random.Random, index: int):
+        if operation == "add":
+            response = session.post(f"{self.base}/documents", json={"content": sample_post(rng, index),
+                                                                     "post_name": f"LoadTest_{index}"})
+        elif operation == "generate":
+            response = session.post(f"{self.base}/prompts", json=sample_product(rng))
+        elif operation in ("post", "structured_post"):
+            response = session.post(f"{self.base}/posts", json={
+                "prompt": "Write an Instagram post for a luxury fragrance",
+                "structured": operation == "structured_post"})
+        elif operation == "search":
+            response = session.post(f"{self.base}/search", json={"query": "luxury woody amber fragrance"})
+        else:
+            raise ValueError(f"Unknown operation: {operation}")
+
+        queue_ms = response.headers.get("X-Queue-Time-Ms")
+        queue_wait = float(queue_ms) / 1000 if queue_ms else None
+        if response.status_code >= 400:
+            return f"HTTP {response.status_code}: {response.text[:200]}", None, queue_wait
+
+        match = _ID_PATTERN.search(response.json().get('result', '')) if operation == "add" else None
+        return None, match.group(1) if match else None, queue_wait
+
+    def check_consistency(self, added_ids: List[str], adds: int) -> Dict:
+        import requests
+        listed = requests.get(f"{self.base}/documents", headers={"X-Tenant-ID": self.tenant}).json()['documents']
+        listed_ids = {document['id'] for document in listed}
+        issues = added_issues(added_ids, adds)
+        missing = set(added_ids) - listed_ids
+        if missing:
+            issues.append(f"{len(missing)} added documents missing from the collection")
+        return {'documents': len(listed_ids), 'added': len(added_ids), 'issues': issues}
+
+    def close(self):
+        pass
+
+
+class ResourceSampler:
+    """
+    Campiona RSS, CPU e numero di thread di un processo leggendo /proc (solo Linux)
+    """
+
+    def __init__(self, pid: int = None, interval: float = 1.0):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.samples: List[Dict] = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(f"/proc/{self.pid}/stat")
+
+    def start(self):
+        if not self.available:
+            print(f"⚠️ /proc/{self.pid} not available: RSS/CPU will not be reported")
+            return
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+        rss_kb, threads = 0, 0
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+        return cpu_seconds, rss_kb, threads
+
+    def _run(self):
+        started = time.monotonic()
+        previous_cpu, _, _ = self._read()
+        previous_time = started
+        while not self._stop_event.wait(self.interval):
+            try:
+                cpu, rss_kb, threads = self._read()
+            except (OSError, ValueError, IndexError):
+                break
+            now = time.monotonic()
+            self.samples.append({'t': round(now - started, 1),
+                                 'rss_mb': round(rss_kb / 1024, 1),
+                                 'cpu_percent': round((cpu - previous_cpu) / (now - previous_time) * 100, 1),
+                                 'threads': threads})
+            previous_cpu, previous_time = cpu, now
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """
+    Converte "generate=5,post=3,add=1" nei pesi delle operazioni
+    """
+    mix = {operation: weight for operation, weight in parse_limits(value).items() if weight > 0}
+    if not mix:
+        raise ValueError(f"Invalid operation mix: {value}")
+    return mix
+
+
+def run_stage(target, users: int, duration: float, mix: Dict[str, int], think_time: float,
+              seed: int, counter: Callable[[], int]) -> List[OperationResult]:
+    """
+    Esegue un livello di carico: `users` utenti virtuali per `duration` secondi
+    """
+    results: List[OperationResult] = []
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    operations, weights = zip(*mix.items())
+
+    def virtual_user(user: int):
+        rng = random.Random(seed * 1000 + user)
+        try:
+            session = target.session()
+        except Exception as e:
+            with results_lock:
+                results.append(OperationResult("session", time.monotonic(), 0.0, None, f"session: {e}"))
+            return
+
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            started = time.monotonic()
+            try:
+                error, doc_id, queue_wait = target.call(session, operation, rng, counter())
+            except Exception as e:
+                error, doc_id, queue_wait = f"{type(e).__name__}: {e}", None, None
+            result = OperationResult(operation, started, time.monotonic() - started, queue_wait, error, doc_id)
+            with results_lock:
+                results.append(result)
+            if think_time:
+                time.sleep(rng.uniform(0, 2 * think_time))
+
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(virtual_user, user),
+                                name=f"vu-{user}", daemon=True) for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results: List[OperationResult], duration: float) -> Dict:
+    """
+    Throughput, distribuzione delle latenze, attesa in coda ed errori (totali e per operazione)
+    """
+
+    def describe(items: List[OperationResult]) -> Dict:
+        latencies = [item.latency * 1000 for item in items]
+        waits = [item.queue_wait * 1000 for item in items if item.queue_wait is not None]
+        errors = [item for item in items if item.error]
+        return {
+            'requests': len(items),
+            'throughput_rps': round(len(items) / duration, 2) if duration else 0.0,
+            'error_rate': round(len(errors) / len(items), 4) if items else 0.0,
+            'latency_mean_ms': round(statistics.fmean(latencies), 1) if latencies else None,
+            'latency_p50_ms': round(percentile(latencies, 50), 1) if latencies else None,
+            'latency_p90_ms': round(percentile(latencies, 90), 1) if latencies else None,
+            'latency_p95_ms': round(percentile(latencies, 95), 1) if latencies else None,
+            'latency_p99_ms': round(percentile(latencies, 99), 1) if latencies else None,
+            'latency_max_ms': round(max(latencies), 1) if latencies else None,
+            'queue_wait_p50_ms': round(percentile(waits, 50), 1) if waits else None,
+            'queue_wait_p95_ms': round(percentile(waits, 95), 1) if waits else None,
+        }
+
+    by_operation = defaultdict(list)
+    for item in results:
+        by_operation[item.operation].append(item)
+
+    errors = Counter(item.error.splitlines()[0][:160] for item in results if item.error)
+    return {**describe(results),
+            'operations': {operation: describe(items) for operation, items in sorted(by_operation.items())},
+            'top_errors': errors.most_common(5)}
+
+
+def resource_summary(samples: List[Dict]) -> Dict:
+    if not samples:
+        return {}
+    return {'rss_peak_mb': max(sample['rss_mb'] for sample in samples),
+            'rss_last_mb': samples[-1]['rss_mb'],
+            'cpu_mean_percent': round(statistics.fmean(sample['cpu_percent'] for sample in samples), 1),
+            'cpu_peak_percent': max(sample['cpu_percent'] for sample in samples),
+            'threads_peak': max(sample['threads'] for sample in samples)}
+
+
+def print_report(report: Dict):
+    print(f"\n{'users':>5} {'req':>6} {'req/s':>7} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queue p95':>9} {'RSS MB':>7} {'CPU%':>6}")
+    for stage in report['stages']:
+        summary, resources = stage['summary'], stage['resources']
+        print(f"{stage['users']:>5} {summary['requests']:>6} {summary['throughput_rps']:>7.2f} "
+              f"{summary['error_rate'] * 100:>6.1f} {summary['latency_p50_ms'] or 0:>8.0f} "
+              f"{summary['latency_p95_ms'] or 0:>8.0f} {summary['latency_p99_ms'] or 0:>8.0f} "
+              f"{summary['queue_wait_p95_ms'] if summary['queue_wait_p95_ms'] is not None else '-':>9} "
+              f"{resources.get('rss_peak_mb', '-'):>7} {resources.get('cpu_mean_percent', '-'):>6}")
+        for error, count in summary['top_errors']:
+            print(f"      ❌ {count}x {error}")
+
+    consistency = report.get('consistency') or {}
+    if consistency.get('issues'):
+        print("\n❌ Consistency issues in the shared collection:")
+        for issue in consistency['issues']:
+            print(f"  - {issue}")
+    elif consistency:
+        print(f"\n✅ Collection consistent after the run ({consistency.get('added', 0)} documents added concurrently)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test against a fake Ollama server")
+    parser.add_argument("mode", choices=["pipeline", "gradio", "api", "fake-ollama"])
+    parser.add_argument("--users", default="1,4,8", help="Comma separated virtual users per stage")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per stage")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="Operation weights: generate, post, structured_post, add, search")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between operations (s)")
+    parser.add_argument("--seed-documents", type=int, default=10, help="Documents added before the first stage")
+    parser.add_argument("--url", default=f"http://localhost:{Config.GRADIO_PORT}", help="App URL (gradio/api)")
+    parser.add_argument("--tenant", default=Config.DEFAULT_TENANT)
+    parser.add_argument("--pid", type=int, help="App process to sample for RSS/CPU (gradio/api)")
+    parser.add_argument("--ingest-queue-db", help="App ingestion queue, to verify documents added in the "
+                                                  "background (gradio)")
+    parser.add_argument("--ingest-timeout", type=float, default=120,
+                        help="Seconds to wait for queued documents to be indexed (gradio)")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--output", help="Where to write the JSON report")
+    parser.add_argument("--seed", type=int, default=42)
+    fake = parser.add_argument_group("fake Ollama server")
+    fake.add_argument("--port", type=int, default=0, help="Fake server port (0 = random)")
+    fake.add_argument("--tokens-per-sec", type=float, default=200)
+    fake.add_argument("--output-tokens", type=int, default=120)
+    fake.add_argument("--prompt-tokens-per-sec", type=float, default=4000)
+    fake.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake Ollama requests failing")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(port=args.port, tokens_per_sec=args.tokens_per_sec,
+                              output_tokens=args.output_tokens, prompt_tokens_per_sec=args.prompt_tokens_per_sec,
+                              error_rate=args.error_rate, seed=args.seed).start()
+    print(f"🤖 Fake Ollama server on {server.url}")
+
+    if args.mode == "fake-ollama":
+        print("   Start the app with OLLAMA_HOST pointing here, then run the gradio/api mode. Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    workdir = None
+    if args.mode == "pipeline":
+        workdir = tempfile.mkdtemp(prefix="mpd_loadtest_")
+        target = PipelineTarget(server.url, workdir)
+    elif args.mode == "gradio":
+        target = GradioTarget(args.url, args.tenant, args.ingest_queue_db, args.ingest_timeout)
+    else:
+        target = ApiTarget(args.url, args.tenant)
+
+    sequence = iter(range(1, 10 ** 9))
+    sequence_lock = threading.Lock()
+
+    def counter() -> int:
+        with sequence_lock:
+            return next(sequence)
+
+    mix = parse_mix(args.mix)
+    stages = []
+    added_ids, adds = [], 0
+    try:
+        # Documenti iniziali, così retrieval e analisi hanno dati su cui lavorare
+        if args.seed_documents:
+            session = target.session()
+            rng = random.Random(args.seed)
+            for _ in range(args.seed_documents):
+                error, doc_id, _ = target.call(session, "add", rng, counter())
+                if error:
+                    # Senza documenti le generazioni fallirebbero tutte: i risultati non sarebbero significativi
+                    print(f"❌ Seed document failed, aborting the load test: {error}")
+                    raise SystemExit(1)
+                adds += 1
+                if doc_id:
+                    added_ids.append(doc_id)
+
+        for users in [int(value) for value in args.users.split(',') if value.strip()]:
+            print(f"🏃 {users} virtual users for {args.duration:.0f}s ({target.name} mode)...")
+            sampler = ResourceSampler(args.pid if args.mode != "pipeline" else None, args.sample_interval)
+            sampler.start()
+            started = time.monotonic()
+            results = run_stage(target, users, args.duration, mix, args.think_time, args.seed + users, counter)
+            elapsed = time.monotonic() - started
+            sampler.stop()
+
+            added_ids.extend(item.doc_id for item in results if item.doc_id)
+            adds += sum(1 for item in results if item.operation == "add" and not item.error)
+            stage = {'users': users, 'duration_s': round(elapsed, 1), 'summary': summarize(results, elapsed),
+                     'resources': resource_summary(sampler.samples), 'resource_samples': sampler.samples}
+            if isinstance(target, PipelineTarget):
+                stage['scheduler'] = target.rag.scheduler.stats()
+            stages.append(stage)
+
+        consistency = target.check_consistency(added_ids, adds)
+        if 'add' in mix and not consistency['added']:
+            consistency['issues'].append("'add' is in the operation mix but no document was added")
+    finally:
+        target.close()
+        server.stop()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'created_at': datetime.now().isoformat(), 'mode': args.mode, 'mix': mix,
+              'think_time_s': args.think_time, 'fake_ollama': {'requests': dict(server.requests),
+                                                               'tokens_per_sec': args.tokens_per_sec,
+                                                               'output_tokens': args.output_tokens,
+                                                               'error_rate': args.error_rate},
+              'stages': stages, 'consistency': consistency}
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 Report saved: {args.output}")
+
+    if consistency.get('issues'):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# Indice invertito sui campi strutturati dei post
+# Note olfattive (top/heart/base), profumiere e tag vengono normalizzati in fase
+# di ingestion, così il retrieval può pre-filtrare o privilegiare i post affini
+# prima della ricerca vettoriale
+
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+import mpd_support_functions as support
+
+INDEX_VERSION = 1
+
+# Campi indicizzati e peso di ciascuno nel punteggio di affinità
+FIELD_WEIGHTS = {
+    'base_notes': 3.0,
+    'heart_notes': 2.0,
+    'top_notes': 1.0,
+    'perfumer': 2.0,
+    'tags': 0.5,
+}
+
+# Etichette dei livelli della piramide olfattiva (anche in italiano)
+_LEVEL_ALIASES = {
+    'top': 'top_notes', 'head': 'top_notes', 'testa': 'top_notes',
+    'heart': 'heart_notes', 'middle': 'heart_notes', 'cuore': 'heart_notes',
+    'base': 'base_notes', 'fondo': 'base_notes', 'bottom': 'base_notes',
+}
+# Etichetta di un livello: "Top: ...", "Head notes - ...", "Note di testa: ..." oppure in prosa
+# "Top notes of ...", "heart of ...", "base di ..."
+_LEVEL_PATTERN = re.compile(
+    r'\b(?:note\s+di\s+)?(top|head|testa|heart|middle|cuore|base|fondo|bottom)(?:\s+notes?|\s+note)?'
+    r'(?:\s*[:\-–—]|\s+(?:of|di|with|con)\b(?!\s+(?:the|a|an|this|its|il|lo|la|un|una|questa|questo)\b))',
+    re.IGNORECASE)
+# Separatori tra le note: il trattino solo se circondato da spazi, per non spezzare "ylang-ylang"
+_NOTE_SPLIT = re.compile(r'\s*(?:,|;|•|/|\+|&|\s[-–—]\s|\band\b|\be\b|\n)\s*', re.IGNORECASE)
+# Fine frase: il testo successivo non appartiene più al livello
+_SENTENCE_END = re.compile(r'[.!?](?:\s|$)')
+# Frammenti più lunghi, o con articoli e congiunzioni, sono prosa e non nomi di note
+MAX_NOTE_WORDS = 4
+_PROSE_WORDS = {'the', 'a', 'an', 'that', 'which', 'with', 'its', 'is', 'il', 'lo', 'la', 'un', 'una', 'che'}
+# Nome del profumiere sulla stessa riga dell'etichetta: da una a tre parole maiuscole, più un
+# eventuale cognome con particella ("Di Trolio", "van der Berg"), che chiude il nome.
+# Punteggiatura, a capo e parole come "Creates" o "A" dei titoli terminano il nome.
+_NAME_PARTICLE = r"(?i:d[aeiu]|del|della|dello|der|van|von|la|le)"
+_NAME_STOP_WORDS = r"(?:A|An|The|And|Of|For|With|In|By|Creates|Presents|Signs|Introduces|Crea|Firma|Presenta|E|Per|Con)"
+_NAME_WORD = rf"(?!(?:{_NAME_PARTICLE}|{_NAME_STOP_WORDS})\b)[A-Z][\w'’\-]*\w"
+_PERFUMER_PATTERN = re.compile(
+    rf"\b(?i:perfumer|nose|profumiere|profumiera)(?:[ \t]*[:,])?[ \t]*"
+    rf"({_NAME_WORD}(?:[ \t]+{_NAME_WORD}){{0,2}}(?:(?:[ \t]+{_NAME_PARTICLE}){{1,2}}[ \t]+{_NAME_WORD})?)")
+_HASHTAG_PATTERN = re.compile(r'#(\w+)')
+
+# Valori segnaposto inseriti dall'interfaccia quando un campo è vuoto
+_PLACEHOLDER_VALUES = {'', 'not specified', 'to be defined', 'unknown', 'n/a'}
+
+
+def normalize_value(value: str) -> str:
+    """
+    Normalizza un valore per il confronto esatto: minuscolo, senza punteggiatura ai bordi
+    """
+    value = re.sub(r'\s+', ' ', value or '').strip().lower()
+    return value.strip(' .:;,-–—*"\'“”')
+
+
+def parse_olfactory_pyramid(text: str) -> Dict[str, List[str]]:
+    """
+    Estrae le note per livello da testo del tipo "Top: a, b  Heart: c  Base: d e f"
+    o "Top notes of a and b, heart of c, base of d". Se nessun livello viene riconosciuto
+    i campi restano vuoti e il retrieval usa solo la similarità vettoriale.
+    """
+    levels = {'top_notes': [], 'heart_notes': [], 'base_notes': []}
+    matches = list(_LEVEL_PATTERN.finditer(text or ''))
+
+    for i, match in enumerate(matches):
+        level = _LEVEL_ALIASES[match.group(1).lower()]
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        segment = text[match.end():end]
+        sentence_end = _SENTENCE_END.search(segment)
+        if sentence_end:
+            segment = segment[:sentence_end.start()]
+        for note in _NOTE_SPLIT.split(segment):
+            note = normalize_value(note)
+            words = note.split()
+            if (note and note not in _PLACEHOLDER_VALUES and len(words) <= MAX_NOTE_WORDS
+                    and not _PROSE_WORDS.intersection(words) and note not in levels[level]):
+                levels[level].append(note)
+
+    return levels
+
+
+def extract_perfumer(text: str) -> List[str]:
+    match = _PERFUMER_PATTERN.search(text or '')
+    return [normalize_value(match.group(1))] if match else []
+
+
+def parse_tags(text: str) -> List[str]:
+    tags = _HASHTAG_PATTERN.findall(text or '')
+    if not tags:
+        tags = re.split(r'[,\s]+', text or '')
+    return list(dict.fromkeys(normalize_value(tag) for tag in tags if normalize_value(tag)))
+
+
+def extract_structured_fields(post_text: str, structure: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    Campi strutturati di un post, a partire dalle sezioni di extract_post_structure
+    """
+    fields = parse_olfactory_pyramid(structure.get('olfactory_pyramid', ''))
+    fields['perfumer'] = extract_perfumer(structure.get('introduction', '')) or extract_perfumer(post_text)
+    fields['tags'] = parse_tags(structure.get('tags', ''))
+    return fields
+
+
+def product_query_fields(olfactory_pyramid: str = "", perfumer_name: str = "") -> Dict[str, List[str]]:
+    """
+    Campi strutturati di un nuovo prodotto, da confrontare con l'indice
+    """
+    fields = parse_olfactory_pyramid(olfactory_pyramid)
+    perfumer = normalize_value(perfumer_name)
+    fields['perfumer'] = [perfumer] if perfumer not in _PLACEHOLDER_VALUES else []
+    return fields
+
+
+class MetadataIndex:
+    """
+    Indice invertito campo -> valore -> id documento, persistito in JSON.
+    Le modifiche vengono scritte su disco al più ogni flush_delay secondi (tutte insieme)
+    e comunque con flush() o close().
+    """
+
+    def __init__(self, path: Optional[str] = None, flush_delay: float = 0.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._documents: Dict[str, Dict[str, List[str]]] = {}
+        self._inverted: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._documents
+
+    def add(self, doc_id: str, fields: Dict[str, Iterable[str]], persist: bool = True):
+        with self._lock:
+            self._remove(doc_id)
+            entry = {field: sorted(set(values)) for field, values in fields.items() if values}
+            self._documents[doc_id] = entry
+            for field, values in entry.items():
+                for value in values:
+                    self._inverted[field][value].add(doc_id)
+            self._dirty = True
+            if persist:
+                self._schedule_flush()
+
+    def remove(self, doc_ids: Iterable[str], persist: bool = True):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+            self._dirty = True
+            if persist:
+                self._schedule_flush()
+
+    def fields(self, doc_id: str) -> Dict[str, List[str]]:
+        with self._lock:
+            return dict(self._documents.get(doc_id, {}))
+
+    def lookup(self, field: str, values: Iterable[str]) -> Set[str]:
+        """
+        Documenti che hanno almeno uno dei valori nel campo indicato
+        """
+        with self._lock:
+            postings = self._inverted.get(field, {})
+            result = set()
+            for value in values:
+                result |= postings.get(normalize_value(value), set())
+            return result
+
+    def score(self, query_fields: Dict[str, Iterable[str]]) -> Dict[str, float]:
+        """
+        Punteggio di affinità pesato (numero di valori in comune per campo)
+        """
+        scores = defaultdict(float)
+        with self._lock:
+            for field, values in query_fields.items():
+                weight = FIELD_WEIGHTS.get(field, 1.0)
+                postings = self._inverted.get(field, {})
+                for value in set(normalize_value(value) for value in values):
+                    for doc_id in postings.get(value, ()):
+                        scores[doc_id] += weight
+        return dict(scores)
+
+    def values(self, field: str) -> Dict[str, int]:
+        """
+        Valori presenti per un campo con il numero di documenti
+        """
+        with self._lock:
+            return {value: len(ids) for value, ids in self._inverted.get(field, {}).items()}
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._inverted.clear()
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            self._cancel_flush()
+            self._dirty = False
+            if not self.path:
+                return
+            data = {'version': INDEX_VERSION, 'documents': self._documents}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            support.atomic_write_text(self.path, json.dumps(data, ensure_ascii=False))
+
+    def flush(self):
+        """
+        Scrive su disco le modifiche in sospeso
+        """
+        with self._lock:
+            if self._dirty:
+                self.save()
+            else:
+                self._cancel_flush()
+
+    def close(self):
+        self.flush()
+
+    def _schedule_flush(self):
+        if self.flush_delay <= 0:
+            self.save()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self._flush_in_background)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"⚠️ Unable to save metadata index {self.path}: {e}")
+
+    def _cancel_flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _remove(self, doc_id: str):
+        entry = self._documents.pop(doc_id, None)
+        if not entry:
+            return
+        for field, values in entry.items():
+            for value in values:
+                postings = self._inverted[field].get(value)
+                if postings is not None:
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._inverted[field][value]
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            print(f"⚠️ Metadata index {self.path} has an unsupported version, it will be rebuilt")
+            return
+        for doc_id, fields in data.get('documents', {}).items():
+            self.add(doc_id, fields, persist=False)
+        self._dirty = False
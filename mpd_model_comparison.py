@@ -0,0 +1,235 @@
+# Confronto A/B tra modelli per la generazione di prompt e post
+# Esegue gli stessi input su più modelli in parallelo e raccoglie latenza,
+# throughput (token/s) e lunghezza dell'output
+
+import argparse
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+from mpd_config import Config
+from mpd_rag_system import GenerationError
+from mpd_scheduler import Priority, scheduler_priority, track_queue_time
+
+
+def parse_models(models) -> List[str]:
+    """
+    Accetta una lista o una stringa separata da virgole/a capo e restituisce i modelli univoci
+    """
+    if isinstance(models, str):
+        models = models.replace('\n', ',').split(',')
+    return list(dict.fromkeys(model.strip() for model in models if model and model.strip()))
+
+
+def response_metrics(response, latency: float, queue_time: float = 0.0) -> Dict:
+    """
+    Estrae le metriche di una risposta Ollama (le durate sono in nanosecondi).
+    latency esclude l'attesa nella coda dello scheduler, riportata a parte in queue_s
+    """
+    text = response.get('response') or ''
+    eval_count = response.get('eval_count') or 0
+    eval_duration = response.get('eval_duration') or 0
+    prompt_eval_count = response.get('prompt_eval_count') or 0
+    prompt_eval_duration = response.get('prompt_eval_duration') or 0
+
+    return {
+        'latency_s': round(latency, 3),
+        'queue_s': round(queue_time, 3),
+        'output_chars': len(text),
+        'output_words': len(text.split()),
+        'eval_count': eval_count,
+        'tokens_per_sec': round(eval_count / (eval_duration / 1e9), 2) if eval_duration else None,
+        'prompt_eval_count': prompt_eval_count,
+        'prompt_eval_ms': round(prompt_eval_duration / 1e6, 1) if prompt_eval_duration else None,
+        'load_ms': round((response.get('load_duration') or 0) / 1e6, 1),
+    }
+
+
+class ModelComparisonRunner:
+    """
+    Esegue generazione del prompt e del post con una lista di modelli,
+    partendo dallo stesso contesto (retrieval + analisi del brand voice).
+    Le chiamate dei modelli hanno priorità batch, per non rallentare il lavoro interattivo.
+    """
+
+    def __init__(self, rag_system, report_dir: str = Config.COMPARISON_REPORT_DIR,
+                 max_workers: int = Config.COMPARISON_MAX_WORKERS, priority: Priority = Priority.BATCH):
+        self.rag_system = rag_system
+        self.report_dir = report_dir
+        self.max_workers = max_workers
+        self.priority = priority
+
+    def run(self,
+            models,
+            product_name: str,
+            perfumer_name: str,
+            brand_values: str,
+            product_description: str,
+            olfactory_pyramid: str,
+            keywords: str,
+            post_destination: str,
+            generate_post: bool = True) -> Dict:
+        """
+        Confronta i modelli e restituisce il report completo
+        """
+        models = parse_models(models)
+        if not models:
+            raise ValueError("No models to compare")
+
+        inputs = {"product_name": product_name,
+                  "perfumer_name": perfumer_name,
+                  "brand_values": brand_values,
+                  "product_description": product_description,
+                  "olfactory_pyramid": olfactory_pyramid,
+                  "keywords": keywords,
+                  "post_destination": post_destination}
+
+        # Il contesto è condiviso: le differenze misurate dipendono solo dal modello
+        started = time.perf_counter()
+        context = self.rag_system.prepare_generation_context(product_name, brand_values, product_description,
+                                                             olfactory_pyramid=olfactory_pyramid,
+                                                             perfumer_name=perfumer_name)
+        context_latency = time.perf_counter() - started
+
+        system, generation_prompt, template = self.rag_system.render_generation_request(context, **inputs)
+
+        workers = max(1, min(len(models), self.max_workers))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compare") as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self._run_model,
+                                       model, system, generation_prompt, generate_post) for model in models]
+            results = [future.result() for future in futures]
+
+        return {
+            'created_at': datetime.now().isoformat(),
+            'inputs': inputs,
+            'template': os.path.basename(template.path),
+            'template_version': template.version,
+            'prefix_reuse': system is not None,
+            'context_latency_s': round(context_latency, 3),
+            'similar_posts': [post['metadata'].get('post_id') for post in context['similar_posts']],
+            'results': results,
+        }
+
+    def _run_model(self, model: str, system, generation_prompt: str, generate_post: bool) -> Dict:
+        result = {'model': model, 'prompt': None, 'post': None, 'prompt_text': '', 'post_text': '', 'error': None}
+        try:
+            with scheduler_priority(self.priority):
+                self._generate(result, model, system, generation_prompt, generate_post)
+        except Exception as e:
+            result['error'] = str(e)
+
+        return result
+
+    def _generate(self, result: Dict, model: str, system, generation_prompt: str, generate_post: bool):
+        response, latency, queue_time = self._timed_call(model, generation_prompt, self.rag_system.PROMPT_OPTIONS,
+                                                         timeout=self.rag_system.PROMPT_TIMEOUT,
+                                                         operation='prompt', system=system)
+        result['prompt'] = response_metrics(response, latency, queue_time)
+        result['prompt_text'] = response['response']
+
+        if generate_post:
+            response, latency, queue_time = self._timed_call(model, result['prompt_text'],
+                                                             self.rag_system.POST_OPTIONS, operation='post')
+            result['post'] = response_metrics(response, latency, queue_time)
+            result['post_text'] = response['response']
+
+    def _timed_call(self, model: str, prompt: str, options: Dict, **kwargs):
+        """
+        Chiamata al modello; restituisce (risposta, latenza, attesa in coda).
+        L'attesa dipende dall'ordine in cui i modelli ottengono lo slot, quindi è esclusa dalla latenza
+        """
+        with track_queue_time() as waits:
+            started = time.perf_counter()
+            response = self.rag_system.call_llm(model, prompt, options, **kwargs)
+            elapsed = time.perf_counter() - started
+        queue_time = sum(waits)
+        return response, elapsed - queue_time, queue_time
+
+    def save_report(self, report: Dict) -> str:
+        """
+        Salva il report JSON e restituisce il path del file
+        """
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"model_comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
+
+
+TABLE_HEADERS = ["Model", "Prompt latency (s)", "Prompt queue (s)", "Prompt tok/s", "Prompt chars",
+                 "Prompt eval (ms)", "Post latency (s)", "Post queue (s)", "Post tok/s", "Post chars",
+                 "Total latency (s)", "Error"]
+
+
+def report_rows(report: Dict) -> List[List]:
+    """
+    Righe della tabella comparativa, ordinate per latenza totale
+    """
+    rows = []
+    for result in report['results']:
+        prompt = result['prompt'] or {}
+        post = result['post'] or {}
+        total = (prompt.get('latency_s') or 0) + (post.get('latency_s') or 0)
+        rows.append([result['model'],
+                     prompt.get('latency_s'), prompt.get('queue_s'), prompt.get('tokens_per_sec'),
+                     prompt.get('output_chars'), prompt.get('prompt_eval_ms'),
+                     post.get('latency_s'), post.get('queue_s'), post.get('tokens_per_sec'), post.get('output_chars'),
+                     round(total, 3) if not result['error'] else None,
+                     result['error'] or ''])
+    return sorted(rows, key=lambda row: (row[10] is None, row[10] or 0))
+
+
+def report_markdown(report: Dict) -> str:
+    """
+    Output affiancati dei modelli, per la valutazione qualitativa
+    """
+    sections = []
+    for result in report['results']:
+        if result['error']:
+            body = f"❌ {result['error']}"
+        else:
+            body = f"**Prompt:**\n\n{result['prompt_text']}\n\n**Post:**\n\n{result['post_text'] or '-'}"
+        sections.append(f"### 🤖 {result['model']}\n\n{body}")
+    return "\n\n---\n\n".join(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare models on the same prompt/post generation inputs")
+    parser.add_argument("--models", required=True, help="Comma separated list of Ollama models")
+    parser.add_argument("--input", required=True,
+                        help="JSON file with product_name, perfumer_name, brand_values, product_description, "
+                             "olfactory_pyramid, keywords, post_destination")
+    parser.add_argument("--no-post", action="store_true", help="Compare prompt generation only")
+    parser.add_argument("--report-dir", default=Config.COMPARISON_REPORT_DIR)
+    args = parser.parse_args()
+
+    from mpd_rag_system import InstagramPromptGenerator
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        inputs = json.load(f)
+
+    inputs.setdefault("perfumer_name", "Not specified")
+    inputs.setdefault("olfactory_pyramid", "To be defined")
+    inputs.setdefault("keywords", "")
+    inputs.setdefault("post_destination", Config.POST_DESTINATIONS[0])
+
+    runner = ModelComparisonRunner(InstagramPromptGenerator(), report_dir=args.report_dir)
+    try:
+        report = runner.run(args.models, generate_post=not args.no_post, **inputs)
+    except GenerationError as e:
+        print(str(e))
+        raise SystemExit(1)
+
+    path = runner.save_report(report)
+    print(" | ".join(TABLE_HEADERS))
+    for row in report_rows(report):
+        print(" | ".join('' if value is None else str(value) for value in row))
+    print(f"\n📄 Report saved: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Schema JSON del post generato e validazione delle singole sezioni
+# Il modello risponde con un oggetto JSON (format di Ollama) le cui chiavi sono le sezioni
+# di extract_post_structure; le sezioni vengono validate man mano che lo stream le completa
+
+import json
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Sezioni richieste da system_prompt.txt, nell'ordine in cui devono comparire nel post
+POST_SECTIONS = [
+    ('title', "Introductory line: must begin with “Unique, one of a kind with Moellhausen: "
+              "[PRODUCT NAME] by [Perfumer’s Brand or Name]”"),
+    ('brand_values', "Brief paragraph presenting the brand values to highlight"),
+    ('introduction', "Poetic introduction presenting the perfumer and the inspiration behind the fragrance"),
+    ('description', "Detailed sensory description of the fragrance, its personality and atmosphere"),
+    ('olfactory_pyramid', "Refined presentation of the composition naming top, heart and base notes"),
+    ('closing', "Closing statement on craftsmanship, creativity and artistic perfumery"),
+]
+SECTION_KEYS = [key for key, _ in POST_SECTIONS]
+
+# Lunghezza minima (caratteri) di ciascuna sezione
+MIN_SECTION_LENGTH = {
+    'title': 30,
+    'brand_values': 40,
+    'introduction': 80,
+    'description': 120,
+    'olfactory_pyramid': 60,
+    'closing': 40,
+}
+
+_FORMULA = re.compile(r"^\W*unique,?\s+one\s+of\s+a\s+kind\s+with\s+moellhausen\s*:\s*\S.*\bby\b\s*\S",
+                      re.IGNORECASE | re.DOTALL)
+_PYRAMID_LEVELS = {
+    'top': re.compile(r'\b(top|head)\b', re.IGNORECASE),
+    'heart': re.compile(r'\b(heart|middle)\b', re.IGNORECASE),
+    'base': re.compile(r'\b(base|bottom|drydown|dry-down)\b', re.IGNORECASE),
+}
+_MARKDOWN_HEADER = re.compile(r'^\s*#{1,6}\s', re.MULTILINE)
+
+# Coppia chiave/valore stringa completa, ancorata alla posizione corrente del buffer
+_KEY_VALUE = re.compile(r'\s*[{,]?\s*"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+
+def build_schema(keys: Optional[Iterable[str]] = None) -> Dict:
+    """
+    Schema JSON da passare come `format` a Ollama, limitato alle sezioni indicate
+    """
+    keys = [key for key in SECTION_KEYS if keys is None or key in set(keys)]
+    descriptions = dict(POST_SECTIONS)
+    return {
+        'type': 'object',
+        'properties': {key: {'type': 'string', 'description': descriptions[key]} for key in keys},
+        'required': keys,
+        'additionalProperties': False,
+    }
+
+
+def validate_section(key: str, value: str) -> Optional[str]:
+    """
+    Restituisce il motivo per cui la sezione non è valida, o None se è corretta
+    """
+    value = (value or '').strip()
+    if key not in MIN_SECTION_LENGTH:
+        return f"unexpected section '{key}'"
+    if len(value) < MIN_SECTION_LENGTH[key]:
+        return f"too short ({len(value)} characters, at least {MIN_SECTION_LENGTH[key]} required)"
+    if _MARKDOWN_HEADER.search(value):
+        return "contains markdown section titles"
+    if key == 'title' and not _FORMULA.match(value):
+        return "must begin with “Unique, one of a kind with Moellhausen: [PRODUCT NAME] by [Perfumer]”"
+    if key == 'olfactory_pyramid':
+        missing = [level for level, pattern in _PYRAMID_LEVELS.items() if not pattern.search(value)]
+        if missing:
+            return f"missing {', '.join(missing)} notes"
+    return None
+
+
+def render_post(sections: Dict[str, str]) -> str:
+    """
+    Testo finale del post: sezioni nell'ordine previsto, senza titoli markdown
+    """
+    return "\n\n".join(sections[key].strip() for key in SECTION_KEYS if sections.get(key, '').strip())
+
+
+def repair_prompt(prompt: str, accepted: Dict[str, str], errors: Dict[str, str]) -> str:
+    """
+    Prompt per rigenerare solo le sezioni mancanti o non valide, mantenendo quelle già accettate
+    """
+    lines = [prompt, "", "---", "",
+             "The following sections of the post have already been written and approved. "
+             "Keep them as context and do NOT repeat them:"]
+    lines.append(json.dumps({key: accepted[key] for key in SECTION_KEYS if key in accepted},
+                            ensure_ascii=False, indent=2))
+    lines.append("")
+    lines.append("Write ONLY these sections:")
+    for key in SECTION_KEYS:
+        if key in errors:
+            reason = errors[key]
+            lines.append(f"- {key}: {dict(POST_SECTIONS)[key]}" + (f" (previous attempt {reason})" if reason else ""))
+    return "\n".join(lines)
+
+
+class IncrementalSectionParser:
+    """
+    Estrae le sezioni dal JSON in streaming non appena il loro valore stringa è completo
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self._pos = 0
+        self.sections: Dict[str, str] = {}
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """
+        Aggiunge un frammento della risposta e restituisce le sezioni appena completate
+        """
+        self.buffer += chunk
+        completed = []
+        while True:
+            match = _KEY_VALUE.match(self.buffer, self._pos)
+            if match is None:
+                break
+            key = match.group(1)
+            try:
+                value = json.loads(f'"{match.group(2)}"')
+            except json.JSONDecodeError:
+                value = match.group(2)
+            self._pos = match.end()
+            self.sections[key] = value
+            completed.append((key, value))
+        return completed
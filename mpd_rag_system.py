@@ -1,15 +1,130 @@
 # Instagram Prompt Generator - Sistema RAG per Moellhausen
 # Integra Ollama + ChromaDB + Gradio per generare prompt ottimali
 
+import contextvars
 import os
+import queue
+import sqlite3
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional
 
 import chromadb
 import ollama
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - su Windows non c'è esclusione tra processi
+    fcntl = None
+from chromadb.api.shared_system_client import SharedSystemClient
 from chromadb.utils.embedding_functions import OllamaEmbeddingFunction
 
 from mpd_config import Config
+from mpd_embeddings import BatchingEmbeddingFunction
+from mpd_metadata_index import MetadataIndex, extract_structured_fields, product_query_fields
+from mpd_post_schema import (SECTION_KEYS, IncrementalSectionParser, build_schema, render_post, repair_prompt,
+                             validate_section)
+from mpd_snapshot import read_collection, write_records
+from mpd_scheduler import LLMScheduler, Priority, SchedulerOverloaded, get_scheduler, scheduler_priority
+from mpd_templates import PromptTemplateRegistry, get_registry, ANALYSIS_PLACEHOLDERS, GENERATION_PLACEHOLDERS
+
+
+class GenerationError(Exception):
+    """
+    Errore di generazione con messaggio già pronto per l'utente
+    """
+
+
+class DatabaseLocked(RuntimeError):
+    """
+    Il database Chroma è usato da un altro processo in modo incompatibile (compattazione da CLI)
+    """
+
+
+# File di lock nella directory del database: condiviso da chi lo usa, esclusivo per la compattazione da CLI
+DATABASE_LOCK_FILE = "mpd.lock"
+
+
+def _open_database_lock(chroma_path: str):
+    """
+    Prende il lock condiviso sul database; solleva DatabaseLocked se un altro processo lo sta compattando
+    """
+    if fcntl is None:
+        return None
+    handle = open(os.path.join(chroma_path, DATABASE_LOCK_FILE), 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        raise DatabaseLocked(f"❌ Database {chroma_path} is being compacted by another process, "
+                             f"retry when it has finished")
+    return handle
+
+
+class _CollectionGuard:
+    """
+    Le letture sulla collection procedono in parallelo; lo scambio della compattazione
+    attende che terminino e blocca le nuove finché la collection non è stata sostituita
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._swapping = False
+        self._local = threading.local()
+
+    @contextmanager
+    def reading(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            with self._condition:
+                while self._swapping:
+                    self._condition.wait()
+                self._readers += 1
+        # Le letture annidate dello stesso thread non attendono (eviterebbero lo scambio all'infinito)
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._condition:
+                    self._readers -= 1
+                    self._condition.notify_all()
+
+    @contextmanager
+    def swapping(self):
+        with self._condition:
+            self._swapping = True
+            while self._readers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._swapping = False
+                self._condition.notify_all()
+
+
+# Prefissi (host, modello, versione della parte fissa) già valutati da Ollama,
+# condivisi tra i tenant dello stesso processo
+_primed_prefixes = set()
+_primed_prefixes_lock = threading.Lock()
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
 
 
 class InstagramPromptGenerator:
@@ -18,6 +133,12 @@ class InstagramPromptGenerator:
     mantenendo il tone of voice di Moellhausen
     """
 
+    # Opzioni Ollama per ciascuna chiamata LLM
+    ANALYSIS_OPTIONS = {'temperature': 0.3}
+    PROMPT_OPTIONS = {'temperature': 0.4, 'num_predict': 2000}
+    POST_OPTIONS = {'temperature': 0.3}
+    PROMPT_TIMEOUT = 300
+
     def __init__(
         self,
         chroma_path: str = Config.CHROMA_DB_PATH,
@@ -28,7 +149,11 @@ class InstagramPromptGenerator:
         analysis_prompt: str = Config.ANALYSIS_PROMPT_FILE,
         generation_prompt: str = Config.GENERATION_PROMPT_FILE,
         post_generation_model: str = Config.POST_MODEL,
-        perplexity_api_key: str = Config.PERPLEXITY_API_KEY
+        perplexity_api_key: str = Config.PERPLEXITY_API_KEY,
+        templates: PromptTemplateRegistry = None,
+        scheduler: LLMScheduler = None,
+        embedding_function=None,
+        warm_prefixes: bool = False
     ):
 
         self.chroma_path = chroma_path
@@ -41,18 +166,44 @@ class InstagramPromptGenerator:
         self.post_generation_model = post_generation_model
         self.perplexity_api_key = perplexity_api_key
 
+        # Template di prompt compilati e condivisi, con ricarica automatica
+        self.templates = templates or get_registry()
+        self.templates.register(self.analysis_prompt, ANALYSIS_PLACEHOLDERS)
+        self.templates.register(self.generation_prompt, GENERATION_PLACEHOLDERS)
+
+        # Scheduler condiviso davanti alle chiamate Ollama (priorità e limiti di concorrenza)
+        self.scheduler = scheduler or get_scheduler(ollama_host)
+
+        # Storico delle generazioni recenti con la versione dei template usata
+        self.generation_log = deque(maxlen=Config.GENERATION_LOG_SIZE)
+
         # Configura client Ollama (per server remoto)
         if ollama_host != "http://localhost:11434":
             os.environ['OLLAMA_HOST'] = ollama_host
 
-        embedding_func = OllamaEmbeddingFunction(
-            model_name=Config.EMBEDDING_MODEL,
-            url=Config.OLLAMA_HOST
-        )
+        embedding_func = embedding_function
+        if embedding_func is None:
+            embedding_func = OllamaEmbeddingFunction(
+                model_name=self.embedding_model,
+                url=self.ollama_host
+            )
+        # La collection riceve la funzione originale, di cui Chroma persiste nome e configurazione
+        self.collection_embedding_function = embedding_func
+        self.embedding_function = embedding_func
+        if embedding_function is None and Config.EMBED_BATCHING:
+            # Gli embedding calcolati dall'applicazione (query e ingestion) vengono uniti in chiamate batch
+            self.embedding_function = BatchingEmbeddingFunction(embedding_func)
+
+        # Serializza le scritture (aggiunte, aggiornamenti, eliminazioni, compattazione)
+        self._write_lock = threading.RLock()
+        # Le letture non usano mai una collection eliminata dalla compattazione
+        self._collection_guard = _CollectionGuard()
 
         # Inizializza ChromaDB
         os.makedirs(chroma_path, exist_ok=True)
+        self._database_lock = _open_database_lock(chroma_path)
         self.chroma_client = chromadb.PersistentClient(path=chroma_path)
+        self._recover_compaction()
 
         # Crea o ottieni la collection
         try:
@@ -60,11 +211,22 @@ class InstagramPromptGenerator:
                 name=self.collection_name,
                 embedding_function=embedding_func
             )
-            print(f"Collection '{self.collection_name}' ready to be embedded via Ollama.\nModel: {Config.EMBEDDING_MODEL}")
+            print(f"Collection '{self.collection_name}' ready to be embedded via Ollama.\nModel: {self.embedding_model}")
         except Exception as e:
             print(f"Error during collection creation/retrieve: {e}")
             raise
 
+        # Indice invertito su note olfattive, profumiere e tag
+        self.metadata_index = MetadataIndex(
+            os.path.join(chroma_path, f"{self.collection_name}_metadata_index.json"),
+            flush_delay=Config.METADATA_INDEX_FLUSH_DELAY)
+        if len(self.metadata_index) != self.collection.count():
+            self.rebuild_metadata_index()
+
+        # Solo l'applicazione lo richiede: strumenti CLI, valutazioni e test non devono chiamare Ollama
+        if warm_prefixes and Config.PROMPT_PREFIX_REUSE and Config.PROMPT_PREFIX_WARMUP:
+            self.warm_prompt_prefixes()
+
     def extract_post_structure(self, post_text: str) -> Dict[str, str]:
         """
         Estrae la struttura del post Instagram utilizzando le sezioni markdown
@@ -113,55 +275,323 @@ class InstagramPromptGenerator:
 
         return sections
 
-    def add_post_to_database(self, post_text: str, post_name: str = "", document_type: str = "") -> str:
+    @staticmethod
+    def new_post_id(post_name: str = "") -> str:
+        """
+        Crea un ID univoco anche per documenti aggiunti nello stesso secondo
+        """
+        post_id = f"post_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:6]}"
+        return f"{post_name}_{post_id}" if post_name else post_id
+
+    def build_document_record(self, post_id: str, post_text: str, post_name: str = "", document_type: str = ""):
+        """
+        Metadati e campi strutturati di un documento, usati sia in inserimento che in aggiornamento
+        """
+        # Estrai la struttura del post
+        structure = self.extract_post_structure(post_text)
+        structured_fields = extract_structured_fields(post_text, structure)
+
+        # Crea metadati con le informazioni estratte
+        metadata = {
+            'post_id': post_id,
+            'title': structure['title'][:200] if structure['title'] else 'Untitled',
+            'brand_values': structure['brand_values'][:300] if structure['brand_values'] else '',
+            'date_added': datetime.now().isoformat(),
+            'word_count': len(post_text.split()),
+            'has_olfactory_pyramid': bool(structure['olfactory_pyramid']),
+            'post_name': post_name or 'Unknown',
+            'document_type': document_type,
+            'perfumer': ', '.join(structured_fields['perfumer'])[:200],
+            'top_notes': ', '.join(structured_fields['top_notes'])[:300],
+            'heart_notes': ', '.join(structured_fields['heart_notes'])[:300],
+            'base_notes': ', '.join(structured_fields['base_notes'])[:300],
+        }
+        return metadata, structured_fields
+
+    def add_post_to_database(self, post_text: str, post_name: str = "", document_type: str = "",
+                             post_id: str = None) -> str:
         """
-        Aggiunge un singolo post al database ChromaDB
+        Aggiunge un singolo post al database ChromaDB (con un ID univoco, se non indicato)
         """
         try:
-            # Crea un ID univoco
-            post_id = f"post_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            if post_name:
-                post_id = f"{post_name}_{post_id}"
-
-            # Estrai la struttura del post
-            structure = self.extract_post_structure(post_text)
-
-            # Crea metadati con le informazioni estratte
-            metadata = {
-                'post_id': post_id,
-                'title': structure['title'][:200] if structure['title'] else 'Untitled',
-                'brand_values': structure['brand_values'][:300] if structure['brand_values'] else '',
-                'date_added': datetime.now().isoformat(),
-                'word_count': len(post_text.split()),
-                'has_olfactory_pyramid': bool(structure['olfactory_pyramid']),
-                'post_name': post_name or 'Unknown',
-                'document_type': document_type
-            }
+            post_id = post_id or self.new_post_id(post_name)
+            metadata, structured_fields = self.build_document_record(post_id, post_text, post_name, document_type)
+            embeddings = self.embedding_function([post_text])
 
             # Aggiungi alla collection ChromaDB
-            self.collection.add(
-                documents=[post_text],
-                metadatas=[metadata],
-                ids=[post_id]
-            )
+            with self._write_lock:
+                self.collection.add(
+                    documents=[post_text],
+                    embeddings=embeddings,
+                    metadatas=[metadata],
+                    ids=[post_id]
+                )
+                self.metadata_index.add(post_id, structured_fields)
 
-            return f"✅ Successfully added post '{structure['title'][:50]}...' (ID: {post_id})"
+            return f"✅ Successfully added post '{metadata['title'][:50]}...' (ID: {post_id})"
 
         except Exception as e:
             return f"❌ Error adding post: {str(e)}"
 
+    def get_document(self, post_id: str) -> Optional[Dict]:
+        """
+        Restituisce testo e metadati di un documento, o None se non esiste
+        """
+        with self._collection_guard.reading():
+            result = self.collection.get(ids=[post_id], include=["documents", "metadatas"])
+        if not result['ids']:
+            return None
+        return {'id': post_id, 'document': result['documents'][0], 'metadata': result['metadatas'][0] or {}}
+
+    def list_documents(self, document_type: str = None) -> List[Dict]:
+        """
+        Elenco dei documenti (ID e metadati principali), dal più recente
+        """
+        where = {"document_type": document_type} if document_type else None
+        documents = []
+        with self._collection_guard.reading():
+            total = self.collection.count()
+            for offset in range(0, total, Config.SNAPSHOT_BATCH_SIZE):
+                batch = self.collection.get(where=where, limit=Config.SNAPSHOT_BATCH_SIZE, offset=offset,
+                                            include=["metadatas"])
+                if not batch['ids']:
+                    break
+                for doc_id, metadata in zip(batch['ids'], batch['metadatas']):
+                    metadata = metadata or {}
+                    documents.append({'id': doc_id,
+                                      'post_name': metadata.get('post_name', ''),
+                                      'document_type': metadata.get('document_type', ''),
+                                      'title': metadata.get('title', ''),
+                                      'date_added': metadata.get('date_added', '')})
+        return sorted(documents, key=lambda document: document['date_added'], reverse=True)
+
+    def update_post(self, post_id: str, post_text: str, post_name: str = None, document_type: str = None) -> str:
+        """
+        Sostituisce testo (ed embedding) di un documento esistente mantenendone l'ID.
+        Nome e tipo restano quelli attuali se non indicati.
+        """
+        try:
+            existing = self.get_document(post_id)
+            if existing is None:
+                return f"❌ Document not found: {post_id}"
+
+            previous = existing['metadata']
+            metadata, structured_fields = self.build_document_record(
+                post_id, post_text,
+                post_name or previous.get('post_name', ''),
+                previous.get('document_type', '') if document_type is None else document_type)
+            metadata['date_added'] = previous.get('date_added', metadata['date_added'])
+            metadata['date_updated'] = datetime.now().isoformat()
+            embeddings = self.embedding_function([post_text])
+
+            with self._write_lock:
+                self.collection.update(ids=[post_id], documents=[post_text], embeddings=embeddings,
+                                       metadatas=[metadata])
+                self.metadata_index.add(post_id, structured_fields)
+
+            return f"✅ Successfully updated '{metadata['title'][:50]}...' (ID: {post_id})"
+
+        except Exception as e:
+            return f"❌ Error updating document: {str(e)}"
+
+    def delete_posts(self, post_ids: List[str]) -> str:
+        """
+        Elimina i documenti indicati dalla collection e dall'indice strutturato
+        """
+        try:
+            post_ids = list(dict.fromkeys(post_id for post_id in post_ids if post_id))
+            if not post_ids:
+                return "❌ No document selected"
+
+            with self._write_lock:
+                existing = self.collection.get(ids=post_ids, include=[])['ids']
+                if not existing:
+                    return "❌ No matching documents found"
+                self.collection.delete(ids=existing)
+                self.metadata_index.remove(existing)
+
+            missing = len(post_ids) - len(existing)
+            return f"✅ Deleted {len(existing)} document(s)" + (f" ({missing} not found)" if missing else "")
+
+        except Exception as e:
+            return f"❌ Error deleting documents: {str(e)}"
+
+    def delete_posts_by_metadata(self, where: Dict) -> str:
+        """
+        Elimina tutti i documenti i cui metadati soddisfano il filtro (sintassi where di Chroma)
+        """
+        if not where:
+            # Un filtro vuoto cancellerebbe l'intera collection
+            return "❌ A metadata filter is required for bulk delete"
+
+        try:
+            with self._write_lock:
+                ids = self.collection.get(where=where, include=[])['ids']
+                if not ids:
+                    return "❌ No documents match the filter"
+                for start in range(0, len(ids), Config.SNAPSHOT_BATCH_SIZE):
+                    self.collection.delete(ids=ids[start:start + Config.SNAPSHOT_BATCH_SIZE])
+                self.metadata_index.remove(ids)
+
+            return f"✅ Deleted {len(ids)} document(s) matching {where}"
+
+        except Exception as e:
+            return f"❌ Error deleting documents: {str(e)}"
+
+    def compact_collection(self, exclusive: bool = False) -> Dict:
+        """
+        Ricostruisce la collection con i soli documenti vivi (nuovo indice ANN, nessun record
+        eliminato residuo) e compatta il database SQLite. Gli embedding vengono riutilizzati.
+        Conviene eseguirla quando il sistema non è sotto carico.
+        Con exclusive=True (strumenti CLI) richiede che nessun altro processo usi il database:
+        altrimenti solleva DatabaseLocked.
+        """
+        if exclusive:
+            self.lock_database_exclusive("compacting")
+
+        with self._write_lock:
+            started = datetime.now()
+            size_before = _directory_size(self.chroma_path)
+            records = read_collection(self.collection)
+
+            temporary_name = f"{self.collection_name}_compact_{started.strftime('%Y%m%d%H%M%S')}"
+            temporary = self.chroma_client.create_collection(
+                name=temporary_name,
+                embedding_function=self.collection_embedding_function,
+                metadata=self.collection.metadata or None
+            )
+            try:
+                write_records(temporary, records)
+                if temporary.count() != len(records['ids']):
+                    raise RuntimeError(f"compacted collection has {temporary.count()} documents, "
+                                       f"expected {len(records['ids'])}")
+            except Exception:
+                self.chroma_client.delete_collection(temporary_name)
+                raise
+
+            # Scambio: l'originale viene rinominata da parte, la nuova prende il suo nome e solo allora
+            # l'originale viene eliminata. Un'interruzione lascia sempre una collection completa, che
+            # _recover_compaction adotta al riavvio.
+            # Le letture in corso terminano prima dello scambio e le nuove attendono anche il VACUUM
+            # (che riscrive il file SQLite), poi usano la nuova collection.
+            old_name = f"{self.collection_name}_old_{started.strftime('%Y%m%d%H%M%S')}"
+            with self._collection_guard.swapping():
+                self.collection.modify(name=old_name)
+                try:
+                    temporary.modify(name=self.collection_name)
+                except Exception:
+                    self.collection.modify(name=self.collection_name)
+                    self.chroma_client.delete_collection(temporary_name)
+                    raise
+                self.collection = temporary
+                self.chroma_client.delete_collection(old_name)
+                vacuumed = self._vacuum_database()
+
+            if len(self.metadata_index) != len(records['ids']):
+                self.rebuild_metadata_index()
+
+            size_after = _directory_size(self.chroma_path)
+
+        report = {'documents': len(records['ids']),
+                  'size_before_mb': round(size_before / 1024 ** 2, 2),
+                  'size_after_mb': round(size_after / 1024 ** 2, 2),
+                  'vacuumed': vacuumed,
+                  'duration_s': round((datetime.now() - started).total_seconds(), 2)}
+        print(f"🧹 Collection '{self.collection_name}' compacted: {report}")
+        return report
+
+    def _recover_compaction(self):
+        """
+        Dopo una compattazione interrotta: se la collection principale manca o è vuota adotta la
+        collection residua (_old_ o _compact_) con più documenti, poi elimina le altre.
+        Solo se nessun altro processo usa il database, che potrebbe avere una compattazione in corso.
+        """
+        leftovers = {}
+        for collection in self.chroma_client.list_collections():
+            for kind in ("old", "compact"):
+                prefix = f"{self.collection_name}_{kind}_"
+                if collection.name.startswith(prefix) and collection.name[len(prefix):].isdigit():
+                    leftovers[collection.name] = self.chroma_client.get_collection(collection.name).count()
+        if not leftovers:
+            return
+        if self._database_lock is not None:
+            try:
+                fcntl.flock(self._database_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print(f"⚠️ Collections left by an interrupted compaction ({', '.join(sorted(leftovers))}): "
+                      f"the database is in use, they will be recovered at the next start")
+                return
+        try:
+            self._adopt_leftovers(leftovers)
+        finally:
+            if self._database_lock is not None:
+                fcntl.flock(self._database_lock, fcntl.LOCK_SH)
+
+    def _adopt_leftovers(self, leftovers: Dict[str, int]):
+        try:
+            current = self.chroma_client.get_collection(self.collection_name).count()
+        except Exception:
+            current = None
+        if not current:
+            # A parità di documenti si preferisce l'originale (_old_), sicuramente completa
+            adopted = max(leftovers, key=lambda name: (leftovers[name], "_old_" in name))
+            if current is not None:
+                self.chroma_client.delete_collection(self.collection_name)
+            self.chroma_client.get_collection(adopted).modify(name=self.collection_name)
+            print(f"♻️ Collection '{self.collection_name}' restored from '{adopted}' "
+                  f"({leftovers.pop(adopted)} documents) after an interrupted compaction")
+
+        for name in leftovers:
+            self.chroma_client.delete_collection(name)
+            print(f"🧹 Removed '{name}' left by an interrupted compaction")
+
+    def lock_database_exclusive(self, operation: str):
+        """
+        Per gli strumenti CLI che riscrivono il database: solleva DatabaseLocked se un altro processo lo usa
+        """
+        if self._database_lock is None:
+            return
+        try:
+            fcntl.flock(self._database_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise DatabaseLocked(f"❌ Database {self.chroma_path} is in use by another process: "
+                                 f"stop the application before {operation} from the command line")
+
+    def _vacuum_database(self) -> bool:
+        path = os.path.join(self.chroma_path, "chroma.sqlite3")
+        if not os.path.exists(path):
+            return False
+        try:
+            connection = sqlite3.connect(path, timeout=30)
+            try:
+                connection.execute("VACUUM")
+            finally:
+                connection.close()
+            return True
+        except sqlite3.Error as e:
+            print(f"⚠️ Unable to vacuum {path}: {e}")
+            return False
+
+    def count_documents(self) -> int:
+        """
+        Numero di documenti indicizzati
+        """
+        with self._collection_guard.reading():
+            return self.collection.count()
+
     def get_collection_stats(self) -> str:
         """
         Ottiene statistiche sulla collection
         """
         try:
-            count = self.collection.count()
-            if count == 0:
-                return "📊 Empty database - No indexed post"
+            with self._collection_guard.reading():
+                count = self.collection.count()
+                if count == 0:
+                    return "📊 Empty database - No indexed post"
 
-            # Prova a ottenere alcuni metadati per le statistiche
-            #sample = self.collection.get(limit=min(count, 5))
-            sample = self.collection.get()
+                # Prova a ottenere alcuni metadati per le statistiche
+                #sample = self.collection.get(limit=min(count, 5))
+                sample = self.collection.get()
             titles = [meta.get('title', 'N/A') + '\n' for meta in sample['metadatas']]
 
             stats = f"""📊 **Database statistics:**
@@ -176,25 +606,55 @@ class InstagramPromptGenerator:
         except Exception as e:
             return f"❌ Error in calculating statistics: {str(e)}"
 
-    def get_similar_posts(self, query: str, n_results: int = 3, restrictions: dict = None) -> List[Dict]:
+    def rebuild_metadata_index(self) -> int:
+        """
+        Ricostruisce l'indice strutturato leggendo tutti i documenti della collection
+        """
+        self.metadata_index.clear()
+        total = self.collection.count()
+        batch_size = Config.SNAPSHOT_BATCH_SIZE
+        for offset in range(0, total, batch_size):
+            batch = self.collection.get(limit=batch_size, offset=offset, include=["documents"])
+            for doc_id, document in zip(batch['ids'], batch['documents']):
+                structure = self.extract_post_structure(document or '')
+                self.metadata_index.add(doc_id, extract_structured_fields(document or '', structure), persist=False)
+        self.metadata_index.save()
+        print(f"🗂️ Metadata index rebuilt for '{self.collection_name}': {len(self.metadata_index)} documents")
+        return len(self.metadata_index)
+
+    def get_similar_posts(self, query: str, n_results: int = 3, restrictions: dict = None,
+                          candidate_ids: List[str] = None) -> List[Dict]:
         """
-        Recupera i post più simili dalla database
+        Recupera i post più simili dalla database.
+        Con candidate_ids la ricerca vettoriale è limitata ai documenti indicati.
         """
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=min(n_results, self.collection.count()),
-                where= restrictions
-            )
+            where = restrictions
+            # Embedding calcolato fuori dalla sezione di lettura, che non deve attendere il modello
+            query_embeddings = self.embedding_function([query])
+            with self._collection_guard.reading():
+                n_results = min(n_results, self.collection.count())
+                if candidate_ids is not None:
+                    candidate_filter = {"post_id": {"$in": list(candidate_ids)}}
+                    where = {"$and": [restrictions, candidate_filter]} if restrictions else candidate_filter
+                    n_results = min(n_results, len(candidate_ids))
+
+                results = self.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where= where
+                )
 
             similar_posts = []
             if results['documents'] and results['documents'][0]:
-                for i, (doc, metadata, distance) in enumerate(zip(
+                for i, (doc_id, doc, metadata, distance) in enumerate(zip(
+                    results['ids'][0],
                     results['documents'][0], 
                     results['metadatas'][0], 
                     results['distances'][0]
                 )):
                     similar_posts.append({
+                        'id': doc_id,
                         'document': doc,
                         'metadata': metadata,
                         'similarity_score': 1 - distance  # Converti distanza in similarità
@@ -206,6 +666,38 @@ class InstagramPromptGenerator:
             print(f"Error in retrieving similar posts: {str(e)}")
             return []
 
+    def retrieve_similar_posts(self, query: str, n_results: int = 3, restrictions: dict = None,
+                               olfactory_pyramid: str = "", perfumer_name: str = "",
+                               prefilter: bool = None, boost: float = None) -> List[Dict]:
+        """
+        Retrieval ibrido: i post che condividono note o profumiere con il nuovo prodotto
+        vengono pre-filtrati tramite l'indice strutturato e poi privilegiati nel ranking
+        """
+        prefilter = Config.STRUCTURED_PREFILTER if prefilter is None else prefilter
+        boost = Config.STRUCTURED_BOOST if boost is None else boost
+
+        # Piramide e profumiere non riconosciuti (o nessun post affine): solo ricerca vettoriale
+        query_fields = product_query_fields(olfactory_pyramid, perfumer_name)
+        scores = self.metadata_index.score(query_fields) if any(query_fields.values()) else {}
+
+        if prefilter and len(scores) >= n_results:
+            candidates = sorted(scores, key=scores.get, reverse=True)[:Config.PREFILTER_MAX_CANDIDATES]
+            similar_posts = self.get_similar_posts(query, n_results, restrictions, candidate_ids=candidates)
+            if len(similar_posts) < n_results:
+                # Le restrizioni hanno escluso troppi candidati: ricerca sull'intera collection
+                similar_posts = self.get_similar_posts(query, n_results, restrictions)
+        else:
+            similar_posts = self.get_similar_posts(query, n_results, restrictions)
+
+        if scores and boost:
+            top_score = max(scores.values())
+            for post in similar_posts:
+                post['structured_score'] = scores.get(post['id'], 0.0)
+                post['similarity_score'] += boost * post['structured_score'] / top_score
+            similar_posts.sort(key=lambda post: post['similarity_score'], reverse=True)
+
+        return similar_posts
+
     def analyze_brand_voice(self, posts: List[Dict]) -> str:
         """
         Analizza il tone of voice e le caratteristiche dei post usando Ollama
@@ -219,22 +711,144 @@ class InstagramPromptGenerator:
 
         analysis_prompt_variables = {'combined_text': combined_text}
 
-        analysis_prompt = self.load_prompt(self.analysis_prompt)
-
         try:
-            analysis_prompt = analysis_prompt.format(**analysis_prompt_variables)
-            client = ollama.Client(host=self.ollama_host)
-            response = client.generate(
-                model=self.analysis_model,
-                prompt=analysis_prompt,
-                options={'temperature': 0.3}
-            )
+            template = self.templates.get(self.analysis_prompt)
+            system, analysis_prompt = self.split_prompt(template, analysis_prompt_variables)
+            record = self.record_generation('brand_analysis', self.analysis_model, template)
+            response = self.call_llm(self.analysis_model, analysis_prompt, self.ANALYSIS_OPTIONS,
+                                     operation='analysis', system=system)
+            self.record_prompt_eval(record, response, self.analysis_model, template, system)
 
             return response['response']
 
+        except SchedulerOverloaded:
+            # Senza analisi non ha senso proseguire con la generazione
+            raise
         except Exception as e:
             return f"❌ Error in brand voice analysis: {str(e)}"
 
+    def build_retrieval_query(self, product_name: str, brand_values: str, product_description: str) -> str:
+        """
+        Costruisce la query per il recupero dei post simili
+        """
+        return f"{product_name} {brand_values} {product_description}"
+
+    def prepare_generation_context(self,
+                                   product_name: str,
+                                   brand_values: str,
+                                   product_description: str,
+                                   olfactory_pyramid: str = "",
+                                   perfumer_name: str = "") -> Dict:
+        """
+        Esegue retrieval e analisi del brand voice una sola volta,
+        in modo che il risultato possa essere condiviso tra più destinazioni.
+        Solleva GenerationError con il messaggio da mostrare all'utente.
+        """
+        # Verifica che ci siano dati nel database
+        count = self.count_documents()
+        if count == 0:
+            raise GenerationError("❌ **Error:** No posts in the database. Please upload some sample posts first in the “Document Upload” section.")
+
+        # Recupera post simili basati su prodotto e valori
+        query = self.build_retrieval_query(product_name, brand_values, product_description)
+        similar_posts = self.retrieve_similar_posts(query, n_results=3, restrictions={"document_type": "Post"},
+                                                    olfactory_pyramid=olfactory_pyramid,
+                                                    perfumer_name=perfumer_name)
+
+        if not similar_posts:
+            raise GenerationError("❌ **Error:** Unable to find similar posts in the database.")
+
+        post_examples = chr(10).join(
+            [f"ESEMPIO {i + 1}:{chr(10)}{post['document'][:1000]}..." for i, post in enumerate(similar_posts[:2])])
+
+        # Analizza il brand voice dei post simili
+        brand_analysis = self.analyze_brand_voice(similar_posts)
+
+        return {"similar_posts": similar_posts,
+                "post_examples": post_examples,
+                "brand_analysis": brand_analysis}
+
+    def render_generation_request(self,
+                                  context: Dict,
+                                  product_name: str,
+                                  perfumer_name: str,
+                                  brand_values: str,
+                                  product_description: str,
+                                  olfactory_pyramid: str,
+                                  keywords: str,
+                                  post_destination: str):
+        """
+        Compone il prompt di generazione per una destinazione.
+        Restituisce la parte system (None se il riutilizzo del prefisso è disattivato),
+        il prompt e il template usato.
+        """
+        generation_prompt_variables = {"product_name": product_name,
+                            "perfumer_name": perfumer_name,
+                            "brand_values": brand_values,
+                            "product_description": product_description,
+                            "olfactory_pyramid": olfactory_pyramid,
+                            "keywords": keywords,
+                            "brand_analysis": context["brand_analysis"],
+                            "post_examples": context["post_examples"],
+                            "post_destination": post_destination}
+
+        template = self.templates.get(self.generation_prompt)
+        system, prompt = self.split_prompt(template, generation_prompt_variables)
+        return system, prompt, template
+
+    def split_prompt(self, template, variables: Dict):
+        """
+        Separa la parte fissa del template (inviata come system prompt e riutilizzabile
+        da Ollama tra le richieste) dalla parte variabile
+        """
+        if Config.PROMPT_PREFIX_REUSE and template.system_source:
+            return template.render_parts(**variables)
+        return None, template.render(**variables)
+
+    def generate_prompt_from_context(self,
+                                     context: Dict,
+                                     product_name: str,
+                                     perfumer_name: str,
+                                     brand_values: str,
+                                     product_description: str,
+                                     olfactory_pyramid: str,
+                                     keywords: str,
+                                     post_destination: str,
+                                     model: str = None):
+        """
+        Genera il prompt per una singola destinazione a partire da un contesto già preparato.
+        Restituisce il testo e la versione del template effettivamente usato
+        (None se l'errore è avvenuto prima della composizione del prompt).
+        """
+        model = model or self.analysis_model
+        template = None
+        try:
+            # Crea il prompt ottimizzato
+            system, generation_prompt, template = self.render_generation_request(
+                context,
+                product_name=product_name,
+                perfumer_name=perfumer_name,
+                brand_values=brand_values,
+                product_description=product_description,
+                olfactory_pyramid=olfactory_pyramid,
+                keywords=keywords,
+                post_destination=post_destination)
+            record = self.record_generation('prompt', model, template, destination=post_destination)
+
+            print(generation_prompt)
+
+            #prompt = self.call_perplexity(prompt=generation_prompt)
+
+            response = self.call_llm(model, generation_prompt, self.PROMPT_OPTIONS, timeout=self.PROMPT_TIMEOUT,
+                                     operation='prompt', system=system)
+            self.record_prompt_eval(record, response, model, template, system)
+
+            return response['response'], template.version
+
+            #return prompt
+        except Exception as e:
+            return f"❌ **Error generating prompt:** {str(e)}", template.version if template else None
+
     def generate_optimized_prompt(self, 
                                 product_name: str,
                                 perfumer_name: str, 
@@ -247,79 +861,341 @@ class InstagramPromptGenerator:
         Genera un prompt ottimizzato per LLM commerciale
         """
         try:
-            # Verifica che ci siano dati nel database
-            count = self.collection.count()
-            if count == 0:
-                return "❌ **Error:** No posts in the database. Please upload some sample posts first in the “Document Upload” section."
+            context = self.prepare_generation_context(product_name, brand_values, product_description,
+                                                      olfactory_pyramid=olfactory_pyramid,
+                                                      perfumer_name=perfumer_name)
+        except GenerationError as e:
+            return str(e)
+        except Exception as e:
+            return f"❌ **Error generating prompt:** {str(e)}"
 
-            # Recupera post simili basati su prodotto e valori
-            query = f"{product_name} {brand_values} {product_description}"
-            similar_posts = self.get_similar_posts(query, n_results=3, restrictions={"document_type": "Post"})
+        prompt, _ = self.generate_prompt_from_context(context,
+                                                      product_name=product_name,
+                                                      perfumer_name=perfumer_name,
+                                                      brand_values=brand_values,
+                                                      product_description=product_description,
+                                                      olfactory_pyramid=olfactory_pyramid,
+                                                      keywords=keywords,
+                                                      post_destination=post_destination)
+        return prompt
 
-            if not similar_posts:
-                return "❌ **Error:** Unable to find similar posts in the database."
+    def generate_for_destinations(self,
+                                  product_name: str,
+                                  perfumer_name: str,
+                                  brand_values: str,
+                                  product_description: str,
+                                  olfactory_pyramid: str,
+                                  keywords: str,
+                                  post_destinations: List[str],
+                                  generate_post: bool = True) -> Iterator[Dict]:
+        """
+        Genera prompt (e opzionalmente post) per più destinazioni in una sola richiesta.
+        Retrieval e analisi del brand voice vengono eseguiti una volta sola, poi le
+        generazioni specifiche per destinazione girano in parallelo.
+        Restituisce gli eventi man mano che sono pronti:
+        {'destination': ..., 'stage': 'prompt' | 'post' | 'error', 'text': ...}
+        """
+        destinations = list(dict.fromkeys(post_destinations or []))
+        if not destinations:
+            return
 
-            post_examples = {chr(10).join(
-                [f"ESEMPIO {i + 1}:{chr(10)}{post['document'][:1000]}..." for i, post in enumerate(similar_posts[:2])])}
+        try:
+            context = self.prepare_generation_context(product_name, brand_values, product_description,
+                                                      olfactory_pyramid=olfactory_pyramid,
+                                                      perfumer_name=perfumer_name)
+        except Exception as e:
+            message = str(e) if isinstance(e, GenerationError) else f"❌ **Error generating prompt:** {str(e)}"
+            for destination in destinations:
+                yield {'destination': destination, 'stage': 'error', 'text': message}
+            return
 
-            # Analizza il brand voice dei post simili
-            brand_analysis = self.analyze_brand_voice(similar_posts)
+        events = queue.Queue()
 
-            generation_prompt_variables = {"product_name": product_name,
-                                "perfumer_name": perfumer_name,
-                                "brand_values": brand_values,
-                                "product_description": product_description,
-                                "olfactory_pyramid": olfactory_pyramid,
-                                "keywords": keywords,
-                                "brand_analysis": brand_analysis,
-                                "post_examples": post_examples,
-                                "post_destination": post_destination}
+        def run_destination(destination: str):
+            try:
+                prompt, template_version = self.generate_prompt_from_context(
+                    context,
+                    product_name=product_name,
+                    perfumer_name=perfumer_name,
+                    brand_values=brand_values,
+                    product_description=product_description,
+                    olfactory_pyramid=olfactory_pyramid,
+                    keywords=keywords,
+                    post_destination=destination)
+                # Versione del template usato per questa generazione, anche se nel frattempo è stato salvato
+                events.put({'destination': destination, 'stage': 'prompt', 'text': prompt,
+                            'template_version': template_version})
 
+                if generate_post and not prompt.startswith("❌"):
+                    post = self.get_post_from_llm(prompt)
+                    events.put({'destination': destination, 'stage': 'post', 'text': post})
+            except Exception as e:
+                events.put({'destination': destination, 'stage': 'error', 'text': f"❌ Error for {destination}: {str(e)}"})
+            finally:
+                events.put(None)
 
+        max_workers = max(1, min(len(destinations), Config.FANOUT_MAX_WORKERS))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout") as executor:
+            for destination in destinations:
+                # Propaga priorità e tracciamento delle attese dello scheduler ai thread
+                executor.submit(contextvars.copy_context().run, run_destination, destination)
 
-            # Crea il prompt ottimizzato
-            generation_prompt = self.load_prompt(self.generation_prompt)
-            generation_prompt = generation_prompt.format(**generation_prompt_variables)
+            pending = len(destinations)
+            while pending:
+                event = events.get()
+                if event is None:
+                    pending -= 1
+                    continue
+                yield event
 
-            print(generation_prompt)
+    def get_post_from_llm(self, prompt, model: str = None):
 
-            #prompt = self.call_perplexity(prompt=generation_prompt)
+        try:
+            response = self.call_llm(model or self.post_generation_model, prompt, self.POST_OPTIONS,
+                                     operation='post')
 
-            client = ollama.Client(host=self.ollama_host, timeout=300)
-            response = client.generate(
-                model=self.analysis_model,
-                prompt=generation_prompt,
-                options={'temperature': 0.4, 'num_predict': 2000}
-            )
-            
-            
             return response['response']
 
-
-            #return prompt
         except Exception as e:
-            return f"❌ **Error generating prompt:** {str(e)}"
+            return f"❌ Error in retrieving post: {str(e)}"
 
-    def get_post_from_llm(self, prompt):
+    def stream_structured_post(self, prompt: str, model: str = None,
+                               max_retries: int = Config.STRUCTURED_POST_MAX_RETRIES) -> Iterator[Dict]:
+        """
+        Genera il post come JSON a sezioni (schema passato come format a Ollama).
+        Ogni sezione viene validata appena lo stream la completa: alla prima sezione non valida
+        la generazione viene interrotta e vengono rigenerate solo le sezioni non valide o mancanti.
+        Restituisce gli eventi man mano:
+        {'stage': 'section', 'section', 'error'} | {'stage': 'retry', 'attempt', 'sections'} |
+        {'stage': 'done', 'result'} con result = {'text', 'sections', 'errors', 'regenerated', 'attempts'}
+        """
+        model = model or self.post_generation_model
+        accepted: Dict[str, str] = {}
+        errors: Dict[str, str] = {}
+        regenerated: List[str] = []
+        pending = list(SECTION_KEYS)
+        attempt = 0
 
-        try:
-            client = ollama.Client(host=self.ollama_host)
-            response = client.generate(
-                model=self.post_generation_model,
+        while pending and attempt <= max_retries:
+            if attempt:
+                regenerated.extend(key for key in pending if key not in regenerated)
+                yield {'stage': 'retry', 'attempt': attempt, 'sections': list(pending)}
+                request = repair_prompt(prompt, accepted, {key: errors.get(key, '') for key in pending})
+            else:
+                request = prompt
+
+            errors = {}
+            parser = IncrementalSectionParser()
+            stream = self.stream_llm(model, request, self.POST_OPTIONS, operation='post',
+                                     format=build_schema(pending))
+            try:
+                for chunk in stream:
+                    for key, value in parser.feed(chunk.get('response') or ''):
+                        if key not in pending:
+                            continue
+                        error = validate_section(key, value)
+                        yield {'stage': 'section', 'section': key, 'error': error}
+                        if error:
+                            errors[key] = error
+                            break
+                        accepted[key] = value.strip()
+                    if errors:
+                        # Interrompe lo stream: il resto verrebbe comunque rigenerato
+                        break
+            finally:
+                stream.close()
+
+            pending = [key for key in pending if key not in accepted]
+            attempt += 1
+
+        for key in pending:
+            errors.setdefault(key, "missing")
+
+        sections = dict.fromkeys(self.extract_post_structure('').keys(), '')
+        sections.update(accepted)
+        yield {'stage': 'done', 'result': {'text': render_post(accepted),
+                                           'sections': sections,
+                                           'errors': {key: errors[key] for key in pending},
+                                           'regenerated': regenerated,
+                                           'attempts': attempt}}
+
+    def get_structured_post(self, prompt: str, model: str = None) -> Dict:
+        """
+        Versione non in streaming di stream_structured_post: restituisce il risultato finale
+        """
+        result = None
+        for event in self.stream_structured_post(prompt, model=model):
+            if event['stage'] == 'done':
+                result = event['result']
+        return result
+
+
+    def call_llm(self, model: str, prompt: str, options: Dict, timeout: float = None,
+                 operation: str = 'generate', system: str = None):
+        """
+        Esegue una generazione Ollama e restituisce la risposta completa (testo e metriche).
+        La chiamata passa dallo scheduler, che può metterla in coda o rifiutarla.
+        """
+        with self.scheduler.slot(operation) as ticket:
+            if ticket.queue_time > 1:
+                print(f"⏳ {operation} ({model}) waited {ticket.queue_time:.1f}s in queue")
+            client = ollama.Client(host=self.ollama_host, timeout=timeout)
+            return client.generate(
+                model=model,
                 prompt=prompt,
-                options={'temperature': 0.3}
+                system=system,
+                options=dict(options),
+                keep_alive=Config.OLLAMA_KEEP_ALIVE or None
             )
 
-            return response['response']
+    def stream_llm(self, model: str, prompt: str, options: Dict, timeout: float = None,
+                   operation: str = 'generate', system: str = None, format=None) -> Iterator:
+        """
+        Come call_llm, ma restituisce i frammenti della risposta man mano che arrivano.
+        Lo slot dello scheduler resta occupato finché lo stream non termina o viene chiuso.
+        """
+        with self.scheduler.slot(operation) as ticket:
+            if ticket.queue_time > 1:
+                print(f"⏳ {operation} ({model}) waited {ticket.queue_time:.1f}s in queue")
+            client = ollama.Client(host=self.ollama_host, timeout=timeout)
+            stream = client.generate(
+                model=model,
+                prompt=prompt,
+                system=system,
+                format=format,
+                options=dict(options),
+                keep_alive=Config.OLLAMA_KEEP_ALIVE or None,
+                stream=True
+            )
+            try:
+                yield from stream
+            finally:
+                # Chiude la connessione: Ollama interrompe la generazione
+                stream.close()
+
+    def warm_prompt_prefixes(self) -> List[threading.Thread]:
+        """
+        Fa valutare a Ollama la parte fissa dei template una volta per modello e versione,
+        in background, così le richieste successive riutilizzano il prefisso già in cache
+        """
+        jobs = [(self.analysis_model, self.analysis_prompt, self.ANALYSIS_OPTIONS),
+                (self.analysis_model, self.generation_prompt, self.PROMPT_OPTIONS)]
+        threads = []
+        for model, path, options in jobs:
+            try:
+                template = self.templates.get(path)
+            except Exception as e:
+                print(f"⚠️ Prompt prefix warmup skipped for {path}: {e}")
+                continue
+            if not template.has_static_prefix or not self._claim_prefix(model, template):
+                continue
+            thread = threading.Thread(target=self._prime_prefix, args=(model, template, options),
+                                      name="prompt-prefix-warmup", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _claim_prefix(self, model: str, template) -> bool:
+        """
+        Segna il prefisso come valutato; False se lo era già
+        """
+        key = (self.ollama_host, model, template.prefix_version)
+        with _primed_prefixes_lock:
+            if key in _primed_prefixes:
+                return False
+            _primed_prefixes.add(key)
+            return True
 
+    def _prime_prefix(self, model: str, template, options: Dict):
+        # Stesse opzioni della richiesta reale (un cambio di contesto ricaricherebbe il modello), un solo token
+        try:
+            with scheduler_priority(Priority.BACKGROUND):
+                response = self.call_llm(model, "OK", {**options, 'num_predict': 1}, operation='warmup',
+                                         system=template.system_source)
+            print(f"🔥 Prompt prefix primed: {os.path.basename(template.path)}@{template.prefix_version} "
+                  f"({model}, {response.get('prompt_eval_count') or 0} tokens, "
+                  f"{(response.get('prompt_eval_duration') or 0) / 1e6:.0f} ms)")
         except Exception as e:
-            return f"❌ Error in retrieving post: {str(e)}"
+            with _primed_prefixes_lock:
+                _primed_prefixes.discard((self.ollama_host, model, template.prefix_version))
+            print(f"⚠️ Prompt prefix warmup failed for {os.path.basename(template.path)} ({model}): {e}")
+
+    def close(self, release_client: bool = True):
+        """
+        Rilascia le risorse del sistema (usato quando un tenant viene disattivato, dopo l'ultimo utilizzo).
+        Con release_client=True rilascia anche il client Chroma del database (connessione SQLite e
+        segmenti HNSW), condiviso nel processo per path: va usato solo quando nessun altro sistema
+        del processo usa lo stesso chroma_path.
+        """
+        with self._write_lock:
+            if self.collection is None:
+                # Già chiuso: il client del path potrebbe appartenere ora a un altro sistema
+                return
+            self.collection = None
+            self.metadata_index.close()
+            if self._database_lock is not None:
+                self._database_lock.close()
+                self._database_lock = None
+        close_embeddings = getattr(self.embedding_function, 'close', None)
+        if close_embeddings is not None:
+            close_embeddings()
+        if not release_client:
+            return
 
+        try:
+            # Solo il sistema di questo path: quelli degli altri database restano in uso
+            system = SharedSystemClient._identifier_to_system.pop(self.chroma_client._identifier, None)
+            if system is not None:
+                system.stop()
+        except Exception as e:
+            print(f"⚠️ Unable to release Chroma client for {self.chroma_path}: {e}")
 
     def load_prompt(self, file_path: str) -> str:
-        """Legge il prompt da file e sostituisce i placeholder."""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            prompt_template = f.read()
-        return prompt_template
+        """Restituisce il testo del template (dalla cache del registry)."""
+        return self.templates.get(file_path).source
+
+    def record_generation(self, operation: str, model: str, template, **details):
+        """
+        Registra quale versione del template è stata usata per una generazione
+        """
+        record = {
+            'timestamp': datetime.now().isoformat(),
+            'operation': operation,
+            'model': model,
+            'template': os.path.basename(template.path),
+            'template_version': template.version,
+            **details
+        }
+        self.generation_log.append(record)
+        print(f"🧾 {operation}: {record['template']}@{template.version} ({model})")
+        return record
+
+    def record_prompt_eval(self, record: Dict, response, model: str, template, system: str = None):
+        """
+        Aggiunge al record il costo della valutazione del prompt, per confrontare
+        le richieste con e senza riutilizzo del prefisso
+        """
+        record['prefix_reuse'] = system is not None
+        record['prompt_eval_count'] = response.get('prompt_eval_count') or 0
+        record['prompt_eval_ms'] = round((response.get('prompt_eval_duration') or 0) / 1e6, 1)
+        if system is not None:
+            # La richiesta appena eseguita ha già portato il prefisso nella cache di Ollama
+            self._claim_prefix(model, template)
+
+    def prompt_eval_stats(self) -> Dict:
+        """
+        Tempo medio di valutazione del prompt per operazione, con e senza riutilizzo del prefisso
+        """
+        groups = {}
+        for record in list(self.generation_log):
+            if 'prompt_eval_ms' not in record:
+                continue
+            key = f"{record['operation']}:{'prefix' if record['prefix_reuse'] else 'full'}"
+            groups.setdefault(key, []).append(record)
+
+        return {key: {'requests': len(records),
+                      'avg_prompt_eval_ms': round(sum(r['prompt_eval_ms'] for r in records) / len(records), 1),
+                      'avg_prompt_eval_tokens': round(sum(r['prompt_eval_count'] for r in records) / len(records), 1)}
+                for key, records in groups.items()}
 
 
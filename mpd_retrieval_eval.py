@@ -0,0 +1,352 @@
+# Valutazione offline della qualità e della latenza del retrieval
+# Misura recall@k, MRR e nDCG@k con i percentili di latenza per ogni
+# configurazione di retrieval, su un set di query etichettate.
+#
+# Formato dei file (JSONL, un oggetto per riga):
+#   corpus:  {"name": "King_Narmar", "document_type": "Post", "text": "# UNIQUE, ONE OF A KIND ..."}
+#   queries: {"id": "q1", "product_name": "...", "brand_values": "...", "product_description": "...",
+#             "olfactory_pyramid": "...", "perfumer_name": "...", "relevant": ["King_Narmar", ...]}
+#            "relevant" può anche essere un dizionario {"nome": grado} per la rilevanza graduata.
+#   configs (JSON, opzionale): [{"name": "...", "k": 3, "query_template": "...", "structured": true,
+#                                "prefilter": true, "boost": 0.1, "document_type": "Post"}, ...]
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from mpd_config import Config
+
+DEFAULT_CONFIGS = [
+    {"name": "vector", "k": 3, "structured": False},
+    {"name": "structured_boost", "k": 3, "structured": True, "prefilter": False},
+    {"name": "structured_prefilter", "k": 3, "structured": True, "prefilter": True},
+]
+
+METRICS = ["recall", "mrr", "ndcg"]
+
+
+class HashingEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Embedding deterministici senza modello (feature hashing di parole e bigrammi),
+    per eseguire la valutazione completamente in locale
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return [self._embed(text) for text in input]
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        tokens = re.findall(r'\w+', (text or '').lower())
+        features = tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.md5(feature.encode('utf-8')).digest()
+            index = int.from_bytes(digest[:4], 'little') % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    @staticmethod
+    def name() -> str:
+        return "mpd-hashing"
+
+    def get_config(self) -> Dict:
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config: Dict) -> "HashingEmbeddingFunction":
+        return HashingEmbeddingFunction(dim=config.get("dim", 256))
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Cache su file degli embedding reali: dopo la prima esecuzione la valutazione
+    non richiede più il server di embedding
+    """
+
+    def __init__(self, inner: Optional[EmbeddingFunction], cache_path: str, model: str):
+        self._inner = inner
+        self.cache_path = cache_path
+        self.model = model
+        self._cache: Dict[str, List[float]] = {}
+        self._dirty = False
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self._cache = json.load(f)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [hashlib.sha1(f"{self.model}\n{text}".encode('utf-8')).hexdigest() for text in input]
+        missing = [(key, text) for key, text in zip(keys, input) if key not in self._cache]
+        if missing:
+            if self._inner is None:
+                raise RuntimeError(f"{len(missing)} embeddings missing from cache {self.cache_path}")
+            vectors = self._inner([text for _, text in missing])
+            for (key, _), vector in zip(missing, vectors):
+                self._cache[key] = [float(value) for value in vector]
+            self._dirty = True
+        return [self._cache[key] for key in keys]
+
+    @staticmethod
+    def name() -> str:
+        return "mpd-cached"
+
+    def get_config(self) -> Dict:
+        return {"model": self.model}
+
+    def save(self):
+        if not self._dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(self._cache, f)
+        self._dirty = False
+
+
+def load_jsonl(path: str) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def relevance_grades(query: Dict) -> Dict[str, float]:
+    relevant = query.get('relevant', [])
+    if isinstance(relevant, dict):
+        return {name: float(grade) for name, grade in relevant.items()}
+    return {name: 1.0 for name in relevant}
+
+
+def recall_at_k(retrieved: List[str], grades: Dict[str, float], k: int) -> float:
+    if not grades:
+        return 0.0
+    return len(set(retrieved[:k]) & set(grades)) / len(grades)
+
+
+def reciprocal_rank(retrieved: List[str], grades: Dict[str, float]) -> float:
+    for rank, name in enumerate(retrieved, start=1):
+        if name in grades:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(retrieved: List[str], grades: Dict[str, float], k: int) -> float:
+    dcg = sum((2 ** grades.get(name, 0.0) - 1) / math.log2(rank + 2) for rank, name in enumerate(retrieved[:k]))
+    ideal = sorted(grades.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RetrievalEvaluator:
+    """
+    Indicizza il corpus in una collection temporanea ed esegue le query
+    etichettate con ogni configurazione di retrieval
+    """
+
+    def __init__(self, corpus: List[Dict], embedding_function: EmbeddingFunction, workdir: Optional[str] = None):
+        from mpd_rag_system import InstagramPromptGenerator
+
+        self._own_workdir = workdir is None
+        self.workdir = workdir or tempfile.mkdtemp(prefix="mpd_retrieval_eval_")
+        # Nessun warmup dei prefissi: la valutazione non deve mai chiamare il server LLM
+        self.rag = InstagramPromptGenerator(
+            chroma_path=self.workdir,
+            collection_name="retrieval_eval",
+            embedding_function=embedding_function,
+            warm_prefixes=False
+        )
+
+        started = time.perf_counter()
+        for document in corpus:
+            result = self.rag.add_post_to_database(document['text'], document['name'],
+                                                   document.get('document_type', 'Post'))
+            if result.startswith("❌"):
+                raise RuntimeError(result)
+        self.ingestion_s = time.perf_counter() - started
+
+    def close(self):
+        self.rag.close()
+        if self._own_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def retrieve(self, query: Dict, config: Dict) -> List[str]:
+        k = config.get('k', Config.SIMILARITY_RESULTS)
+        template = config.get('query_template')
+        if template:
+            text = template.format(**{key: query.get(key, '') for key in
+                                      ('product_name', 'brand_values', 'product_description',
+                                       'olfactory_pyramid', 'perfumer_name', 'keywords')})
+        else:
+            text = self.rag.build_retrieval_query(query.get('product_name', ''), query.get('brand_values', ''),
+                                                  query.get('product_description', ''))
+
+        document_type = config.get('document_type', 'Post')
+        restrictions = {"document_type": document_type} if document_type else None
+
+        if config.get('structured'):
+            posts = self.rag.retrieve_similar_posts(text, k, restrictions,
+                                                    olfactory_pyramid=query.get('olfactory_pyramid', ''),
+                                                    perfumer_name=query.get('perfumer_name', ''),
+                                                    prefilter=config.get('prefilter'),
+                                                    boost=config.get('boost'))
+        else:
+            posts = self.rag.get_similar_posts(text, k, restrictions)
+
+        return [post['metadata'].get('post_name') for post in posts]
+
+    def evaluate(self, queries: List[Dict], config: Dict, repeat: int = 1) -> Dict:
+        k = config.get('k', Config.SIMILARITY_RESULTS)
+        per_query = []
+        latencies = []
+
+        # Prima query non misurata: riscalda cache e connessioni
+        if queries:
+            self.retrieve(queries[0], config)
+
+        for query in queries:
+            grades = relevance_grades(query)
+            for _ in range(max(1, repeat)):
+                started = time.perf_counter()
+                retrieved = self.retrieve(query, config)
+                latencies.append((time.perf_counter() - started) * 1000)
+            per_query.append({
+                'id': query.get('id'),
+                'retrieved': retrieved,
+                'recall': recall_at_k(retrieved, grades, k),
+                'mrr': reciprocal_rank(retrieved, grades),
+                'ndcg': ndcg_at_k(retrieved, grades, k),
+            })
+
+        summary = {metric: round(statistics.fmean(item[metric] for item in per_query), 4) if per_query else 0.0
+                   for metric in METRICS}
+        summary.update({
+            'latency_p50_ms': round(percentile(latencies, 50), 2),
+            'latency_p95_ms': round(percentile(latencies, 95), 2),
+            'latency_p99_ms': round(percentile(latencies, 99), 2),
+            'latency_mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        })
+        return {'config': config, 'k': k, 'summary': summary, 'queries': per_query}
+
+
+def compare_with_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Elenca le metriche di qualità peggiorate oltre la tolleranza rispetto al report di riferimento
+    """
+    regressions = []
+    previous = {result['config']['name']: result['summary'] for result in baseline.get('results', [])}
+    for result in report['results']:
+        name = result['config']['name']
+        if name not in previous:
+            continue
+        for metric in METRICS:
+            before, after = previous[name].get(metric, 0.0), result['summary'][metric]
+            if after < before - tolerance:
+                regressions.append(f"{name}: {metric} {before:.4f} -> {after:.4f}")
+    return regressions
+
+
+def build_embedding_function(kind: str, cache_path: Optional[str]):
+    if kind == "hashing":
+        embedding_function = HashingEmbeddingFunction()
+        model = "hashing"
+    elif kind == "ollama":
+        from chromadb.utils.embedding_functions import OllamaEmbeddingFunction
+        embedding_function = OllamaEmbeddingFunction(model_name=Config.EMBEDDING_MODEL, url=Config.OLLAMA_HOST)
+        model = Config.EMBEDDING_MODEL
+    elif kind == "cache":
+        # Solo embedding già in cache: nessuna chiamata al server
+        embedding_function = None
+        model = Config.EMBEDDING_MODEL
+    else:
+        raise ValueError(f"Unknown embeddings kind: {kind}")
+
+    if cache_path:
+        return CachedEmbeddingFunction(embedding_function, cache_path, model)
+    if embedding_function is None:
+        raise ValueError("--embeddings cache requires --embedding-cache")
+    return embedding_function
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval quality and latency evaluation")
+    parser.add_argument("--corpus", required=True, help="JSONL file with the documents to index")
+    parser.add_argument("--queries", required=True, help="JSONL file with labeled queries")
+    parser.add_argument("--configs", help="JSON file with the retrieval configurations to compare")
+    parser.add_argument("--embeddings", choices=["hashing", "ollama", "cache"], default="hashing",
+                        help="hashing = deterministic local stand-in, ollama = real model, cache = cached only")
+    parser.add_argument("--embedding-cache", help="JSON cache file for real embeddings")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repetitions per query")
+    parser.add_argument("--output", help="Where to write the JSON report")
+    parser.add_argument("--baseline", help="Previous JSON report: exit 1 if quality dropped")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Allowed metric drop vs baseline")
+    args = parser.parse_args()
+
+    corpus = load_jsonl(args.corpus)
+    queries = load_jsonl(args.queries)
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, 'r', encoding='utf-8') as f:
+            configs = json.load(f)
+
+    embedding_function = build_embedding_function(args.embeddings, args.embedding_cache)
+    evaluator = RetrievalEvaluator(corpus, embedding_function)
+    try:
+        results = [evaluator.evaluate(queries, config, repeat=args.repeat) for config in configs]
+    finally:
+        evaluator.close()
+        if isinstance(embedding_function, CachedEmbeddingFunction):
+            embedding_function.save()
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'embeddings': args.embeddings,
+        'corpus_size': len(corpus),
+        'queries': len(queries),
+        'ingestion_s': round(evaluator.ingestion_s, 3),
+        'results': results,
+    }
+
+    print(f"{'config':<24} {'k':>3} {'recall':>8} {'mrr':>8} {'ndcg':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for result in results:
+        summary = result['summary']
+        print(f"{result['config']['name']:<24} {result['k']:>3} {summary['recall']:>8.4f} {summary['mrr']:>8.4f} "
+              f"{summary['ndcg']:>8.4f} {summary['latency_p50_ms']:>8.2f} {summary['latency_p95_ms']:>8.2f} "
+              f"{summary['latency_p99_ms']:>8.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 Report saved: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Retrieval quality regressions:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            raise SystemExit(1)
+        print("\n✅ No retrieval quality regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Scheduler con controllo di ammissione per le chiamate LLM verso Ollama
+# Limita la concorrenza (globale e per operazione), serve prima il lavoro
+# interattivo rispetto a quello batch e rifiuta/scarta richieste in caso di sovraccarico
+
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Dict, List, Optional
+
+from mpd_config import Config
+
+
+class Priority(IntEnum):
+    """
+    Classi di priorità: valore più basso = servito prima
+    """
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+
+class SchedulerOverloaded(RuntimeError):
+    """
+    Richiesta rifiutata o scartata perché la coda è piena o l'attesa è troppo lunga
+    """
+    MARKER = "LLM scheduler overloaded"
+
+    def __init__(self, reason: str):
+        super().__init__(f"{self.MARKER}: {reason}")
+
+
+_current_priority = contextvars.ContextVar("mpd_llm_priority", default=Priority.INTERACTIVE)
+_queue_times = contextvars.ContextVar("mpd_llm_queue_times", default=None)
+
+
+@contextmanager
+def scheduler_priority(priority: Priority):
+    """
+    Imposta la priorità delle chiamate LLM eseguite nel blocco (e nei thread avviati con copy_context)
+    """
+    token = _current_priority.set(Priority(priority))
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def track_queue_time():
+    """
+    Raccoglie i tempi di attesa in coda (secondi) delle chiamate LLM eseguite nel blocco
+    """
+    waits = []
+    token = _queue_times.set(waits)
+    try:
+        yield waits
+    finally:
+        _queue_times.reset(token)
+
+
+def parse_limits(value: str) -> Dict[str, int]:
+    """
+    Converte "analysis=2,prompt=2" in {'analysis': 2, 'prompt': 2}
+    """
+    limits = {}
+    for item in (value or "").split(','):
+        if '=' not in item:
+            continue
+        key, limit = item.split('=', 1)
+        limits[key.strip()] = int(limit)
+    return limits
+
+
+class Ticket:
+    """
+    Richiesta in attesa (o in esecuzione) di uno slot LLM
+    """
+
+    def __init__(self, seq: int, operation: str, priority: Priority):
+        self.seq = seq
+        self.operation = operation
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.granted = False
+        self.shed = False
+
+    @property
+    def queue_time(self) -> float:
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    def sort_key(self):
+        return self.priority, self.seq
+
+
+class LLMScheduler:
+    """
+    Coda a priorità davanti alle chiamate Ollama
+    """
+
+    def __init__(self,
+                 max_concurrency: int = Config.LLM_MAX_CONCURRENCY,
+                 operation_limits: Optional[Dict[str, int]] = None,
+                 max_queue_depth: Optional[Dict[Priority, int]] = None,
+                 max_queue_wait: float = Config.LLM_MAX_QUEUE_WAIT):
+        self.max_concurrency = max(1, max_concurrency)
+        self.operation_limits = operation_limits if operation_limits is not None \
+            else parse_limits(Config.LLM_OPERATION_LIMITS)
+        self.max_queue_depth = max_queue_depth or {
+            Priority.INTERACTIVE: Config.LLM_QUEUE_DEPTH_INTERACTIVE,
+            Priority.BATCH: Config.LLM_QUEUE_DEPTH_BATCH,
+            Priority.BACKGROUND: Config.LLM_QUEUE_DEPTH_BACKGROUND,
+        }
+        self.max_queue_wait = max_queue_wait
+
+        self._condition = threading.Condition()
+        self._waiting: List[Ticket] = []
+        self._running: Dict[str, int] = {}
+        self._running_total = 0
+        self._seq = itertools.count()
+        self._counters = {'completed': 0, 'rejected': 0, 'shed': 0, 'timed_out': 0}
+        self._recent_waits = []
+
+    @contextmanager
+    def slot(self, operation: str, priority: Optional[Priority] = None):
+        """
+        Attende uno slot per l'operazione indicata. Solleva SchedulerOverloaded se la
+        richiesta viene rifiutata, scartata o supera il tempo massimo di attesa.
+        """
+        priority = Priority(priority if priority is not None else _current_priority.get())
+        ticket = self._acquire(operation, priority)
+
+        waits = _queue_times.get()
+        if waits is not None:
+            waits.append(ticket.queue_time)
+
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            waits = sorted(self._recent_waits)
+            return {
+                'running': dict(self._running),
+                'running_total': self._running_total,
+                'waiting': {priority.name.lower(): sum(1 for ticket in self._waiting if ticket.priority == priority)
+                            for priority in Priority},
+                'max_concurrency': self.max_concurrency,
+                'operation_limits': dict(self.operation_limits),
+                'queue_wait_p50_ms': round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                'queue_wait_p99_ms': round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 1) if waits else None,
+                **self._counters,
+            }
+
+    def _acquire(self, operation: str, priority: Priority) -> Ticket:
+        with self._condition:
+            ticket = Ticket(next(self._seq), operation, priority)
+
+            # Ammissione: coda piena per questa classe -> prova a scartare lavoro meno importante
+            if len(self._waiting) >= self.max_queue_depth.get(priority, 0):
+                victim = self._lowest_priority_waiting(than=priority)
+                if victim is None:
+                    self._counters['rejected'] += 1
+                    raise SchedulerOverloaded(f"queue full ({len(self._waiting)} waiting), "
+                                              f"{priority.name.lower()} '{operation}' rejected")
+                self._waiting.remove(victim)
+                victim.shed = True
+                self._counters['shed'] += 1
+
+            self._waiting.append(ticket)
+            self._dispatch()
+
+            deadline = ticket.enqueued_at + self.max_queue_wait if self.max_queue_wait > 0 else None
+            while not ticket.granted and not ticket.shed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._counters['timed_out'] += 1
+                    raise SchedulerOverloaded(f"waited more than {self.max_queue_wait:.0f}s "
+                                              f"for '{operation}'")
+                self._condition.wait(remaining)
+
+            if ticket.shed:
+                raise SchedulerOverloaded(f"{priority.name.lower()} '{operation}' shed in favour of "
+                                          f"higher priority work")
+
+            self._recent_waits.append(ticket.queue_time)
+            del self._recent_waits[:-500]
+            return ticket
+
+    def _release(self, ticket: Ticket):
+        with self._condition:
+            self._running[ticket.operation] -= 1
+            self._running_total -= 1
+            self._counters['completed'] += 1
+            self._dispatch()
+
+    def _lowest_priority_waiting(self, than: Priority) -> Optional[Ticket]:
+        candidates = [ticket for ticket in self._waiting if ticket.priority > than]
+        if not candidates:
+            return None
+        # Scarta il ticket meno prioritario e più recente
+        return max(candidates, key=lambda ticket: (ticket.priority, ticket.seq))
+
+    def _dispatch(self):
+        """
+        Assegna gli slot liberi ai ticket in attesa in ordine di priorità
+        """
+        for ticket in sorted(self._waiting, key=Ticket.sort_key):
+            if self._running_total >= self.max_concurrency:
+                break
+            limit = self.operation_limits.get(ticket.operation)
+            if limit is not None and self._running.get(ticket.operation, 0) >= limit:
+                continue
+            self._waiting.remove(ticket)
+            ticket.granted = True
+            ticket.started_at = time.monotonic()
+            self._running[ticket.operation] = self._running.get(ticket.operation, 0) + 1
+            self._running_total += 1
+
+        # Risveglia anche i ticket scartati, che sono già fuori dalla coda
+        self._condition.notify_all()
+
+
+_schedulers: Dict[str, LLMScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(ollama_host: str = Config.OLLAMA_HOST) -> LLMScheduler:
+    """
+    Scheduler condiviso per host Ollama (tutti i tenant sullo stesso host condividono i limiti)
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(ollama_host)
+        if scheduler is None:
+            scheduler = _schedulers[ollama_host] = LLMScheduler()
+        return scheduler
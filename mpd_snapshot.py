@@ -0,0 +1,223 @@
+# Export/import della collection ChromaDB in un unico file compresso
+# Il file contiene documenti, metadati ed embedding già calcolati, così il
+# knowledge base può essere spostato tra ambienti senza ricalcolare gli embedding
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+
+from mpd_config import Config
+
+# Versione del formato del file di snapshot: ids, documenti e metadati come righe JSON UTF-8
+# in un'unica colonna di byte, embedding come array float32
+SNAPSHOT_FORMAT = "mpd-snapshot"
+SNAPSHOT_VERSION = 2
+
+
+class SnapshotError(ValueError):
+    """
+    File di snapshot non valido o incompatibile con la collection di destinazione
+    """
+
+
+def read_collection(collection, batch_size: int = Config.SNAPSHOT_BATCH_SIZE) -> Dict:
+    """
+    Legge tutti i record della collection (embedding compresi) a blocchi
+    """
+    records = {'ids': [], 'documents': [], 'metadatas': [], 'embeddings': []}
+    total = collection.count()
+
+    for offset in range(0, total, batch_size):
+        batch = collection.get(
+            limit=batch_size,
+            offset=offset,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        records['ids'].extend(batch['ids'])
+        records['documents'].extend(doc or '' for doc in batch['documents'])
+        records['metadatas'].extend(meta or {} for meta in batch['metadatas'])
+        records['embeddings'].extend(np.asarray(embedding, dtype=np.float32) for embedding in batch['embeddings'])
+
+    return records
+
+
+def write_records(collection, records: Dict, batch_size: int = Config.SNAPSHOT_BATCH_SIZE) -> int:
+    """
+    Scrive i record nella collection usando gli embedding forniti (nessuna chiamata al modello)
+    """
+    total = len(records['ids'])
+    for start in range(0, total, batch_size):
+        end = start + batch_size
+        collection.upsert(
+            ids=list(records['ids'][start:end]),
+            documents=list(records['documents'][start:end]),
+            metadatas=list(records['metadatas'][start:end]),
+            embeddings=[np.asarray(embedding, dtype=np.float32) for embedding in records['embeddings'][start:end]]
+        )
+    return total
+
+
+def _encode_jsonl(rows) -> np.ndarray:
+    """
+    Righe JSON UTF-8 in un array di byte: la dimensione dipende dal testo effettivo,
+    non dal documento più lungo moltiplicato per il numero di righe
+    """
+    data = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode('utf-8')
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def _decode_jsonl(column: np.ndarray):
+    # I caratteri di fine riga nel testo sono sempre escapati da json.dumps: si divide solo su "\n"
+    text = column.tobytes().decode('utf-8')
+    return [json.loads(line) for line in text.split("\n") if line]
+
+
+def export_collection(collection, path: str, embedding_model: str = Config.EMBEDDING_MODEL) -> Dict:
+    """
+    Esporta la collection in un file .npz compresso e restituisce il manifest
+    """
+    started = time.perf_counter()
+    records = read_collection(collection)
+
+    count = len(records['ids'])
+    embeddings = np.vstack(records['embeddings']).astype(np.float32) if count else np.zeros((0, 0), dtype=np.float32)
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'collection_name': collection.name,
+        'embedding_model': embedding_model,
+        'count': count,
+        'dimension': int(embeddings.shape[1]) if count else 0,
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    # Record testuali come righe JSON in byte (nessun pickle), embedding come array float32
+    rows = ({'id': doc_id, 'document': document, 'metadata': metadata}
+            for doc_id, document, metadata in zip(records['ids'], records['documents'], records['metadatas']))
+    with open(path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            manifest=np.array(json.dumps(manifest)),
+            records=_encode_jsonl(rows),
+            embeddings=embeddings
+        )
+
+    print(f"📦 Exported {count} documents from '{collection.name}' to {path} "
+          f"in {time.perf_counter() - started:.2f}s")
+    return manifest
+
+
+def load_snapshot(path: str) -> Dict:
+    """
+    Legge e valida un file di snapshot
+    """
+    with np.load(path, allow_pickle=False) as data:
+        if 'manifest' not in data.files:
+            raise SnapshotError(f"{path} is not a snapshot file (manifest missing)")
+
+        manifest = json.loads(str(data['manifest']))
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            raise SnapshotError(f"Unknown snapshot format: {manifest.get('format')}")
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {manifest.get('version')} "
+                                f"(supported: {SNAPSHOT_VERSION})")
+
+        rows = _decode_jsonl(data['records'])
+        records = {
+            'ids': [row['id'] for row in rows],
+            'documents': [row['document'] for row in rows],
+            'metadatas': [row['metadata'] for row in rows],
+            'embeddings': data['embeddings'],
+        }
+
+    if len(records['ids']) != manifest['count'] or len(records['embeddings']) != manifest['count']:
+        raise SnapshotError("Snapshot is corrupted: record count does not match the manifest")
+
+    return {'manifest': manifest, 'records': records}
+
+
+def import_collection(collection, path: str, embedding_model: str = Config.EMBEDDING_MODEL,
+                      force: bool = False, replace: bool = False) -> Dict:
+    """
+    Importa uno snapshot nella collection caricando direttamente gli embedding.
+    Con replace=True i documenti non presenti nello snapshot vengono rimossi.
+    """
+    started = time.perf_counter()
+    snapshot = load_snapshot(path)
+    manifest = snapshot['manifest']
+    records = snapshot['records']
+
+    # Embedding di modelli diversi non sono confrontabili con le query
+    if manifest['embedding_model'] != embedding_model and not force:
+        raise SnapshotError(f"Snapshot embeddings were computed with '{manifest['embedding_model']}', "
+                            f"collection uses '{embedding_model}'. Use force to import anyway.")
+
+    if replace:
+        existing = set(collection.get(include=[])['ids'])
+        stale = list(existing - set(records['ids']))
+        for start in range(0, len(stale), Config.SNAPSHOT_BATCH_SIZE):
+            collection.delete(ids=stale[start:start + Config.SNAPSHOT_BATCH_SIZE])
+
+    imported = write_records(collection, records)
+
+    print(f"📥 Imported {imported} documents into '{collection.name}' from {path} "
+          f"in {time.perf_counter() - started:.2f}s")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export/import the vector collection as a compressed snapshot")
+    parser.add_argument("command", choices=["export", "import", "info", "compact"])
+    parser.add_argument("path", nargs="?", help="Snapshot file (.npz), not needed for compact")
+    parser.add_argument("--chroma-path", default=Config.CHROMA_DB_PATH)
+    parser.add_argument("--collection", default=Config.COLLECTION_NAME)
+    parser.add_argument("--force", action="store_true", help="Import even if the embedding model differs")
+    parser.add_argument("--replace", action="store_true", help="Remove documents not present in the snapshot")
+    args = parser.parse_args()
+    if args.command != "compact" and not args.path:
+        parser.error(f"{args.command} requires the snapshot path")
+
+    if args.command == "info":
+        print(json.dumps(load_snapshot(args.path)['manifest'], indent=2))
+        return
+
+    from mpd_rag_system import DatabaseLocked, InstagramPromptGenerator
+
+    try:
+        rag = InstagramPromptGenerator(chroma_path=args.chroma_path, collection_name=args.collection)
+        if args.command == "compact":
+            # Ricostruisce la collection con i soli documenti vivi e compatta il database:
+            # rifiutata se l'applicazione (o un altro processo) ha il database aperto
+            print(json.dumps(rag.compact_collection(exclusive=True), indent=2))
+            return
+        if args.command == "import":
+            # L'import (con --replace anche le eliminazioni) e la ricostruzione dell'indice
+            # non devono avvenire sotto un'applicazione che ha il database aperto
+            rag.lock_database_exclusive("importing a snapshot")
+    except DatabaseLocked as e:
+        print(str(e))
+        raise SystemExit(1)
+
+    if args.command == "export":
+        export_collection(rag.collection, args.path, embedding_model=rag.embedding_model)
+    else:
+        try:
+            import_collection(rag.collection, args.path, embedding_model=rag.embedding_model,
+                              force=args.force, replace=args.replace)
+            rag.rebuild_metadata_index()
+        except SnapshotError as e:
+            print(f"❌ {str(e)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from PIL import Image
 from io import BytesIO
 import base64
+import os
+import tempfile
 
 def load_image(image_path):
     with Image.open(image_path) as img:
@@ -16,5 +18,20 @@ def load_system_prompt(system_prompt_path):
         return f.read()
 
 def save_system_prompt(system_prompt_path, contenuto):
-    with open(system_prompt_path, "w", encoding="utf-8") as f:
-        f.write(contenuto)
\ No newline at end of file
+    atomic_write_text(system_prompt_path, contenuto)
+
+def atomic_write_text(path, contenuto):
+    # Scrive su un file temporaneo nella stessa directory e lo sostituisce in un colpo solo,
+    # così chi legge in parallelo vede sempre la versione vecchia o quella nuova completa
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(contenuto)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
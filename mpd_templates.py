@@ -0,0 +1,313 @@
+# Registry dei template di prompt
+# Compila i template una sola volta, li tiene in memoria, li ricarica quando
+# il file cambia e salva le nuove versioni in modo atomico
+
+import atexit
+import hashlib
+import os
+import re
+import string
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import mpd_support_functions as support
+from mpd_config import Config
+
+try:
+    import watchfiles
+except ImportError:  # pragma: no cover - watchfiles è opzionale
+    watchfiles = None
+
+
+# Placeholder ammessi per ciascun tipo di template
+ANALYSIS_PLACEHOLDERS = {"combined_text"}
+GENERATION_PLACEHOLDERS = {"product_name", "perfumer_name", "brand_values", "product_description",
+                           "olfactory_pyramid", "keywords", "brand_analysis", "post_examples",
+                           "post_destination"}
+
+# Riga che separa la parte fissa (system) dalla parte variabile (user) di un template.
+# La parte fissa viene inviata come system prompt, così Ollama può riutilizzarne la valutazione.
+USER_MARKER = "---USER---"
+_USER_MARKER_LINE = re.compile(r'^[ \t]*' + re.escape(USER_MARKER) + r'[ \t]*$', re.MULTILINE)
+
+
+class TemplateError(ValueError):
+    """
+    Template non valido o variabili mancanti in fase di rendering
+    """
+
+
+def compute_version(source: str) -> str:
+    """
+    Calcola l'ID di versione di un template a partire dal suo contenuto
+    """
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+def split_template(source: str):
+    """
+    Divide il sorgente in parte system e parte user sulla riga USER_MARKER.
+    Senza marker tutto il template è considerato parte user.
+    """
+    markers = list(_USER_MARKER_LINE.finditer(source))
+    if len(markers) > 1:
+        raise TemplateError(f"The '{USER_MARKER}' separator can appear only once")
+    if not markers:
+        return "", source
+    return source[:markers[0].start()].strip('\n'), source[markers[0].end():].strip('\n')
+
+
+class PromptTemplate:
+    """
+    Template di prompt già analizzato e validato, pronto per il rendering
+    """
+
+    def __init__(self, path: str, source: str, allowed_placeholders: Optional[Iterable[str]] = None,
+                 mtime: float = 0.0):
+        self.path = path
+        self.source = source
+        self.version = compute_version(source)
+        self.mtime = mtime
+        self.loaded_at = datetime.now().isoformat()
+        self.system_source, self.user_source = split_template(source)
+        self._system_segments = self._compile(self.system_source, allowed_placeholders)
+        self._user_segments = self._compile(self.user_source, allowed_placeholders)
+        self.placeholders = sorted({field for _, field, _, _ in self._system_segments + self._user_segments
+                                    if field is not None})
+        # Versione della sola parte fissa: cambia solo quando il prefisso da riutilizzare cambia
+        self.prefix_version = compute_version(self.system_source)
+
+    @property
+    def has_static_prefix(self) -> bool:
+        """
+        True se il template ha una parte system senza placeholder (identica per ogni richiesta)
+        """
+        return bool(self.system_source) and all(field is None for _, field, _, _ in self._system_segments)
+
+    @staticmethod
+    def _compile(source: str, allowed_placeholders: Optional[Iterable[str]]) -> List[tuple]:
+        try:
+            segments = list(string.Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"Malformed template: {e}")
+
+        allowed = set(allowed_placeholders) if allowed_placeholders is not None else None
+        for _, field, _, conversion in segments:
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise TemplateError(f"Invalid placeholder '{{{field}}}': only named placeholders are supported")
+            if allowed is not None and field not in allowed:
+                raise TemplateError(f"Unknown placeholder '{{{field}}}'. Allowed: {', '.join(sorted(allowed))}")
+            if conversion not in (None, 's', 'r', 'a'):
+                raise TemplateError(f"Invalid conversion '!{conversion}' for placeholder '{{{field}}}'")
+
+        return segments
+
+    def render(self, **variables) -> str:
+        """
+        Sostituisce i placeholder senza dover rianalizzare il template
+        """
+        system, user = self.render_parts(**variables)
+        return f"{system}\n\n{user}" if system else user
+
+    def render_parts(self, **variables):
+        """
+        Restituisce separatamente parte system e parte user renderizzate
+        """
+        return self._render(self._system_segments, variables), self._render(self._user_segments, variables)
+
+    def _render(self, segments: List[tuple], variables: Dict) -> str:
+        parts = []
+        for literal, field, format_spec, conversion in segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            if field not in variables:
+                raise TemplateError(f"Missing value for placeholder '{{{field}}}' in {self.path}")
+            value = variables[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            elif conversion == 's':
+                value = str(value)
+            parts.append(format(value, format_spec or ''))
+        return ''.join(parts)
+
+
+class PromptTemplateRegistry:
+    """
+    Cache in memoria dei template compilati, con ricarica automatica
+    quando il file su disco cambia
+    """
+
+    def __init__(self, reload_interval: float = Config.PROMPT_RELOAD_INTERVAL,
+                 history_dir: str = Config.PROMPT_HISTORY_DIR, watch: bool = True):
+        self.reload_interval = reload_interval
+        self.history_dir = history_dir
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._placeholders: Dict[str, Optional[set]] = {}
+        self._last_check: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._watch = watch and watchfiles is not None
+        self._watcher = None
+        self._watched_dirs = set()
+        self._stop_event = threading.Event()
+
+    def register(self, path: str, placeholders: Optional[Iterable[str]] = None):
+        """
+        Registra un file di template con i placeholder ammessi
+        """
+        key = os.path.abspath(path)
+        with self._lock:
+            self._placeholders[key] = set(placeholders) if placeholders is not None else None
+            self._templates.pop(key, None)
+        self._ensure_watcher(key)
+
+    def get(self, path: str) -> PromptTemplate:
+        """
+        Restituisce il template compilato, caricandolo solo se necessario
+        """
+        key = os.path.abspath(path)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None and not self._should_check(key):
+                return template
+
+            mtime = os.path.getmtime(key)
+            if template is not None and template.mtime == mtime:
+                return template
+
+            return self._load(key, mtime, previous=template)
+
+    def save(self, path: str, source: str) -> PromptTemplate:
+        """
+        Valida e salva una nuova versione del template in modo atomico.
+        La versione precedente viene archiviata nello storico.
+        """
+        key = os.path.abspath(path)
+        with self._lock:
+            template = PromptTemplate(key, source, self._placeholders.get(key))
+
+            previous = self._templates.get(key)
+            if previous is None and os.path.exists(key):
+                previous = self._load(key, os.path.getmtime(key))
+            if previous is not None and previous.version != template.version:
+                self._archive(previous)
+
+            support.atomic_write_text(key, source)
+            template.mtime = os.path.getmtime(key)
+            self._templates[key] = template
+            self._last_check[key] = time.monotonic()
+            print(f"📝 Prompt template saved: {os.path.basename(key)} (version {template.version})")
+            return template
+
+    def history(self, path: str) -> List[str]:
+        """
+        Elenca le versioni archiviate di un template (dalla più recente)
+        """
+        stem = os.path.basename(path)
+        directory = self._history_path(path)
+        if not os.path.isdir(directory):
+            return []
+        entries = [name for name in os.listdir(directory) if name.startswith(stem + ".")]
+        return sorted(entries, reverse=True)
+
+    def invalidate(self, path: Optional[str] = None):
+        """
+        Forza la ricarica di un template (o di tutti) alla prossima richiesta
+        """
+        with self._lock:
+            if path is None:
+                self._last_check.clear()
+            else:
+                self._last_check.pop(os.path.abspath(path), None)
+
+    def close(self):
+        self._stop_event.set()
+        watcher = self._watcher
+        if watcher is not None and watcher is not threading.current_thread():
+            # watchfiles controlla stop_event a intervalli brevi: il thread termina subito
+            watcher.join(timeout=2)
+
+    def _should_check(self, key: str) -> bool:
+        if (self._watcher is not None and self._watcher.is_alive()
+                and os.path.dirname(key) in self._watched_dirs):
+            # Con il watcher attivo la cache resta valida fino a notifica
+            return key not in self._last_check
+        last_check = self._last_check.get(key)
+        return last_check is None or time.monotonic() - last_check >= self.reload_interval
+
+    def _load(self, key: str, mtime: float, previous: Optional[PromptTemplate] = None) -> PromptTemplate:
+        with open(key, 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        self._last_check[key] = time.monotonic()
+        try:
+            template = PromptTemplate(key, source, self._placeholders.get(key), mtime=mtime)
+        except TemplateError as e:
+            if previous is None:
+                raise
+            # Mantiene l'ultima versione valida se il file modificato non è corretto
+            print(f"⚠️ Invalid template {os.path.basename(key)}, keeping version {previous.version}: {e}")
+            previous.mtime = mtime
+            return previous
+
+        if previous is not None and previous.version != template.version:
+            print(f"🔄 Prompt template reloaded: {os.path.basename(key)} (version {template.version})")
+        self._templates[key] = template
+        return template
+
+    def _history_path(self, path: str) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(path)), self.history_dir)
+
+    def _archive(self, template: PromptTemplate):
+        directory = self._history_path(template.path)
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        name = f"{os.path.basename(template.path)}.{timestamp}.{template.version}"
+        support.atomic_write_text(os.path.join(directory, name), template.source)
+
+    def _ensure_watcher(self, key: str):
+        if not self._watch:
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                # Le directory registrate dopo l'avvio del watcher usano il polling
+                return
+            self._watched_dirs = {os.path.dirname(path) for path in self._placeholders}
+            self._watcher = threading.Thread(target=self._watch_loop, args=(set(self._watched_dirs),),
+                                             name="prompt-template-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self, directories):
+        try:
+            for changes in watchfiles.watch(*directories, stop_event=self._stop_event):
+                changed = {os.path.abspath(path) for _, path in changes}
+                with self._lock:
+                    for key in changed & set(self._templates):
+                        # Forza il controllo dell'mtime alla prossima richiesta
+                        self._last_check.pop(key, None)
+        except Exception as e:
+            print(f"⚠️ Prompt template watcher stopped, falling back to polling: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> PromptTemplateRegistry:
+    """
+    Restituisce il registry condiviso dal processo, con i template di default registrati
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PromptTemplateRegistry()
+            # Il watcher va fermato prima della finalizzazione dell'interprete: un thread daemon
+            # ancora dentro watchfiles all'uscita fa terminare il processo con abort
+            atexit.register(_registry.close)
+        return _registry
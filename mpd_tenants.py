@@ -0,0 +1,301 @@
+# Registry dei tenant (brand / linee di prodotto) serviti dallo stesso processo
+# Ogni tenant ha la sua collection, i suoi template e i suoi modelli.
+# I sistemi RAG vengono creati al primo utilizzo e rilasciati quando restano inattivi.
+# Chi usa un sistema RAG lo prende in prestito con lease(): un tenant in uso non viene mai rilasciato.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional
+
+from mpd_config import Config
+
+
+@dataclass
+class TenantConfig:
+    """
+    Configurazione di un singolo tenant. I campi non specificati usano i valori di Config.
+    """
+    tenant_id: str
+    display_name: str = ""
+    chroma_path: str = Config.CHROMA_DB_PATH
+    collection_name: str = Config.COLLECTION_NAME
+    embedding_model: str = Config.EMBEDDING_MODEL
+    analysis_model: str = Config.ANALYSIS_MODEL
+    post_generation_model: str = Config.POST_MODEL
+    analysis_prompt: str = Config.ANALYSIS_PROMPT_FILE
+    generation_prompt: str = Config.GENERATION_PROMPT_FILE
+    ollama_host: str = Config.OLLAMA_HOST
+    extra: Dict = field(default_factory=dict)
+
+    @property
+    def label(self) -> str:
+        return self.display_name or self.tenant_id
+
+    def generator_kwargs(self) -> Dict:
+        return {
+            'chroma_path': self.chroma_path,
+            'collection_name': self.collection_name,
+            'embedding_model': self.embedding_model,
+            'analysis_model': self.analysis_model,
+            'post_generation_model': self.post_generation_model,
+            'analysis_prompt': self.analysis_prompt,
+            'generation_prompt': self.generation_prompt,
+            'ollama_host': self.ollama_host,
+        }
+
+
+def default_tenant(ollama_host: str = Config.OLLAMA_HOST) -> TenantConfig:
+    return TenantConfig(tenant_id=Config.DEFAULT_TENANT, display_name="Moellhausen", ollama_host=ollama_host)
+
+
+def load_tenants(path: str = Config.TENANTS_FILE, ollama_host: str = Config.OLLAMA_HOST) -> Dict[str, TenantConfig]:
+    """
+    Carica i tenant dal file JSON. Senza file viene servito solo il tenant di default.
+
+    Formato: {"tenants": [{"tenant_id": "brand_a", "collection_name": "...", ...}, ...]}
+    """
+    if not path or not os.path.exists(path):
+        tenant = default_tenant(ollama_host)
+        return {tenant.tenant_id: tenant}
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    known_fields = set(TenantConfig.__dataclass_fields__) - {'extra'}
+    tenants = {}
+    for entry in data.get('tenants', []):
+        if not entry.get('tenant_id'):
+            raise ValueError(f"Tenant without tenant_id in {path}")
+        values = {key: value for key, value in entry.items() if key in known_fields}
+        values.setdefault('ollama_host', ollama_host)
+        extra = {key: value for key, value in entry.items() if key not in known_fields}
+        tenant = TenantConfig(**values, extra=extra)
+        if tenant.tenant_id in tenants:
+            raise ValueError(f"Duplicate tenant_id '{tenant.tenant_id}' in {path}")
+        tenants[tenant.tenant_id] = tenant
+
+    if not tenants:
+        raise ValueError(f"No tenants defined in {path}")
+
+    return tenants
+
+
+class TenantRegistry:
+    """
+    Crea i sistemi RAG dei tenant su richiesta e rilascia quelli inattivi
+    per limitare la memoria occupata
+    """
+
+    def __init__(self,
+                 tenants: Dict[str, TenantConfig],
+                 factory: Callable = None,
+                 idle_timeout: float = Config.TENANT_IDLE_TIMEOUT,
+                 max_active: int = Config.MAX_ACTIVE_TENANTS,
+                 default_tenant_id: Optional[str] = None):
+        if factory is None:
+            from mpd_rag_system import InstagramPromptGenerator
+            factory = InstagramPromptGenerator
+
+        self.tenants = tenants
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.max_active = max(1, max_active)
+        self.default_tenant_id = default_tenant_id if default_tenant_id in tenants else next(iter(tenants))
+
+        self._active: Dict[str, object] = {}
+        self._last_used: Dict[str, float] = {}
+        # Numero di utilizzatori in corso per tenant (richieste, worker, compattazione)
+        self._leases: Dict[str, int] = {}
+        self._creation_locks: Dict[str, threading.Lock] = {tenant_id: threading.Lock() for tenant_id in tenants}
+        # Tenant con lo stesso database condividono il client Chroma del processo: apertura e
+        # rilascio del client sono serializzati per path
+        self._path_locks: Dict[str, threading.Lock] = {self._chroma_path(tenant_id): threading.Lock()
+                                                       for tenant_id in tenants}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._reaper = None
+
+        if self.idle_timeout > 0:
+            self._reaper = threading.Thread(target=self._reap_loop, name="tenant-reaper", daemon=True)
+            self._reaper.start()
+
+    def tenant_ids(self) -> List[str]:
+        return list(self.tenants)
+
+    def choices(self) -> List[tuple]:
+        """
+        Coppie (etichetta, id) per i menu a tendina
+        """
+        return [(tenant.label, tenant_id) for tenant_id, tenant in self.tenants.items()]
+
+    def config(self, tenant_id: Optional[str] = None) -> TenantConfig:
+        tenant_id = tenant_id or self.default_tenant_id
+        if tenant_id not in self.tenants:
+            raise KeyError(f"Unknown tenant '{tenant_id}'")
+        return self.tenants[tenant_id]
+
+    def get(self, tenant_id: Optional[str] = None):
+        """
+        Restituisce il sistema RAG del tenant, creandolo se necessario.
+        Il sistema non è protetto dal rilascio: per usarlo in una richiesta serve lease().
+        """
+        return self._get(tenant_id, lease=False)
+
+    def acquire(self, tenant_id: Optional[str] = None):
+        """
+        Prende in prestito il sistema RAG del tenant: resta attivo finché non viene chiamato release()
+        """
+        return self._get(tenant_id, lease=True)
+
+    def release(self, tenant_id: Optional[str] = None):
+        """
+        Restituisce il prestito; se il limite di tenant attivi era stato superato, libera ora i tenant in eccesso
+        """
+        tenant_id = self.config(tenant_id).tenant_id
+        with self._lock:
+            remaining = self._leases.get(tenant_id, 0) - 1
+            if remaining > 0:
+                self._leases[tenant_id] = remaining
+            else:
+                self._leases.pop(tenant_id, None)
+            self._last_used[tenant_id] = time.monotonic()
+            evicted = self._select_lru_evictions(keep=None) if remaining <= 0 else []
+
+        for evicted_id, evicted_rag in evicted:
+            self._release(evicted_id, evicted_rag, reason="max active tenants reached")
+
+    @contextmanager
+    def lease(self, tenant_id: Optional[str] = None):
+        """
+        Blocco in cui il sistema RAG del tenant non può essere rilasciato
+        """
+        rag = self.acquire(tenant_id)
+        try:
+            yield rag
+        finally:
+            self.release(tenant_id)
+
+    def _get(self, tenant_id: Optional[str], lease: bool):
+        tenant = self.config(tenant_id)
+        tenant_id = tenant.tenant_id
+
+        with self._lock:
+            rag = self._active.get(tenant_id)
+            if rag is not None:
+                self._touch(tenant_id, lease)
+                return rag
+
+        # Creazione fuori dal lock globale: un tenant lento non blocca gli altri
+        with self._creation_locks[tenant_id]:
+            with self._lock:
+                rag = self._active.get(tenant_id)
+                if rag is not None:
+                    self._touch(tenant_id, lease)
+                    return rag
+
+            print(f"🏷️ Activating tenant '{tenant_id}' (collection: {tenant.collection_name})")
+            with self._path_locks[self._chroma_path(tenant_id)]:
+                rag = self.factory(**tenant.generator_kwargs())
+
+                with self._lock:
+                    self._active[tenant_id] = rag
+                    self._touch(tenant_id, lease)
+                    evicted = self._select_lru_evictions(keep=tenant_id)
+
+        for evicted_id, evicted_rag in evicted:
+            self._release(evicted_id, evicted_rag, reason="max active tenants reached")
+
+        return rag
+
+    def evict_idle(self) -> List[str]:
+        """
+        Rilascia i tenant non usati da più di idle_timeout secondi (mai quelli in uso)
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [tenant_id for tenant_id, last_used in self._last_used.items()
+                    if now - last_used > self.idle_timeout and tenant_id in self._active
+                    and not self._leases.get(tenant_id)]
+            evicted = [(tenant_id, self._pop(tenant_id)) for tenant_id in idle]
+
+        for tenant_id, rag in evicted:
+            self._release(tenant_id, rag, reason="idle")
+        return [tenant_id for tenant_id, _ in evicted]
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'tenant_id': tenant_id,
+                'active': tenant_id in self._active,
+                'leases': self._leases.get(tenant_id, 0),
+                'idle_s': round(now - self._last_used[tenant_id], 1) if tenant_id in self._last_used else None,
+                **asdict(tenant),
+            } for tenant_id, tenant in self.tenants.items()]
+
+    def close(self):
+        """
+        Chiusura del processo: rilascia tutti i tenant
+        """
+        self._stop_event.set()
+        with self._lock:
+            evicted = [(tenant_id, self._pop(tenant_id)) for tenant_id in list(self._active)]
+            self._leases.clear()
+        for tenant_id, rag in evicted:
+            self._release(tenant_id, rag, reason="shutdown")
+
+    def _touch(self, tenant_id: str, lease: bool):
+        self._last_used[tenant_id] = time.monotonic()
+        if lease:
+            self._leases[tenant_id] = self._leases.get(tenant_id, 0) + 1
+
+    def _pop(self, tenant_id: str):
+        self._last_used.pop(tenant_id, None)
+        return self._active.pop(tenant_id, None)
+
+    def _select_lru_evictions(self, keep: Optional[str]) -> List[tuple]:
+        """
+        Tenant da rilasciare per rientrare nel limite, esclusi quelli in uso:
+        se sono tutti in uso il limite viene superato temporaneamente e ricontrollato a ogni release()
+        """
+        evicted = []
+        while len(self._active) > self.max_active:
+            candidates = [tenant_id for tenant_id in self._active
+                          if tenant_id != keep and not self._leases.get(tenant_id)]
+            if not candidates:
+                break
+            lru = min(candidates, key=lambda tenant_id: self._last_used.get(tenant_id, 0))
+            evicted.append((lru, self._pop(lru)))
+        return evicted
+
+    def _chroma_path(self, tenant_id: str) -> str:
+        return os.path.abspath(self.tenants[tenant_id].chroma_path)
+
+    def _release(self, tenant_id: str, rag, reason: str):
+        if rag is None:
+            return
+        path = self._chroma_path(tenant_id)
+        close = getattr(rag, 'close', None)
+        with self._path_locks[path]:
+            with self._lock:
+                # Il client Chroma (SQLite, segmenti HNSW caricati) si rilascia solo se nessun
+                # altro tenant attivo usa lo stesso database
+                shared = any(self._chroma_path(other) == path for other in self._active)
+            if close is not None:
+                try:
+                    close(release_client=not shared)
+                except Exception as e:
+                    print(f"⚠️ Error releasing tenant '{tenant_id}': {e}")
+        print(f"💤 Tenant '{tenant_id}' released ({reason})")
+
+    def _reap_loop(self):
+        interval = max(1.0, min(self.idle_timeout / 2, 60.0))
+        while not self._stop_event.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"⚠️ Tenant reaper error: {e}")
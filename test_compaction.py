@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test della compattazione della collection (mpd_rag_system.py) e del recupero dopo un'interruzione
+Il modello di embedding è il server Ollama finto del load test: nessuna rete
+"""
+
+import random
+
+import pytest
+
+from mpd_loadtest import FakeOllamaServer, sample_post
+
+rag_system = pytest.importorskip("mpd_rag_system")
+
+COLLECTION = "posts"
+
+
+@pytest.fixture
+def fake_ollama():
+    server = FakeOllamaServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def open_generator(tmp_path, fake_ollama):
+    opened = []
+
+    def open_generator():
+        rag = rag_system.InstagramPromptGenerator(chroma_path=str(tmp_path), collection_name=COLLECTION,
+                                                  ollama_host=fake_ollama.url)
+        opened.append(rag)
+        return rag
+
+    yield open_generator
+    for rag in opened:
+        rag.close()
+
+
+def add_posts(rag, count: int = 3):
+    rng = random.Random(0)
+    for index in range(count):
+        assert rag.add_post_to_database(sample_post(rng, index), f"Post_{index}", "Post").startswith("✅")
+
+
+def collection_names(rag):
+    return sorted(collection.name for collection in rag.chroma_client.list_collections())
+
+
+def copy_collection(rag, name: str):
+    copy = rag.chroma_client.create_collection(name=name, embedding_function=rag.collection_embedding_function)
+    rag_system.write_records(copy, rag_system.read_collection(rag.collection))
+    return copy
+
+
+def test_compaction_keeps_documents_and_removes_old_collection(open_generator):
+    rag = open_generator()
+    add_posts(rag)
+    rag.delete_posts([rag.list_documents()[0]['id']])
+
+    report = rag.compact_collection()
+
+    assert report['documents'] == 2
+    assert rag.count_documents() == 2
+    assert collection_names(rag) == [COLLECTION]
+
+
+def test_failed_rename_restores_original_collection(open_generator, monkeypatch):
+    rag = open_generator()
+    add_posts(rag)
+    original_modify = type(rag.collection).modify
+
+    def modify(collection, name=None, **kwargs):
+        if name == COLLECTION and "_compact_" in collection.name:
+            raise RuntimeError("rename failed")
+        return original_modify(collection, name=name, **kwargs)
+
+    monkeypatch.setattr(type(rag.collection), "modify", modify)
+    with pytest.raises(RuntimeError):
+        rag.compact_collection()
+
+    assert rag.collection.name == COLLECTION
+    assert rag.count_documents() == 3
+    assert collection_names(rag) == [COLLECTION]
+
+
+def test_restart_adopts_collection_renamed_aside(open_generator):
+    # Interruzione tra i due rinomini: la principale manca, restano _old_ e _compact_
+    rag = open_generator()
+    add_posts(rag)
+    copy_collection(rag, f"{COLLECTION}_compact_20260101000000")
+    rag.collection.modify(name=f"{COLLECTION}_old_20260101000000")
+    rag.close()
+
+    restarted = open_generator()
+    assert restarted.count_documents() == 3
+    assert len(restarted.metadata_index) == 3
+    assert collection_names(restarted) == [COLLECTION]
+
+
+def test_restart_replaces_empty_collection_with_leftover(open_generator):
+    # Riavvio precedente che ha già creato una collection vuota al posto di quella persa
+    rag = open_generator()
+    add_posts(rag)
+    copy_collection(rag, f"{COLLECTION}_compact_20260101000000")
+    rag.chroma_client.delete_collection(COLLECTION)
+    rag.chroma_client.create_collection(COLLECTION, embedding_function=rag.collection_embedding_function)
+    rag.close()
+
+    restarted = open_generator()
+    assert restarted.count_documents() == 3
+    assert collection_names(restarted) == [COLLECTION]
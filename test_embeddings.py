@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Test della configurazione persistita della collection con il micro-batching degli embedding
+Il modello di embedding è il server Ollama finto del load test: nessuna rete
+"""
+
+import random
+
+import chromadb
+import pytest
+
+from mpd_config import Config
+from mpd_embeddings import BatchingEmbeddingFunction
+from mpd_loadtest import FakeOllamaServer, sample_post
+
+
+@pytest.fixture
+def fake_ollama():
+    server = FakeOllamaServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def generator(tmp_path, fake_ollama, monkeypatch):
+    rag_system = pytest.importorskip("mpd_rag_system")
+    monkeypatch.setattr(Config, "EMBED_BATCHING", True)
+    rag = rag_system.InstagramPromptGenerator(chroma_path=str(tmp_path), collection_name="posts",
+                                              ollama_host=fake_ollama.url)
+    yield rag
+    rag.close()
+
+
+def persisted_embedding_function(path: str, name: str) -> dict:
+    # Client separato, come un nuovo processo che riapre il database
+    client = chromadb.PersistentClient(path=path)
+    return client.get_collection(name).configuration_json['embedding_function']
+
+
+def assert_ollama_config(config: dict, server: FakeOllamaServer):
+    assert config['type'] == "known"
+    assert config['name'] == "ollama"
+    assert config['config']['url'] == server.url
+    assert config['config']['model_name'] == Config.EMBEDDING_MODEL
+
+
+def test_collection_persists_ollama_configuration(generator, fake_ollama, tmp_path):
+    assert isinstance(generator.embedding_function, BatchingEmbeddingFunction)
+    result = generator.add_post_to_database(sample_post(random.Random(0), 1), "Post_1", "Post")
+    assert result.startswith("✅")
+    assert generator.get_similar_posts("luxury fragrance", 1)
+
+    # Gli embedding dell'applicazione passano dal batcher
+    assert generator.embedding_function.stats()['upstream_calls'] >= 2
+    assert_ollama_config(persisted_embedding_function(str(tmp_path), "posts"), fake_ollama)
+
+
+def test_compacted_collection_keeps_ollama_configuration(generator, fake_ollama, tmp_path):
+    generator.add_post_to_database(sample_post(random.Random(1), 1), "Post_1", "Post")
+    generator.compact_collection()
+
+    assert generator.count_documents() == 1
+    assert_ollama_config(persisted_embedding_function(str(tmp_path), "posts"), fake_ollama)
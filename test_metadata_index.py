@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test dell'estrazione dei campi strutturati (mpd_metadata_index.py): piramide olfattiva e profumiere
+"""
+
+import pytest
+
+from mpd_metadata_index import extract_perfumer, parse_olfactory_pyramid, product_query_fields
+
+
+# --- Profumiere ---
+
+@pytest.mark.parametrize("text, expected", [
+    ("Our perfumer Luca Rossi evokes a journey", "luca rossi"),
+    ("Perfumer: Nilafar.", "nilafar"),
+    ("Nose: Jean-Claude Ellena", "jean-claude ellena"),
+    ("il profumiere Marco de Santis, con passione", "marco de santis"),
+    ("PERFUMER: AURORA", "aurora"),
+])
+def test_perfumer_names(text, expected):
+    assert extract_perfumer(text) == [expected]
+
+
+def test_perfumer_stops_at_end_of_line():
+    assert extract_perfumer("Created by perfumer Luca Rossi\nTop: Sea salt") == ["luca rossi"]
+
+
+def test_perfumer_stops_at_punctuation():
+    assert extract_perfumer("Perfumer Luca Rossi, who grew up in Liguria") == ["luca rossi"]
+
+
+def test_perfumer_surname_with_particle_closes_the_name():
+    assert extract_perfumer("Perfumer Anna Chiara Di Trolio Creates A Masterpiece") == ["anna chiara di trolio"]
+    assert extract_perfumer("Perfumer Anna Maria van der Berg Presents") == ["anna maria van der berg"]
+
+
+def test_perfumer_ignores_title_case_words_after_the_name():
+    assert extract_perfumer("The perfumer Luca Rossi Presents A New Scent") == ["luca rossi"]
+
+
+def test_perfumer_label_without_name():
+    assert extract_perfumer("A word from our perfumer\nLuca Rossi") == []
+    assert extract_perfumer("Crafted by a talented perfumer.") == []
+
+
+# --- Piramide olfattiva ---
+
+def test_pyramid_with_labels():
+    levels = parse_olfactory_pyramid("Top: bergamot, saffron  Heart: rose  Base: oud, amber")
+    assert levels == {'top_notes': ['bergamot', 'saffron'], 'heart_notes': ['rose'],
+                      'base_notes': ['oud', 'amber']}
+
+
+def test_pyramid_in_prose():
+    levels = parse_olfactory_pyramid("Top notes of sea salt and lemon, a heart of marine accord and rosemary, "
+                                     "resting on a base of ambergris and white musk.")
+    assert levels == {'top_notes': ['sea salt', 'lemon'], 'heart_notes': ['marine accord', 'rosemary'],
+                      'base_notes': ['ambergris', 'white musk']}
+
+
+def test_pyramid_keeps_hyphenated_notes():
+    assert parse_olfactory_pyramid("Heart: ylang-ylang - jasmine")['heart_notes'] == ['ylang-ylang', 'jasmine']
+
+
+def test_product_query_ignores_placeholders():
+    fields = product_query_fields("To be defined", "Not specified")
+    assert fields == {'top_notes': [], 'heart_notes': [], 'base_notes': [], 'perfumer': []}
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test dello schema del post strutturato (mpd_post_schema.py): parser incrementale,
+validazione delle sezioni e rigenerazione delle sezioni non valide. Nessuna rete.
+"""
+
+import json
+
+import pytest
+
+from mpd_post_schema import (SECTION_KEYS, IncrementalSectionParser, build_schema, render_post, repair_prompt,
+                             validate_section)
+
+VALID_SECTIONS = {
+    'title': "Unique, one of a kind with Moellhausen: OCEAN BREEZE by Luca Rossi",
+    'brand_values': "Elegance, innovation and the Mediterranean spirit guide every creation of the house.",
+    'introduction': "Luca Rossi grew up between the cliffs of Liguria, and this fragrance is his love letter "
+                    "to the sea that shaped his childhood summers.",
+    'description': "A luminous marine composition that opens like a window on the harbour at dawn: salty air, "
+                   "sun-warmed stones and a breeze that carries the zest of lemon groves over the water.",
+    'olfactory_pyramid': "Top notes of sea salt and lemon, a heart of marine accord and rosemary, "
+                         "resting on a base of ambergris and white musk.",
+    'closing': "A tribute to artistic perfumery, crafted with patience by hands that love their art.",
+}
+
+
+def as_json(sections):
+    return json.dumps(sections, ensure_ascii=False)
+
+
+def feed_all(parser, chunks):
+    completed = []
+    for chunk in chunks:
+        completed.extend(parser.feed(chunk))
+    return completed
+
+
+# --- IncrementalSectionParser ---
+
+def test_parser_whole_response():
+    parser = IncrementalSectionParser()
+    completed = parser.feed(as_json(VALID_SECTIONS))
+    assert [key for key, _ in completed] == SECTION_KEYS
+    assert parser.sections == VALID_SECTIONS
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64])
+def test_parser_sections_split_across_chunks(size):
+    text = as_json(VALID_SECTIONS)
+    chunks = [text[start:start + size] for start in range(0, len(text), size)]
+    parser = IncrementalSectionParser()
+    assert feed_all(parser, chunks) == list(VALID_SECTIONS.items())
+
+
+def test_parser_emits_section_only_when_value_is_complete():
+    parser = IncrementalSectionParser()
+    assert parser.feed('{"title": "Unique, one of a kind') == []
+    assert parser.feed(' with Moellhausen: X by Y", "brand_') == [
+        ('title', "Unique, one of a kind with Moellhausen: X by Y")]
+    assert parser.feed('values": "Elegance') == []
+    assert parser.feed('"}') == [('brand_values', "Elegance")]
+
+
+def test_parser_escapes_split_across_chunks():
+    parser = IncrementalSectionParser()
+    chunks = ['{"description": "She said \\', '"hello\\', '" \\u00e8 ', 'vero\\nnew line"', '}']
+    assert feed_all(parser, chunks) == [('description', 'She said "hello" è vero\nnew line')]
+
+
+def test_parser_invalid_escape_keeps_raw_value():
+    parser = IncrementalSectionParser()
+    assert parser.feed('{"closing": "bad \\q escape"}') == [('closing', 'bad \\q escape')]
+
+
+def test_parser_ignores_text_that_is_not_json():
+    parser = IncrementalSectionParser()
+    assert parser.feed("Sure! Here is your post:\n# OCEAN BREEZE\n") == []
+    assert parser.feed('{"title": "late"}') == []
+    assert parser.sections == {}
+
+
+def test_parser_stops_at_non_string_value():
+    parser = IncrementalSectionParser()
+    assert parser.feed('{"title": "Unique", "brand_values": 42, "closing": "never reached"}') == [
+        ('title', "Unique")]
+
+
+# --- validate_section ---
+
+@pytest.mark.parametrize("key", SECTION_KEYS)
+def test_valid_sections(key):
+    assert validate_section(key, VALID_SECTIONS[key]) is None
+
+
+def test_section_too_short():
+    assert validate_section('closing', "Short.").startswith("too short (6 characters")
+
+
+def test_section_with_markdown_title():
+    value = VALID_SECTIONS['description'] + "\n## OLFACTORY PYRAMID\nTop: lemon"
+    assert validate_section('description', value) == "contains markdown section titles"
+
+
+def test_title_requires_formula():
+    assert validate_section('title', "OCEAN BREEZE by Luca Rossi, a marine fragrance").startswith("must begin")
+    assert validate_section('title', "unique one of a kind with Moellhausen: OCEAN BREEZE by Luca Rossi") is None
+
+
+def test_pyramid_requires_all_levels():
+    value = "Top notes of sea salt and lemon, with a generous heart of marine accord and rosemary."
+    assert validate_section('olfactory_pyramid', value) == "missing base notes"
+
+
+def test_unknown_section():
+    assert validate_section('tags', "#marine #fresh") == "unexpected section 'tags'"
+
+
+# --- Schema e prompt di rigenerazione ---
+
+def test_schema_limited_to_pending_sections():
+    schema = build_schema(['closing', 'title'])
+    assert schema['required'] == ['title', 'closing']
+    assert set(schema['properties']) == {'title', 'closing'}
+    assert schema['additionalProperties'] is False
+
+
+def test_repair_prompt_lists_only_sections_to_rewrite():
+    accepted = {'title': VALID_SECTIONS['title']}
+    text = repair_prompt("ORIGINAL PROMPT", accepted, {'brand_values': "too short", 'closing': ''})
+    assert text.startswith("ORIGINAL PROMPT")
+    assert VALID_SECTIONS['title'] in text
+    assert "- brand_values: " in text and "(previous attempt too short)" in text
+    assert "- closing: " in text
+    assert "- title:" not in text
+
+
+def test_render_post_uses_section_order():
+    sections = dict(reversed(list(VALID_SECTIONS.items())))
+    assert render_post(sections) == "\n\n".join(VALID_SECTIONS[key] for key in SECTION_KEYS)
+
+
+# --- Rigenerazione delle sezioni non valide (stream_structured_post con un LLM finto) ---
+
+class FakeStreamingLLM:
+    """
+    Sostituisce stream_llm: restituisce le risposte previste a frammenti e registra le richieste
+    """
+
+    def __init__(self, responses, chunk_size=5):
+        self.responses = list(responses)
+        self.chunk_size = chunk_size
+        self.requests = []
+
+    def __call__(self, model, prompt, options, timeout=None, operation='generate', system=None, format=None):
+        self.requests.append({'prompt': prompt, 'format': format})
+        text = self.responses.pop(0)
+        for start in range(0, len(text), self.chunk_size):
+            yield {'response': text[start:start + self.chunk_size]}
+
+
+@pytest.fixture
+def generator():
+    rag_system = pytest.importorskip("mpd_rag_system")
+    # Solo i metodi di generazione strutturata: niente collection né client Ollama
+    rag = rag_system.InstagramPromptGenerator.__new__(rag_system.InstagramPromptGenerator)
+    rag.post_generation_model = "fake-model"
+    return rag
+
+
+def test_invalid_section_is_regenerated_alone(generator):
+    first = dict(VALID_SECTIONS, brand_values="Too short")
+    second = {key: VALID_SECTIONS[key] for key in SECTION_KEYS[1:]}
+    llm = generator.stream_llm = FakeStreamingLLM([as_json(first), as_json(second)])
+
+    events = list(generator.stream_structured_post("PROMPT", max_retries=2))
+    result = events[-1]['result']
+
+    assert [(event['section'], bool(event['error'])) for event in events if event['stage'] == 'section'][:2] == [
+        ('title', False), ('brand_values', True)]
+    assert [event for event in events if event['stage'] == 'retry'] == [
+        {'stage': 'retry', 'attempt': 1, 'sections': SECTION_KEYS[1:]}]
+
+    # Il secondo tentativo chiede solo le sezioni mancanti, con quelle accettate come contesto
+    assert len(llm.requests) == 2
+    assert llm.requests[1]['format']['required'] == SECTION_KEYS[1:]
+    assert VALID_SECTIONS['title'] in llm.requests[1]['prompt']
+    assert "(previous attempt too short" in llm.requests[1]['prompt']
+
+    assert result['errors'] == {}
+    assert result['attempts'] == 2
+    assert result['regenerated'] == SECTION_KEYS[1:]
+    assert result['text'] == render_post(VALID_SECTIONS)
+
+
+def test_sections_still_invalid_after_retries_are_reported(generator):
+    broken = as_json(dict(VALID_SECTIONS, closing="Bye"))
+    generator.stream_llm = FakeStreamingLLM([broken, as_json({'closing': "Bye"})])
+
+    result = list(generator.stream_structured_post("PROMPT", max_retries=1))[-1]['result']
+
+    assert result['attempts'] == 2
+    assert list(result['errors']) == ['closing']
+    assert result['errors']['closing'].startswith("too short")
+    assert result['sections']['closing'] == ''
+    assert result['text'] == render_post({key: VALID_SECTIONS[key] for key in SECTION_KEYS[:-1]})
+
+
+def test_malformed_response_marks_sections_missing(generator):
+    generator.stream_llm = FakeStreamingLLM(["I cannot answer in JSON, sorry."])
+
+    result = list(generator.stream_structured_post("PROMPT", max_retries=0))[-1]['result']
+
+    assert result['errors'] == {key: "missing" for key in SECTION_KEYS}
+    assert result['text'] == ''
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test dello scheduler delle chiamate LLM (mpd_scheduler.py)
+Le chiamate a Ollama sono sostituite da una funzione finta: nessuna rete
+"""
+
+import threading
+import time
+
+import pytest
+
+from mpd_scheduler import LLMScheduler, Priority, SchedulerOverloaded, parse_limits, scheduler_priority
+
+DEPTHS = {Priority.INTERACTIVE: 10, Priority.BATCH: 10, Priority.BACKGROUND: 10}
+
+
+def make_scheduler(**kwargs) -> LLMScheduler:
+    options = dict(max_concurrency=1, operation_limits={}, max_queue_depth=dict(DEPTHS), max_queue_wait=5)
+    options.update(kwargs)
+    return LLMScheduler(**options)
+
+
+def wait_until(predicate, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.005)
+
+
+class FakeLLM:
+    """
+    Sostituisce la chiamata a Ollama: registra l'ordine di esecuzione e gli errori dello scheduler
+    """
+
+    def __init__(self, scheduler: LLMScheduler):
+        self.scheduler = scheduler
+        self.calls = []
+        self.errors = {}
+        self.threads = []
+
+    def __call__(self, name: str, operation: str = "prompt", priority: Priority = Priority.INTERACTIVE):
+        try:
+            with self.scheduler.slot(operation, priority):
+                self.calls.append(name)
+        except SchedulerOverloaded as e:
+            self.errors[name] = str(e)
+
+    def start(self, name: str, operation: str = "prompt", priority: Priority = Priority.INTERACTIVE):
+        thread = threading.Thread(target=self, args=(name, operation, priority), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return thread
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(timeout=2)
+            assert not thread.is_alive()
+
+
+def waiting(scheduler: LLMScheduler, priority: Priority) -> int:
+    return scheduler.stats()['waiting'][priority.name.lower()]
+
+
+def test_parse_limits():
+    assert parse_limits("analysis=2, prompt=3,invalid,") == {'analysis': 2, 'prompt': 3}
+    assert parse_limits("") == {}
+
+
+def test_interactive_work_is_served_before_queued_batch_work():
+    scheduler = make_scheduler()
+    llm = FakeLLM(scheduler)
+
+    with scheduler.slot("prompt", Priority.INTERACTIVE):
+        llm.start("background", priority=Priority.BACKGROUND)
+        wait_until(lambda: waiting(scheduler, Priority.BACKGROUND) == 1)
+        llm.start("batch", priority=Priority.BATCH)
+        wait_until(lambda: waiting(scheduler, Priority.BATCH) == 1)
+        llm.start("interactive", priority=Priority.INTERACTIVE)
+        wait_until(lambda: waiting(scheduler, Priority.INTERACTIVE) == 1)
+        assert llm.calls == []
+
+    llm.join()
+    assert llm.calls == ["interactive", "batch", "background"]
+    assert llm.errors == {}
+
+
+def test_same_priority_is_first_come_first_served():
+    scheduler = make_scheduler()
+    llm = FakeLLM(scheduler)
+
+    with scheduler.slot("prompt"):
+        for index in range(3):
+            llm.start(f"call-{index}")
+            wait_until(lambda: waiting(scheduler, Priority.INTERACTIVE) == index + 1)
+
+    llm.join()
+    assert llm.calls == ["call-0", "call-1", "call-2"]
+
+
+def test_priority_comes_from_context():
+    scheduler = make_scheduler()
+    with scheduler_priority(Priority.BATCH):
+        with scheduler.slot("analysis") as ticket:
+            assert ticket.priority == Priority.BATCH
+    with scheduler.slot("analysis") as ticket:
+        assert ticket.priority == Priority.INTERACTIVE
+
+
+def test_operation_limit_does_not_block_other_operations():
+    scheduler = make_scheduler(max_concurrency=4, operation_limits={'analysis': 1})
+    llm = FakeLLM(scheduler)
+
+    with scheduler.slot("analysis"):
+        llm.start("second-analysis", operation="analysis")
+        wait_until(lambda: waiting(scheduler, Priority.INTERACTIVE) == 1)
+
+        # Un'operazione senza limite passa anche se l'analisi successiva è ancora in coda
+        llm("prompt", operation="prompt")
+        assert llm.calls == ["prompt"]
+        assert scheduler.stats()['running'] == {'analysis': 1, 'prompt': 0}
+
+    llm.join()
+    assert llm.calls == ["prompt", "second-analysis"]
+
+
+def test_global_concurrency_limit():
+    scheduler = make_scheduler(max_concurrency=2)
+    llm = FakeLLM(scheduler)
+
+    with scheduler.slot("prompt"), scheduler.slot("post"):
+        llm.start("third", operation="analysis")
+        wait_until(lambda: waiting(scheduler, Priority.INTERACTIVE) == 1)
+        assert scheduler.stats()['running_total'] == 2
+
+    llm.join()
+    assert llm.calls == ["third"]
+    assert scheduler.stats()['completed'] == 3
+
+
+def test_full_queue_sheds_lower_priority_work():
+    depths = {Priority.INTERACTIVE: 2, Priority.BATCH: 1, Priority.BACKGROUND: 1}
+    scheduler = make_scheduler(max_queue_depth=depths)
+    llm = FakeLLM(scheduler)
+
+    with scheduler.slot("prompt"):
+        llm.start("batch", priority=Priority.BATCH)
+        wait_until(lambda: waiting(scheduler, Priority.BATCH) == 1)
+
+        # La coda batch è piena e non c'è lavoro meno importante da scartare
+        llm("batch-rejected", priority=Priority.BATCH)
+        assert "queue full" in llm.errors["batch-rejected"]
+
+        llm.start("interactive-1")
+        wait_until(lambda: waiting(scheduler, Priority.INTERACTIVE) == 1)
+
+        # Coda interattiva piena: viene scartato il batch in attesa
+        llm.start("interactive-2")
+        wait_until(lambda: "batch" in llm.errors)
+        assert "shed" in llm.errors["batch"]
+        assert waiting(scheduler, Priority.BATCH) == 0
+
+    llm.join()
+    assert llm.calls == ["interactive-1", "interactive-2"]
+    stats = scheduler.stats()
+    assert stats['rejected'] == 1
+    assert stats['shed'] == 1
+
+
+def test_interactive_work_is_rejected_when_nothing_can_be_shed():
+    depths = {Priority.INTERACTIVE: 1, Priority.BATCH: 1, Priority.BACKGROUND: 1}
+    scheduler = make_scheduler(max_queue_depth=depths)
+    llm = FakeLLM(scheduler)
+
+    with scheduler.slot("prompt"):
+        llm.start("queued")
+        wait_until(lambda: waiting(scheduler, Priority.INTERACTIVE) == 1)
+        with pytest.raises(SchedulerOverloaded, match="rejected"):
+            with scheduler.slot("prompt"):
+                pass
+
+    llm.join()
+    assert llm.calls == ["queued"]
+
+
+def test_queue_timeout_rejects_waiting_request():
+    scheduler = make_scheduler(max_queue_wait=0.05)
+
+    with scheduler.slot("prompt"):
+        started = time.monotonic()
+        with pytest.raises(SchedulerOverloaded, match="waited more than"):
+            with scheduler.slot("prompt"):
+                pass
+        assert time.monotonic() - started >= 0.05
+
+    stats = scheduler.stats()
+    assert stats['timed_out'] == 1
+    assert stats['running_total'] == 0
+    assert waiting(scheduler, Priority.INTERACTIVE) == 0
+
+    # Il ticket scaduto non occupa lo slot: la chiamata successiva passa
+    with scheduler.slot("prompt") as ticket:
+        assert ticket.granted